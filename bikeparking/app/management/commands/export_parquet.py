@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.utils.parquet_export import LedgerExporter
+
+
+class Command(BaseCommand):
+    help = 'Append new ticket, history and economics rows to the month-partitioned Parquet export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', action='append', choices=['tickets', 'parking_history', 'economics'],
+                            help='Only export this table (repeatable)')
+        parser.add_argument('--out', help='Export directory (default: settings.ANALYTICS_EXPORT_DIR)')
+
+    def handle(self, *args, **options):
+        try:
+            exporter = LedgerExporter(options['out'])
+            exported = exporter.run(options['table'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        for table, rows in exported.items():
+            self.stdout.write(f'{table}: {rows} rows')
+        self.stdout.write(self.style.SUCCESS(f'Export written to {exporter.out_dir}'))
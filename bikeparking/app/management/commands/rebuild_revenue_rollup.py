@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from app.models import RevenueDailyRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily revenue rollup from the economics ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', help='Last day to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        dates = {}
+        for option in ('date_from', 'date_to'):
+            if options[option]:
+                dates[option] = parse_date(options[option])
+                if dates[option] is None:
+                    raise CommandError(f'Invalid date: {options[option]}')
+
+        buckets = RevenueDailyRollup.rebuild(**dates)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {buckets} rollup buckets'))
@@ -0,0 +1,67 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError, InterfaceError
+from app.utils.gate_events import process_manual_entry, process_manual_exit
+from app.utils.gate_queue import GateQueue
+
+
+class Command(BaseCommand):
+    help = 'Replay gate events queued on this host while the database was unreachable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--batch', type=int, default=100, help='Events replayed per batch')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when idle or the database is down')
+
+    def handle(self, *args, **options):
+        queue = GateQueue()
+        self.stdout.write(f'Replaying gate queue {queue.path}')
+        while True:
+            try:
+                replayed = self.replay(queue, options['batch'])
+            except (OperationalError, InterfaceError) as e:
+                self.stdout.write(self.style.WARNING(f'Database still unavailable: {e}'))
+                connection.close()
+                replayed = 0
+
+            if not replayed:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+    def replay(self, queue, batch):
+        events = queue.pending(batch)
+        if not events:
+            queue.purge_replayed()
+            return 0
+
+        users = get_user_model().objects.in_bulk({event['user_id'] for event in events if event['user_id']})
+
+        # Each event goes through the same single-event path as the manual
+        # entry page, in the order it was recorded. A database error
+        # propagates before the event is marked, so it is retried
+        for event in events:
+            user = users.get(event['user_id'])
+            label = f"{event['action']} {event['vehicle_number']} ({event['event_id']})"
+            try:
+                if event['action'] == 'entry':
+                    result = process_manual_entry(
+                        event['vehicle_number'], event.get('booking_id', ''), user,
+                        event['timestamp'], event_id=event['event_id'],
+                    )
+                else:
+                    result = process_manual_exit(
+                        event['vehicle_number'], user, event['timestamp'], event_id=event['event_id'],
+                    )
+            except ValueError as e:
+                self.stdout.write(self.style.WARNING(f'Rejected {label}: {e}'))
+            else:
+                if result.get('duplicate'):
+                    self.stdout.write(f'Already recorded {label}')
+                else:
+                    self.stdout.write(f'Recorded {label}')
+            queue.mark_replayed([event['seq']])
+
+        return len(events)
@@ -0,0 +1,59 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from app.models import Ticket, UserMembership
+from app.utils.pricing import Tariff, from_cents, get_tariff, to_cents
+
+
+class Command(BaseCommand):
+    help = 'Re-price exited tickets under the current or a what-if tariff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='First exit date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', help='Last exit date (YYYY-MM-DD)')
+        parser.add_argument('--tariff', help='JSON file of PARKING_TARIFF overrides to price with')
+        parser.add_argument('--apply', action='store_true', help='Save the new fees instead of only reporting')
+
+    def handle(self, *args, **options):
+        tariff = get_tariff()
+        if options['tariff']:
+            with open(options['tariff']) as f:
+                tariff = Tariff.from_settings(**json.load(f))
+
+        tickets = Ticket.objects.filter(exit_time__isnull=False)
+        for option, lookup in (('date_from', 'exit_time__date__gte'), ('date_to', 'exit_time__date__lte')):
+            if options[option]:
+                day = parse_date(options[option])
+                if day is None:
+                    raise CommandError(f'Invalid date: {options[option]}')
+                tickets = tickets.filter(**{lookup: day})
+
+        rows = list(tickets.values_list('id', 'entry_time', 'exit_time', 'fee_amount', 'booking__user_id'))
+        if not rows:
+            self.stdout.write('No exited tickets in range')
+            return
+        ids, entries, exits, current, user_ids = zip(*rows)
+        members = UserMembership.active_user_ids({user_id for user_id in user_ids if user_id})
+
+        started = time.perf_counter()
+        fees = tariff.quote_batch(entries, exits, [user_id in members for user_id in user_ids])
+        elapsed = time.perf_counter() - started
+
+        current_total = sum(to_cents(fee) for fee in current)
+        changed = [
+            (ticket_id, cents) for ticket_id, cents, fee in zip(ids, fees, current) if int(cents) != to_cents(fee)
+        ]
+        self.stdout.write(f'Priced {len(rows)} tickets in {elapsed * 1000:.1f} ms')
+        self.stdout.write(f'Current total: PKR {from_cents(current_total)}')
+        self.stdout.write(f'Repriced total: PKR {from_cents(int(fees.sum()))}')
+        self.stdout.write(f'Tickets with a different fee: {len(changed)}')
+
+        if options['apply'] and changed:
+            Ticket.objects.bulk_update(
+                [Ticket(id=ticket_id, fee_amount=from_cents(cents)) for ticket_id, cents in changed],
+                ['fee_amount'],
+                batch_size=1000
+            )
+            self.stdout.write(self.style.SUCCESS(f'Updated {len(changed)} tickets'))
@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app.models import Booking, IdempotencyKey
+from app.utils.deadlines import DeadlineQueue
+
+
+class Command(BaseCommand):
+    help = 'Expire bookings exactly when their grace period or booked window ends'
+
+    LOOKBACK = timedelta(minutes=1)
+    PURGE_INTERVAL = timedelta(minutes=10)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=5.0,
+                            help='Seconds between checks for newly created bookings')
+
+    def handle(self, *args, **options):
+        self.queue = DeadlineQueue()
+        self.loaded_until = None
+        self.purged_at = timezone.now()
+        poll = timedelta(seconds=options['poll'])
+
+        # Rebuild the deadline queue from the database after a restart
+        self.load_bookings()
+        self.stdout.write(f'Booking scheduler started with {len(self.queue)} deadlines')
+
+        while True:
+            now = timezone.now()
+            due = self.queue.pop_due(now)
+            if due:
+                self.run_transitions(due, now)
+
+            next_due = self.queue.next_due()
+            wake_at = now + poll if next_due is None else min(next_due, now + poll)
+            time.sleep(max((wake_at - timezone.now()).total_seconds(), 0))
+
+            self.load_bookings()
+
+            if timezone.now() - self.purged_at >= self.PURGE_INTERVAL:
+                # Booking idempotency keys past their TTL
+                IdempotencyKey.purge_expired()
+                self.purged_at = timezone.now()
+
+    def load_bookings(self):
+        """Schedule deadlines for bookings created or edited since the last load.
+
+        The first load reads every open booking; later loads pick up rows
+        whose ``updated_at`` is past the previous load, less ``LOOKBACK`` so
+        bookings committed late are not missed. Scheduling replaces the
+        earlier deadline of an edited booking and is a no-op when it is
+        unchanged. Queryset updates that move ``start_time`` or ``end_time``
+        must set ``updated_at`` themselves.
+        """
+        started = timezone.now()
+        bookings = Booking.objects.filter(status__in=['confirmed', 'active'])
+        if self.loaded_until:
+            bookings = bookings.filter(updated_at__gte=self.loaded_until - self.LOOKBACK)
+
+        for booking in bookings.only('id', 'start_time', 'end_time').iterator(chunk_size=1000):
+            self.queue.schedule(booking.id, 'grace', booking.grace_deadline())
+            if booking.end_time:
+                self.queue.schedule(booking.id, 'end', booking.end_time)
+
+        self.loaded_until = started
+
+    def run_transitions(self, due, now):
+        """Apply each kind of due transition as one batched update.
+
+        Bookings that arrived, exited or were cancelled since they were
+        scheduled no longer match the update filters, so stale deadlines
+        are harmless no-ops.
+        """
+        if 'grace' in due:
+            expired = Booking.expire_overdue(now=now, ids=due['grace'])
+            if expired:
+                self.stdout.write(f'{expired} unarrived bookings expired')
+        if 'end' in due:
+            expired = Booking.expire_ended(now=now, ids=due['end'])
+            if expired:
+                self.stdout.write(f'{expired} ended bookings expired')
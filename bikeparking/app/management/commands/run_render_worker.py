@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app.models import RenderJob
+
+
+class Command(BaseCommand):
+    help = 'Render queued booking slips and QR codes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--batch', type=int, default=20, help='Jobs claimed per poll')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Render worker started')
+        while True:
+            jobs = RenderJob.claim(options['batch'])
+            for job in jobs:
+                if job.run():
+                    self.stdout.write(f'Rendered {job}')
+                else:
+                    self.stdout.write(self.style.WARNING(f'{job}: {job.last_error}'))
+
+            if not jobs:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app.utils.stripe_events import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Apply received Stripe webhook events in order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--batch', type=int, default=50, help='Events applied per poll')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Stripe event worker started')
+        while True:
+            events = process_pending_events(options['batch'])
+            for event in events:
+                if event.status == 'done':
+                    self.stdout.write(f'Applied {event}')
+                else:
+                    self.stdout.write(self.style.WARNING(f'{event}: {event.last_error}'))
+
+            # A pending event at the end of the batch failed and will be retried
+            if not events or events[-1].status == 'pending':
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -2,7 +2,7 @@
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.utils import timezone
-from app.models import UserMembership
+from app.utils.membership_cache import get_membership
 class SubscriptionCheckMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -16,18 +16,14 @@ class SubscriptionCheckMiddleware:
         if request.path.startswith('/create-payment-intent/') or \
            'subscribe' in request.path.lower():
             
-            try:
-                membership = request.user.membership
-                
-                if not membership.can_subscribe_again:
-                    messages.error(
-                        request, 
-                        "You already have an active subscription. You can subscribe again 7 days before your current subscription ends."
-                    )
-                    return redirect('home')
-                    
-            except UserMembership.DoesNotExist:
-                # User has no membership yet, allow subscription
-                pass
+            membership = get_membership(request.user.pk)
+            
+            # Users with no membership yet may subscribe
+            if membership is not None and not membership.can_subscribe_again:
+                messages.error(
+                    request, 
+                    "You already have an active subscription. You can subscribe again 7 days before your current subscription ends."
+                )
+                return redirect('home')
         
         return self.get_response(request)
\ No newline at end of file
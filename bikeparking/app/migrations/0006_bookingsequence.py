@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:29
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    """Start each year's counter after the highest booking_id already issued"""
+    Booking = apps.get_model('app', 'Booking')
+    BookingSequence = apps.get_model('app', 'BookingSequence')
+
+    last_values = {}
+    for booking_id in Booking.objects.exclude(booking_id='').values_list('booking_id', flat=True):
+        parts = booking_id.split('-')
+        if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+            continue
+        year, number = int(parts[1]), int(parts[2])
+        last_values[year] = max(last_values.get(year, 0), number)
+
+    BookingSequence.objects.bulk_create([
+        BookingSequence(year=year, last_value=last_value)
+        for year, last_value in last_values.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_add_user_to_economicsreport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(unique=True)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Booking Sequence',
+                'verbose_name_plural': 'Booking Sequences',
+            },
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
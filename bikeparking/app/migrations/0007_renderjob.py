@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:30
+
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    """Rows created before the render queue already have their files"""
+    Booking = apps.get_model('app', 'Booking')
+    Ticket = apps.get_model('app', 'Ticket')
+    Booking.objects.exclude(booking_slip='').update(artifact_status='ready')
+    Ticket.objects.exclude(qr_code='').update(artifact_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_bookingsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='artifact_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='artifact_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='RenderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('booking', 'Booking QR Code and Slip'), ('ticket', 'Ticket QR Code')], max_length=10)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='app_renderj_status_d6c285_idx')],
+            },
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:38
+
+import re
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def backfill_plate_keys(apps, schema_editor):
+    """Fill plate_key in primary-key batches so no single statement locks a whole table"""
+    for model_name in ('Booking', 'Ticket', 'ParkingHistory', 'EconomicsReport'):
+        Model = apps.get_model('app', model_name)
+        last_pk = 0
+        while True:
+            batch = list(
+                Model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'vehicle_number')[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            for obj in batch:
+                # Same rule as app.models.normalize_plate
+                obj.plate_key = re.sub(r'\s+', '', obj.vehicle_number or '').upper()
+            Model.objects.bulk_update(batch, ['plate_key'])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    # Each backfill batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('app', '0009_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='plate_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='economicsreport',
+            name='plate_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='parkinghistory',
+            name='plate_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='plate_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+        migrations.RunPython(backfill_plate_keys, migrations.RunPython.noop),
+    ]
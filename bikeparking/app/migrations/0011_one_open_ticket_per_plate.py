@@ -0,0 +1,61 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+from app.utils.pricing import Tariff
+
+
+def close_duplicate_open_tickets(apps, schema_editor):
+    """Close older open tickets for a plate at the entry time of the next one.
+
+    A vehicle can't be parked twice, so the earlier ticket was abandoned by
+    the time the later entry was recorded. It's closed the way an exit
+    closes it: priced at the standard rate, its booking completed and its
+    slot freed unless an open ticket still holds it. ``closed_at`` doesn't
+    exist yet; 0019 backfills it from ``exit_time``.
+    """
+    Ticket = apps.get_model('app', 'Ticket')
+    Booking = apps.get_model('app', 'Booking')
+    ParkingSlot = apps.get_model('app', 'ParkingSlot')
+    tariff = Tariff.from_settings()
+    duplicated = (
+        Ticket.objects.filter(exit_time__isnull=True)
+        .values('plate_key')
+        .annotate(open_count=Count('id'))
+        .filter(open_count__gt=1)
+        .values_list('plate_key', flat=True)
+    )
+    slot_ids = set()
+    for plate_key in duplicated:
+        tickets = list(
+            Ticket.objects.filter(plate_key=plate_key, exit_time__isnull=True).order_by('entry_time', 'id')
+        )
+        for ticket, newer in zip(tickets, tickets[1:]):
+            Ticket.objects.filter(pk=ticket.pk).update(
+                exit_time=newer.entry_time,
+                duration=newer.entry_time - ticket.entry_time,
+                fee_amount=tariff.quote(ticket.entry_time, newer.entry_time),
+            )
+            if ticket.booking_id:
+                Booking.objects.filter(pk=ticket.booking_id).update(status='completed')
+            if ticket.slot_id:
+                slot_ids.add(ticket.slot_id)
+
+    held = Ticket.objects.filter(slot_id__in=slot_ids, exit_time__isnull=True).values_list('slot_id', flat=True)
+    ParkingSlot.objects.filter(pk__in=slot_ids - set(held)).update(is_occupied=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_plate_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_tickets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ticket',
+            constraint=models.UniqueConstraint(condition=models.Q(('exit_time__isnull', True)), fields=('plate_key',), name='one_open_ticket_per_plate'),
+        ),
+    ]
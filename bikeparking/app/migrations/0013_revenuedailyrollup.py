@@ -0,0 +1,55 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:47
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollup(apps, schema_editor):
+    """Seed the rollup from the existing ledger"""
+    EconomicsReport = apps.get_model('app', 'EconomicsReport')
+    RevenueDailyRollup = apps.get_model('app', 'RevenueDailyRollup')
+    rows = (
+        EconomicsReport.objects.annotate(day=TruncDate('transaction_date'))
+        .values('day', 'transaction_type', 'payment_method', 'is_paid')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    RevenueDailyRollup.objects.bulk_create([
+        RevenueDailyRollup(
+            date=row['day'],
+            transaction_type=row['transaction_type'],
+            payment_method=row['payment_method'],
+            is_paid=row['is_paid'],
+            total_amount=row['total'],
+            transaction_count=row['count'],
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_gate_event_receipts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('transaction_type', models.CharField(max_length=30)),
+                ('payment_method', models.CharField(max_length=20)),
+                ('is_paid', models.BooleanField()),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('transaction_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'transaction_type', 'payment_method', 'is_paid'), name='unique_revenue_rollup_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
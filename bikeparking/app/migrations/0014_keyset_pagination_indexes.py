@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-19 11:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_revenuedailyrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='app_booking_booked__6b29ec_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='parkinghistory',
+            name='app_parking_timesta_7514f4_idx',
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['booked_at', 'id'], name='app_booking_booked__e8c16c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='economicsreport',
+            index=models.Index(fields=['transaction_date', 'id'], name='app_economi_transac_e7270f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkinghistory',
+            index=models.Index(fields=['timestamp', 'id'], name='app_parking_timesta_544d4f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['entry_time', 'id'], name='app_ticket_entry_t_282240_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivitylog',
+            index=models.Index(fields=['timestamp', 'id'], name='app_useract_timesta_b3a46e_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-19 12:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotOccupancyTimeline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('initial_state', models.PositiveSmallIntegerField(choices=[(0, 'Free'), (1, 'Reserved'), (2, 'Occupied')], default=0)),
+                ('transitions', models.BinaryField(default=bytes)),
+                ('slot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timelines', to='app.parkingslot')),
+            ],
+            options={
+                'ordering': ['-date', 'slot'],
+                'constraints': [models.UniqueConstraint(fields=('slot', 'date'), name='unique_slot_timeline_day')],
+            },
+        ),
+    ]
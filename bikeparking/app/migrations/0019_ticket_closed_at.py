@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+def backfill_closed_at(apps, schema_editor):
+    """Tickets closed before the field existed count as recorded at their exit time"""
+    Ticket = apps.get_model('app', 'Ticket')
+    Ticket.objects.filter(exit_time__isnull=False).update(closed_at=models.F('exit_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_idempotency_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_closed_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_ticket_closed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermembership',
+            name='stripe_event_created',
+            field=models.DateTimeField(blank=True, help_text='When Stripe created the last subscription event applied here', null=True),
+        ),
+    ]
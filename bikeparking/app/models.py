@@ -1,5 +1,17 @@
-from django.db import models
+import hashlib
+import re
+import threading
+from functools import partial
+from array import array
+from collections import defaultdict
+from django.db import models, connection, connections, transaction, DEFAULT_DB_ALIAS, IntegrityError, InterfaceError, OperationalError
+from django.db.models import Exists, OuterRef, Subquery
+from django.db.models.functions import TruncDate
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files import File
+from django.core.files.storage import default_storage
+from .utils.pricing import get_tariff
 from io import BytesIO
 import qrcode
 from django.utils import timezone
@@ -8,17 +20,94 @@ from django.contrib.auth import get_user_model
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.utils import ImageReader
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 User = get_user_model()
-from datetime import timedelta
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
 
+ARTIFACT_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('ready', 'Ready'),
+    ('failed', 'Failed'),
+]
+
+
+def normalize_plate(vehicle_number):
+    """Canonical plate for lookups: whitespace removed, uppercased"""
+    return re.sub(r'\s+', '', vehicle_number or '').upper()
+
+class PlateKeyMixin:
+    """Keeps the indexed ``plate_key`` column in step with ``vehicle_number``.
+
+    Lookups go through ``plate_key=normalize_plate(...)`` instead of
+    ``vehicle_number__iexact`` so they can use a plain b-tree index.
+    """
+
+    def save(self, *args, **kwargs):
+        self.plate_key = normalize_plate(self.vehicle_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'vehicle_number' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'plate_key'}
+        super().save(*args, **kwargs)
+
+class RenderedArtifactsMixin:
+    """Lazily rendered, content-addressed QR code / slip files.
+
+    Files are stored under a hash of the values printed on them, so they are
+    rendered once on first request and reused until those values change.
+    Models list their file fields and extensions in ``ARTIFACT_FIELDS`` and
+    implement ``artifact_inputs()`` and ``render_artifacts()``.
+    """
+    ARTIFACT_FIELDS = {}
+
+    def artifact_key(self):
+        """Content hash of the values the artifacts are rendered from"""
+        raw = '|'.join(str(value) for value in self.artifact_inputs())
+        return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+    def artifact_name(self, field_name):
+        """Storage path for ``field_name`` under the current content hash"""
+        field = self._meta.get_field(field_name)
+        return field.generate_filename(self, f"{self.artifact_key()}{self.ARTIFACT_FIELDS[field_name]}")
+
+    def artifacts_current(self):
+        """True if every artifact is stored under the current content hash"""
+        if self.artifact_status != 'ready':
+            return False
+        for field_name in self.ARTIFACT_FIELDS:
+            name = getattr(self, field_name).name
+            if name != self.artifact_name(field_name) or not default_storage.exists(name):
+                return False
+        return True
+
+    def reuse_artifact(self, field_name):
+        """Point ``field_name`` at an already stored file for the same content"""
+        name = self.artifact_name(field_name)
+        if default_storage.exists(name):
+            getattr(self, field_name).name = name
+            return True
+        return False
+
+    def ensure_artifacts(self):
+        """Render missing or outdated artifacts and return an up-to-date instance"""
+        if self.artifacts_current():
+            return self
+        with transaction.atomic():
+            # Lock the row so concurrent first requests render only once
+            locked = type(self).objects.select_for_update().get(pk=self.pk)
+            if not locked.artifacts_current():
+                locked.render_artifacts()
+        return locked
 
 class GuestUser(models.Model):
     session_key = models.CharField(max_length=40)
     created_at = models.DateTimeField(auto_now_add=True)
 
 class ParkingSlot(models.Model):
+    # pg_advisory_xact_lock key serializing the pre-booking quota check
+    BOOKING_QUOTA_LOCK_ID = 0x626F6F6B
+
     slot_number = models.CharField(max_length=10, unique=True)
     is_occupied = models.BooleanField(default=False)
     is_reserved = models.BooleanField(default=False)
@@ -35,7 +124,24 @@ class ParkingSlot(models.Model):
     def clean(self):
         if self.is_occupied and self.is_reserved:
             raise ValidationError("Slot cannot be both occupied and reserved at the same time")
-    
+
+    @property
+    def state(self):
+        """Slot state as recorded in ``SlotOccupancyTimeline``"""
+        if self.is_occupied:
+            return SlotOccupancyTimeline.OCCUPIED
+        if self.is_reserved:
+            return SlotOccupancyTimeline.RESERVED
+        return SlotOccupancyTimeline.FREE
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Snapshot the state so saves only record real transitions
+        if {'is_occupied', 'is_reserved'} <= set(field_names):
+            instance._recorded_state = instance.state
+        return instance
+
     def release_slot(self):
         """Release the slot by marking it as available"""
         self.is_occupied = False
@@ -57,20 +163,73 @@ class ParkingSlot(models.Model):
         self.save()
         return True
 
-class Booking(models.Model):
+    @classmethod
+    def lock_free_slots(cls, limit=1, start_time=None, end_time=None):
+        """Lock and return up to ``limit`` free slots.
+
+        Must be called inside ``transaction.atomic()``. Rows already locked by
+        another transaction are skipped rather than waited on, so concurrent
+        bookers each get a different slot instead of queueing on one row.
+        When a time window is given, slots with a conflicting booking are
+        excluded as well.
+        """
+        slots = cls.objects.select_for_update(skip_locked=True).filter(
+            is_occupied=False,
+            is_reserved=False
+        )
+        if start_time and end_time:
+            slots = slots.exclude(Exists(Booking.objects.filter(
+                slot=OuterRef('pk'),
+                status__in=['confirmed', 'active'],
+                start_time__lt=end_time,
+                end_time__gt=start_time
+            )))
+        return list(slots.order_by('slot_number')[:limit])
+
+    @classmethod
+    def lock_booking_counts(cls):
+        """Hold the booking quota lock until the transaction ends and return fresh slot counts.
+
+        Must be called inside ``transaction.atomic()``. Slot rows are taken
+        with SKIP LOCKED, so concurrent bookers never wait on each other's
+        slots, but each would count the reserved slots before the others
+        commit and they could overshoot the pre-booking quota together.
+        This lock serializes only the count and the booking insert that
+        follows it. It is a PostgreSQL advisory lock; SQLite already allows
+        a single writer at a time.
+
+        Returns ``(total, occupied, reserved)`` as committed when the lock
+        was granted.
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [cls.BOOKING_QUOTA_LOCK_ID])
+        counts = cls.objects.aggregate(
+            total=models.Count('pk'),
+            occupied=models.Count('pk', filter=models.Q(is_occupied=True)),
+            reserved=models.Count('pk', filter=models.Q(is_reserved=True, is_occupied=False)),
+        )
+        return counts['total'], counts['occupied'], counts['reserved']
+
+class Booking(RenderedArtifactsMixin, PlateKeyMixin, models.Model):
     STATUS_CHOICES = [
         ('active', 'Active'),
         ('expired', 'Expired'),
         ('cancelled', 'Cancelled'),
         ('completed', 'Completed'),
     ]
+    # Minutes a confirmed booking holds its slot before the vehicle must arrive
+    EXPIRY_MINUTES = 15
+
     booking_id = models.CharField(max_length=20, unique=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     guest_id = models.CharField(max_length=36)  # For UUID storage
     slot = models.ForeignKey(ParkingSlot, on_delete=models.SET_NULL, null=True)
     vehicle_number = models.CharField(max_length=20)
+    plate_key = models.CharField(max_length=20, blank=True, editable=False, db_index=True)
     vehicle_arrived = models.BooleanField(default=False)  
     booked_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     start_time = models.DateTimeField()
     guest_email = models.EmailField(null=True, blank=True)
     guest_phone = models.CharField(max_length=20, null=True, blank=True)
@@ -78,6 +237,9 @@ class Booking(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
     qr_code = models.ImageField(upload_to='qr_codes/', blank=True)
     booking_slip = models.FileField(upload_to='booking_slips/', blank=True)
+    artifact_status = models.CharField(max_length=10, choices=ARTIFACT_STATUS_CHOICES, default='pending')
+
+    ARTIFACT_FIELDS = {'qr_code': '.png', 'booking_slip': '.pdf'}
 
     def confirm_booking(self):
         if self.slot and not self.slot.is_occupied and not self.slot.is_reserved:
@@ -92,6 +254,10 @@ class Booking(models.Model):
         ordering = ['-booked_at']
         verbose_name = 'Booking'
         verbose_name_plural = 'Bookings'
+        indexes = [
+            models.Index(fields=['booked_at', 'id']),
+            models.Index(fields=['updated_at']),
+        ]
     
     def __str__(self):
         return f"Booking #{self.id} - {self.vehicle_number} ({self.get_status_display()})"
@@ -100,18 +266,68 @@ class Booking(models.Model):
         now = timezone.now()
         return self.start_time <= now <= self.end_time and self.status == 'confirmed'
     
-    def save(self, *args, **kwargs):
-        # Update slot status when booking is confirmed
-        if self.status == 'confirmed':
-            self.slot.is_reserved = True
-            self.slot.save()
-        super().save(*args, **kwargs)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Snapshot loaded values so status changes are detected without a query
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def releases_reservation(self):
+        """True if this save moves a confirmed booking off its reserved slot"""
+        original = getattr(self, '_loaded_values', None)
+        return bool(
+            self.slot_id
+            and original
+            and original.get('status') == 'confirmed'
+            and self.status in ('cancelled', 'expired', 'completed')
+        )
+
+    def grace_deadline(self):
+        """When an unarrived confirmed booking stops holding its slot"""
+        return self.start_time + timedelta(minutes=self.EXPIRY_MINUTES)
+
+    @classmethod
+    def expire_overdue(cls, now=None, ids=None):
+        """Expire confirmed bookings whose vehicle never arrived in time.
+
+        Runs as two set-based UPDATEs in one transaction (release the slots,
+        then expire the bookings) instead of saving each row. ``ids`` limits
+        the sweep to bookings the scheduler knows are due. Returns the
+        number of bookings expired.
+        """
+        now = now or timezone.now()
+        overdue = cls.objects.filter(
+            status='confirmed',
+            start_time__lte=now - timedelta(minutes=cls.EXPIRY_MINUTES),
+            vehicle_arrived=False
+        )
+        if ids is not None:
+            overdue = overdue.filter(id__in=ids)
+        with transaction.atomic():
+            slot_ids = list(overdue.exclude(slot=None).values_list('slot_id', flat=True))
+            ParkingSlot.objects.filter(id__in=slot_ids).update(is_reserved=False)
+            SlotOccupancyTimeline.record_slots(slot_ids, now)
+            return overdue.update(status='expired')
+
+    @classmethod
+    def expire_ended(cls, now=None, ids=None):
+        """Expire arrived bookings whose booked window is over.
+
+        The vehicle is still parked, so the slot stays occupied until exit.
+        Returns the number of bookings expired.
+        """
+        now = now or timezone.now()
+        ended = cls.objects.filter(status='active', end_time__lte=now)
+        if ids is not None:
+            ended = ended.filter(id__in=ids)
+        return ended.update(status='expired')
 
     @classmethod
     def find_active_booking_for_vehicle(cls, vehicle_number):
         """Find active booking for a vehicle number"""
         return cls.objects.filter(
-            vehicle_number__iexact=vehicle_number.strip(),
+            plate_key=normalize_plate(vehicle_number),
             status__in=['confirmed', 'active']
         ).first()
     
@@ -130,7 +346,7 @@ class Booking(models.Model):
         buffer = BytesIO()
         img.save(buffer, format='PNG')
         
-        filename = f'booking_{self.id}_qr.png'
+        filename = f'{self.artifact_key()}.png'
         self.qr_code.save(filename, File(buffer), save=False)
         buffer.close()
     
@@ -178,7 +394,7 @@ class Booking(models.Model):
             pdf.save()
 
             # Save to model
-            filename = f'booking_{self.id}_slip.pdf'
+            filename = f'{self.artifact_key()}.pdf'
             self.booking_slip.save(filename, File(buffer), save=False)
 
         except Exception as e:
@@ -186,63 +402,60 @@ class Booking(models.Model):
         finally:
             buffer.close()
     
-    def check_status(self):
-        """Check and update booking status"""
-        now = timezone.now()
-
-        if self.status in ['cancelled', 'expired', 'completed']:
-            return self.status
-
-        if self.slot:
-            # Auto cancel if user didn't arrive within 30 minutes of start_time
-            grace_period = self.start_time + timedelta(minutes=30)
-            if not self.vehicle_arrived and now > grace_period:  # Use vehicle_arrived
-                self.status = 'cancelled'
-                self.slot.release_slot()
-                self.save()
-                return self.status
-
-            # Auto mark as completed if vehicle is parked during valid time
-            if self.vehicle_arrived and self.start_time <= now <= self.end_time:  # Use vehicle_arrived
-                self.status = 'completed'
-                self.save()
-                return self.status
-
-            # Mark as expired if booking time is over and slot was used
-            if now > self.end_time and self.slot.is_occupied:
-                self.status = 'expired'
-                self.slot.is_reserved = False
-                self.slot.save()
-                self.save()
-                return self.status
-
-            # Free the slot if time is over and never used
-            if now > self.end_time and not self.slot.is_occupied:
-                self.status = 'cancelled'
-                self.slot.release_slot()
-                self.save()
-                return self.status
-
-        return self.status
-
     def save(self, *args, **kwargs):
         is_new = not self.pk
 
         if is_new:
-            self.generate_qr_code()
-            self.generate_booking_slip()
-
             if not self.booking_id:
-                last = Booking.objects.order_by('-id').first()
-                next_id = last.id + 1 if last else 1
-                self.booking_id = f"BOOK-{timezone.now().year}-{next_id:04d}"
+                year = timezone.now().year
+                self.booking_id = f"BOOK-{year}-{BookingSequence.next_value(year):04d}"
 
             # Reserve slot
             if self.slot and not self.slot.is_occupied and not self.slot.is_reserved:
                 self.slot.is_reserved = True
                 self.slot.save()
 
-        super().save(*args, **kwargs)
+        if self.releases_reservation():
+            # Release the reservation in the same transaction as the status change
+            with transaction.atomic():
+                ParkingSlot.objects.filter(pk=self.slot_id).update(is_reserved=False)
+                SlotOccupancyTimeline.record_slots([self.slot_id])
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+        if is_new and settings.PRERENDER_ARTIFACTS:
+            # QR code and slip are rendered by the render worker after commit
+            RenderJob.enqueue('booking', self.pk)
+
+    def artifact_inputs(self):
+        return [
+            'booking',
+            self.id,
+            self.vehicle_number,
+            self.slot.slot_number if self.slot else '',
+            self.booked_at.isoformat() if self.booked_at else '',
+            self.start_time.isoformat() if self.start_time else '',
+            self.end_time.isoformat() if self.end_time else '',
+        ]
+
+    def render_artifacts(self):
+        """Render the QR code and booking slip and mark them ready"""
+        if not self.reuse_artifact('qr_code'):
+            self.generate_qr_code()
+        if not self.reuse_artifact('booking_slip'):
+            self.generate_booking_slip()
+        self.artifact_status = 'ready'
+        Booking.objects.filter(pk=self.pk).update(
+            qr_code=self.qr_code.name,
+            booking_slip=self.booking_slip.name,
+            artifact_status=self.artifact_status
+        )
     
     def cancel(self):
         """Cancel the booking"""
@@ -251,6 +464,124 @@ class Booking(models.Model):
             self.slot.release_slot()
         self.save()
 
+class BookingSequence(models.Model):
+    """Per-year counter backing the ``BOOK-YYYY-NNNN`` booking references"""
+    year = models.PositiveIntegerField(unique=True)
+    last_value = models.PositiveIntegerField(default=0)
+
+    # Values pre-allocated to this worker process, keyed by year
+    _blocks = {}
+    _blocks_lock = threading.Lock()
+
+    # Per-thread connection used to reserve values outside the caller's transaction
+    _local = threading.local()
+
+    class Meta:
+        verbose_name = 'Booking Sequence'
+        verbose_name_plural = 'Booking Sequences'
+
+    def __str__(self):
+        return f"{self.year}: {self.last_value}"
+
+    @classmethod
+    def _use_own_connection(cls):
+        # SQLite allows a single writer, so a second connection would wait on the caller
+        return connection.in_atomic_block and connection.vendor != 'sqlite'
+
+    @classmethod
+    def reserve(cls, year, count=1):
+        """Atomically reserve ``count`` consecutive values and return the first.
+
+        Inside a transaction the counter row is bumped by one autocommitted
+        ``UPDATE ... RETURNING`` on a separate connection, so its row lock is
+        released at once instead of being held until the caller's booking
+        commits and every other booker queueing behind it. The reservation
+        outlives a rollback of the caller, which just leaves a gap. On SQLite
+        the caller's connection and transaction are used.
+        """
+        if not cls._use_own_connection():
+            return cls._reserve_in_transaction(year, count)
+
+        own = getattr(cls._local, 'connection', None)
+        if own is None:
+            own = cls._local.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            return cls._reserve_on(own, year, count)
+        except (OperationalError, InterfaceError):
+            # The idle connection may have been dropped by the server; retry on a fresh one
+            own.close()
+            return cls._reserve_on(own, year, count)
+
+    @classmethod
+    def _reserve_on(cls, own, year, count):
+        table = own.ops.quote_name(cls._meta.db_table)
+        with own.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET last_value = last_value + %s WHERE year = %s RETURNING last_value",
+                [count, year]
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                return row[0] - count + 1
+            try:
+                cursor.execute(f"INSERT INTO {table} (year, last_value) VALUES (%s, %s)", [year, count])
+                return 1
+            except IntegrityError:
+                # Another worker created the row first
+                return cls._reserve_on(own, year, count)
+
+    @classmethod
+    def _reserve_in_transaction(cls, year, count):
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET last_value = last_value + %s "
+                    f"WHERE year = %s RETURNING last_value",
+                    [count, year]
+                )
+                row = cursor.fetchone()
+            if row is None:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(year=year, last_value=count)
+                    return 1
+                except IntegrityError:
+                    # Another worker created the row first
+                    return cls._reserve_in_transaction(year, count)
+        return row[0] - count + 1
+
+    @classmethod
+    def next_value(cls, year):
+        """Return the next booking number for ``year``.
+
+        With ``BOOKING_ID_BLOCK_SIZE`` > 1 each worker reserves a block of
+        numbers at a time and hands them out from memory. A block reserved
+        inside the caller's transaction (SQLite) is only cached once that
+        transaction commits, so a rolled-back booking can never cause a
+        number to be issued twice; unused numbers simply leave gaps.
+        """
+        block_size = settings.BOOKING_ID_BLOCK_SIZE
+
+        with cls._blocks_lock:
+            block = cls._blocks.get(year)
+            if block:
+                return block.pop(0)
+
+        own_connection = cls._use_own_connection()
+        first = cls.reserve(year, block_size)
+        if block_size > 1:
+            def cache_block():
+                with cls._blocks_lock:
+                    cls._blocks.setdefault(year, []).extend(
+                        range(first + 1, first + block_size)
+                    )
+            if own_connection:
+                cache_block()
+            else:
+                transaction.on_commit(cache_block)
+        return first
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone_number = models.CharField(max_length=15, blank=True, null=True)
@@ -269,21 +600,37 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
 
-class Ticket(models.Model):
+class Ticket(RenderedArtifactsMixin, PlateKeyMixin, models.Model):
     slot = models.ForeignKey(ParkingSlot, on_delete=models.SET_NULL, null=True, blank=True,related_name='tickets')
     booking = models.ForeignKey(Booking, on_delete=models.SET_NULL, null=True, blank=True)
     vehicle_number = models.CharField(max_length=20)
-    entry_time = models.DateTimeField(auto_now_add=True)
+    plate_key = models.CharField(max_length=20, blank=True, editable=False, db_index=True)
+    entry_time = models.DateTimeField(default=timezone.now)
     exit_time = models.DateTimeField(null=True, blank=True)
+    # When the exit was recorded; later than exit_time for exits replayed from the gate queue
+    closed_at = models.DateTimeField(null=True, blank=True, db_index=True)
     duration = models.DurationField(null=True, blank=True)
     fee_paid = models.BooleanField(default=False)
     fee_amount = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
     qr_code = models.ImageField(upload_to='ticket_qr/', blank=True)
+    artifact_status = models.CharField(max_length=10, choices=ARTIFACT_STATUS_CHOICES, default='pending')
+
+    ARTIFACT_FIELDS = {'qr_code': '.png'}
     
     class Meta:
         ordering = ['-entry_time']
         verbose_name = 'Ticket'
         verbose_name_plural = 'Tickets'
+        indexes = [
+            models.Index(fields=['entry_time', 'id']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['plate_key'],
+                condition=models.Q(exit_time__isnull=True),
+                name='one_open_ticket_per_plate',
+            ),
+        ]
     
     def __str__(self):
         return f"Ticket #{self.id} - {self.vehicle_number}"
@@ -301,34 +648,36 @@ class Ticket(models.Model):
         img = qr.make_image(fill_color="black", back_color="white")
         buffer = BytesIO()
         img.save(buffer, format='PNG')
-        filename = f'ticket_{self.id}_qr.png'
+        filename = f'{self.artifact_key()}.png'
         self.qr_code.save(filename, File(buffer), save=False)
         buffer.close()
-    
-    def save(self, *args, **kwargs):
-        if not self.pk:  # Only on creation
+
+    def artifact_inputs(self):
+        return ['ticket', self.id, self.vehicle_number]
+
+    def render_artifacts(self):
+        """Render the ticket QR code and mark it ready"""
+        if not self.reuse_artifact('qr_code'):
             self.generate_qr_code()
-        super().save(*args, **kwargs)
+        self.artifact_status = 'ready'
+        Ticket.objects.filter(pk=self.pk).update(
+            qr_code=self.qr_code.name,
+            artifact_status=self.artifact_status
+        )
     
     def calculate_fee(self):
-        """Calculate parking fee based on duration"""
+        """Calculate parking fee for the stay under the configured tariff"""
         if not self.exit_time:
-            return 0.00
-        
-        duration = self.exit_time - self.entry_time
-        hours = duration.total_seconds() / 3600
+            return Decimal('0.00')
         
-        # Basic pricing model - $2 for first hour, $1 for each additional hour
-        base_fee = 2.00  # First hour
-        additional_hours = max(0, hours - 1)
-        additional_fee = additional_hours * 1.00
-        
-        return round(base_fee + additional_fee, 2)
+        user_id = self.booking.user_id if self.booking else None
+        is_member = bool(user_id) and user_id in UserMembership.active_user_ids([user_id])
+        return get_tariff().quote(self.entry_time, self.exit_time, is_member=is_member)
     
     def save(self, *args, **kwargs):
-        # Generate QR code on creation
-        if not self.pk or not self.qr_code:
-            self.generate_qr_code()
+        is_new = not self.pk
+        if self.exit_time and not self.closed_at:
+            self.closed_at = timezone.now()
         
         # Calculate duration and fee when exiting
         if self.exit_time and not self.duration:
@@ -341,6 +690,10 @@ class Ticket(models.Model):
                 self.booking.save()
         
         super().save(*args, **kwargs)
+
+        if is_new and settings.PRERENDER_ARTIFACTS:
+            # QR code is rendered by the render worker after commit
+            RenderJob.enqueue('ticket', self.pk)
     
     def mark_exited(self):
         """Mark the ticket as exited with current time"""
@@ -348,7 +701,231 @@ class Ticket(models.Model):
             self.exit_time = timezone.now()
             self.save()
 
-class ParkingHistory(models.Model):
+class IdempotencyKey(models.Model):
+    """First response stored for a client-supplied ``Idempotency-Key``"""
+    TTL = timedelta(hours=24)
+    # How long a request may hold a key without finishing before a retry may take it over
+    LEASE = timedelta(seconds=30)
+
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # None while in progress
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+    @classmethod
+    def claim(cls, scope, key, request_hash):
+        """Return ``(record, created)``; ``created`` means the caller should run the request.
+
+        An in-progress record whose lease has run out (its worker died
+        mid-request) is taken over by the next retry with the same body.
+        Callers must compare ``request_hash`` when ``created`` is False.
+        """
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    scope=scope, key=key, request_hash=request_hash,
+                    locked_until=now + cls.LEASE, expires_at=now + cls.TTL
+                ), True
+        except IntegrityError:
+            record = cls.objects.filter(scope=scope, key=key).first()
+            if record is None:
+                # Purged or released between the insert and this read
+                return cls.claim(scope, key, request_hash)
+            if record.expires_at <= now:
+                record.delete()
+                return cls.claim(scope, key, request_hash)
+            if record.status_code is None and record.request_hash == request_hash:
+                taken = cls.objects.filter(
+                    models.Q(locked_until__lte=now) | models.Q(locked_until=None),
+                    pk=record.pk, status_code=None
+                ).update(locked_until=now + cls.LEASE)
+                if taken:
+                    return record, True
+            return record, False
+
+    @classmethod
+    def purge_expired(cls):
+        return cls.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+class GateEventReceipt(models.Model):
+    """Gate event IDs already applied, so replayed or retried events are skipped"""
+    event_id = models.CharField(max_length=64, unique=True)
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def record(cls, event_id):
+        """Store a receipt for ``event_id``; ``False`` if it was already applied.
+
+        Call inside the transaction that applies the event, so the receipt
+        only sticks if the event does.
+        """
+        try:
+            with transaction.atomic():
+                cls.objects.create(event_id=event_id)
+        except IntegrityError:
+            return False
+        return True
+
+    def __str__(self):
+        return self.event_id
+
+class RenderJob(models.Model):
+    """Queued QR code / booking slip pre-rendering, processed by ``run_render_worker``
+
+    Only used when ``PRERENDER_ARTIFACTS`` is enabled; otherwise artifacts
+    are rendered on first download.
+    """
+    KIND_CHOICES = [
+        ('booking', 'Booking QR Code and Slip'),
+        ('ticket', 'Ticket QR Code'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    MAX_ATTEMPTS = 3
+    STALE_AFTER = timedelta(minutes=5)
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.object_id} ({self.get_status_display()})"
+
+    @classmethod
+    def enqueue(cls, kind, object_id):
+        """Queue rendering in the caller's transaction; workers see it once committed"""
+        return cls.objects.create(kind=kind, object_id=object_id)
+
+    @classmethod
+    def claim(cls, limit=20):
+        """Claim up to ``limit`` pending jobs for this worker"""
+        now = timezone.now()
+
+        # Requeue jobs left running by a worker that died
+        cls.objects.filter(
+            status='running',
+            updated_at__lt=now - cls.STALE_AFTER
+        ).update(status='pending', updated_at=now)
+
+        with transaction.atomic():
+            jobs = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status='pending')
+                .order_by('created_at')[:limit]
+            )
+            cls.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status='running',
+                attempts=models.F('attempts') + 1,
+                updated_at=now
+            )
+        for job in jobs:
+            job.status = 'running'
+            job.attempts += 1
+        return jobs
+
+    def get_target(self):
+        if self.kind == 'booking':
+            return Booking.objects.select_related('slot').get(pk=self.object_id)
+        return Ticket.objects.get(pk=self.object_id)
+
+    def run(self):
+        """Render the artifacts for this job, retrying up to ``MAX_ATTEMPTS``"""
+        try:
+            self.get_target().render_artifacts()
+            self.status = 'done'
+            self.last_error = ''
+        except (Booking.DoesNotExist, Ticket.DoesNotExist):
+            self.status = 'failed'
+            self.last_error = 'Target no longer exists'
+        except Exception as e:
+            self.last_error = str(e)
+            if self.attempts < self.MAX_ATTEMPTS:
+                self.status = 'pending'
+            else:
+                self.status = 'failed'
+                target_model = Booking if self.kind == 'booking' else Ticket
+                target_model.objects.filter(pk=self.object_id).update(artifact_status='failed')
+        self.save(update_fields=['status', 'last_error', 'updated_at'])
+        return self.status == 'done'
+
+class StripeEvent(models.Model):
+    """Verified Stripe webhook event, stored on receipt and applied by ``run_stripe_worker``
+
+    ``event_id`` is Stripe's event ID, so redeliveries of an event already
+    received are dropped. ``payload`` is the event body exactly as Stripe
+    sent it.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    MAX_ATTEMPTS = 5
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created = models.DateTimeField(help_text="When Stripe created the event")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(fields=['status', 'created', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.get_status_display()})"
+
+    @classmethod
+    def record(cls, payload):
+        """Store a verified event body; returns ``(event, created)``, ``created`` False for a redelivery"""
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    event_id=payload['id'],
+                    event_type=payload['type'],
+                    payload=payload,
+                    created=datetime.fromtimestamp(payload['created'], tz=dt_timezone.utc),
+                ), True
+        except IntegrityError:
+            return cls.objects.get(event_id=payload['id']), False
+
+class ParkingHistory(PlateKeyMixin, models.Model):
     ACTION_CHOICES = [
         ('entered', 'Vehicle Entered'),
         ('exited', 'Vehicle Exited'),
@@ -357,8 +934,9 @@ class ParkingHistory(models.Model):
     ]
     
     vehicle_number = models.CharField(max_length=20)
+    plate_key = models.CharField(max_length=20, blank=True, editable=False, db_index=True)
     action = models.CharField(max_length=10, choices=ACTION_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     duration = models.DurationField(null=True, blank=True)
     is_prebooked = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -371,7 +949,7 @@ class ParkingHistory(models.Model):
         verbose_name_plural = 'Parking Histories'
         indexes = [
             models.Index(fields=['vehicle_number']),
-            models.Index(fields=['timestamp']),
+            models.Index(fields=['timestamp', 'id']),
         ]
     
     def __str__(self):
@@ -399,8 +977,9 @@ class ParkingHistory(models.Model):
             ticket=ticket
         )
     
-class EconomicsReport(models.Model):
+class EconomicsReport(PlateKeyMixin, models.Model):
     vehicle_number = models.CharField(max_length=20)
+    plate_key = models.CharField(max_length=20, blank=True, editable=False, db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2, default=20.00)
     transaction_type = models.CharField(max_length=20, choices=[
         ('entry_fee', 'Entry Fee'),
@@ -421,10 +1000,315 @@ class EconomicsReport(models.Model):
     
     class Meta:
         ordering = ['-transaction_date']
+        indexes = [
+            models.Index(fields=['transaction_date', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.vehicle_number} - PKR {self.amount} - {self.transaction_date.strftime('%Y-%m-%d %H:%M')}"
-    
+
+    ROLLUP_FIELDS = ('transaction_date', 'transaction_type', 'payment_method', 'is_paid', 'amount')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Snapshot the rollup bucket so edits can move the amount between buckets
+        if set(cls.ROLLUP_FIELDS) <= set(field_names):
+            instance._rollup_state = instance.rollup_state()
+        return instance
+
+    def rollup_state(self):
+        """``(bucket, amount)`` this record contributes to ``RevenueDailyRollup``"""
+        bucket = (
+            timezone.localdate(self.transaction_date),
+            self.transaction_type,
+            self.payment_method,
+            self.is_paid,
+        )
+        return bucket, Decimal(str(self.amount))
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = getattr(self, '_rollup_state', None)
+            if previous is None and self.pk:
+                previous = EconomicsReport.objects.get(pk=self.pk).rollup_state()
+            super().save(*args, **kwargs)
+
+            current = self.rollup_state()
+            if current != previous:
+                if previous:
+                    RevenueDailyRollup.add(*previous[0], amount=-previous[1], count=-1)
+                RevenueDailyRollup.add(*current[0], amount=current[1])
+        self._rollup_state = current
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            bucket, amount = self.rollup_state()
+            result = super().delete(*args, **kwargs)
+            RevenueDailyRollup.add(*bucket, amount=-amount, count=-1)
+        return result
+
+class RevenueDailyRollup(models.Model):
+    """Running EconomicsReport totals per local day, type, payment method and paid flag.
+
+    Kept in step by ``EconomicsReport.save``/``delete`` (and by bulk paths
+    through ``add_reports``) inside the same transaction, so dashboards can
+    sum a few rows instead of scanning the ledger. Queryset-level updates
+    bypass it; ``rebuild_revenue_rollup`` recomputes it from the ledger.
+    """
+    date = models.DateField()
+    transaction_type = models.CharField(max_length=30)
+    payment_method = models.CharField(max_length=20)
+    is_paid = models.BooleanField()
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'transaction_type', 'payment_method', 'is_paid'],
+                name='unique_revenue_rollup_bucket',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.transaction_type}/{self.payment_method} - PKR {self.total_amount} ({self.transaction_count})"
+
+    @classmethod
+    def add(cls, date, transaction_type, payment_method, is_paid, amount, count=1):
+        """Add ``amount``/``count`` to a bucket, creating its row on first use"""
+        bucket = dict(date=date, transaction_type=transaction_type, payment_method=payment_method, is_paid=is_paid)
+        delta = dict(
+            total_amount=models.F('total_amount') + amount,
+            transaction_count=models.F('transaction_count') + count,
+        )
+        if cls.objects.filter(**bucket).update(**delta):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(**bucket, total_amount=amount, transaction_count=count)
+        except IntegrityError:
+            # Another transaction created the row first
+            cls.objects.filter(**bucket).update(**delta)
+
+    @classmethod
+    def add_reports(cls, reports):
+        """Roll up reports saved without ``EconomicsReport.save`` (e.g. ``bulk_create``)"""
+        totals = {}
+        for report in reports:
+            bucket, amount = report.rollup_state()
+            total, count = totals.get(bucket, (Decimal('0'), 0))
+            totals[bucket] = (total + amount, count + 1)
+            report._rollup_state = (bucket, amount)
+        for bucket, (amount, count) in totals.items():
+            cls.add(*bucket, amount=amount, count=count)
+
+    @classmethod
+    def rebuild(cls, date_from=None, date_to=None):
+        """Recompute buckets in the date range (inclusive) from the ledger.
+
+        On PostgreSQL the ledger is locked against writes for the duration so
+        no insert is counted twice or missed. Returns the number of buckets.
+        """
+        reports = EconomicsReport.objects.all()
+        buckets = cls.objects.all()
+        if date_from:
+            reports = reports.filter(transaction_date__date__gte=date_from)
+            buckets = buckets.filter(date__gte=date_from)
+        if date_to:
+            reports = reports.filter(transaction_date__date__lte=date_to)
+            buckets = buckets.filter(date__lte=date_to)
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LOCK TABLE {connection.ops.quote_name(EconomicsReport._meta.db_table)} IN SHARE MODE")
+            buckets.delete()
+            rows = (
+                reports.annotate(day=TruncDate('transaction_date'))
+                .values('day', 'transaction_type', 'payment_method', 'is_paid')
+                .annotate(total=models.Sum('amount'), count=models.Count('id'))
+                .order_by()
+            )
+            return len(cls.objects.bulk_create([
+                cls(
+                    date=row['day'],
+                    transaction_type=row['transaction_type'],
+                    payment_method=row['payment_method'],
+                    is_paid=row['is_paid'],
+                    total_amount=row['total'],
+                    transaction_count=row['count'],
+                )
+                for row in rows
+            ]))
+
+    @classmethod
+    def totals(cls, **filters):
+        """``{'total': Decimal, 'count': int}`` over the matching buckets"""
+        result = cls.objects.filter(**filters).aggregate(
+            total=models.Sum('total_amount'),
+            count=models.Sum('transaction_count'),
+        )
+        return {'total': result['total'] or 0, 'count': result['count'] or 0}
+
+class SlotOccupancyTimeline(models.Model):
+    """Run-length encoded state history of one slot over one local day.
+
+    ``transitions`` is a packed array of unsigned 32-bit words, one per state
+    change, each holding the seconds since local midnight shifted left two
+    bits with the new state in the low bits; ``initial_state`` is the state
+    carried over from the slot's previous timeline. A day with no changes
+    has no row, so the lot state at any instant is the latest row per slot
+    at or before that day, decoded up to the instant.
+
+    Slot changes are queued with ``record_on_commit`` and written by
+    ``record_many`` once the transaction that made them commits, so the
+    timeline's locks and queries stay out of the gate and booking
+    transactions. A transition recorded late for a day that already has a
+    later row (e.g. a gate queue replay) does not update the carried-over
+    state of the following days.
+    """
+    FREE, RESERVED, OCCUPIED = 0, 1, 2
+    STATE_CHOICES = [(FREE, 'Free'), (RESERVED, 'Reserved'), (OCCUPIED, 'Occupied')]
+
+    slot = models.ForeignKey(ParkingSlot, on_delete=models.CASCADE, related_name='timelines')
+    date = models.DateField()
+    initial_state = models.PositiveSmallIntegerField(choices=STATE_CHOICES, default=FREE)
+    transitions = models.BinaryField(default=bytes)
+
+    class Meta:
+        ordering = ['-date', 'slot']
+        constraints = [
+            models.UniqueConstraint(fields=['slot', 'date'], name='unique_slot_timeline_day'),
+        ]
+
+    def __str__(self):
+        return f"Slot {self.slot_id} on {self.date} ({len(self.decode())} changes)"
+
+    @staticmethod
+    def day_start(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    def decode(self):
+        """``[(seconds since local midnight, state), ...]`` in time order"""
+        words = array('I')
+        words.frombytes(bytes(self.transitions))
+        return [(word >> 2, word & 3) for word in words]
+
+    def encode(self, changes):
+        self.transitions = array('I', [(seconds << 2) | state for seconds, state in changes]).tobytes()
+
+    @property
+    def final_state(self):
+        changes = self.decode()
+        return changes[-1][1] if changes else self.initial_state
+
+    def state_at(self, seconds):
+        """State ``seconds`` after local midnight"""
+        state = self.initial_state
+        for offset, new_state in self.decode():
+            if offset > seconds:
+                break
+            state = new_state
+        return state
+
+    @classmethod
+    def latest(cls, slot_ids, day, inclusive=True):
+        """``{slot_id: timeline}`` with each slot's latest row on or before ``day`` (``slot_ids=None``: all slots)"""
+        lookup = 'date__lte' if inclusive else 'date__lt'
+        slots = ParkingSlot.objects.all() if slot_ids is None else ParkingSlot.objects.filter(pk__in=slot_ids)
+        latest_ids = slots.annotate(
+            timeline_id=Subquery(
+                cls.objects.filter(slot=OuterRef('pk'), **{lookup: day}).order_by('-date').values('pk')[:1]
+            )
+        ).values('timeline_id')
+        return {timeline.slot_id: timeline for timeline in cls.objects.filter(pk__in=latest_ids)}
+
+    @classmethod
+    def record_on_commit(cls, changes):
+        """Write ``(slot_id, state, at)`` changes with one ``record_many`` call once the current transaction commits.
+
+        Changes made in a transaction or savepoint that rolls back are never
+        recorded. A failed write is logged rather than failing the request
+        whose slot change already committed.
+        """
+        changes = list(changes)
+        if changes:
+            transaction.on_commit(partial(cls.record_many, changes), robust=True)
+
+    @classmethod
+    def record_many(cls, changes):
+        """Append ``(slot_id, state, at)`` changes to their slots' day timelines"""
+        by_day = defaultdict(list)
+        slots_by_day = defaultdict(set)
+        for slot_id, state, at in changes:
+            day = timezone.localdate(at)
+            seconds = int((at - cls.day_start(day)).total_seconds())
+            by_day[(slot_id, day)].append((seconds, state))
+            slots_by_day[day].add(slot_id)
+        if not by_day:
+            return
+
+        with transaction.atomic():
+            rows = cls.objects.select_for_update().filter(
+                slot_id__in=set().union(*slots_by_day.values()),
+                date__in=slots_by_day.keys(),
+            )
+            timelines = {(t.slot_id, t.date): t for t in rows if (t.slot_id, t.date) in by_day}
+
+            # Days are applied in order so a day started in this batch
+            # carries over the state the batch left the previous day in
+            batch_latest = {}
+            for day in sorted(slots_by_day):
+                slot_ids = slots_by_day[day]
+                missing = [slot_id for slot_id in slot_ids if (slot_id, day) not in timelines]
+                if missing:
+                    previous = cls.latest(missing, day, inclusive=False)
+                    for slot_id in missing:
+                        if slot_id in batch_latest and (slot_id not in previous or batch_latest[slot_id].date >= previous[slot_id].date):
+                            previous[slot_id] = batch_latest[slot_id]
+                        timeline = cls(
+                            slot_id=slot_id,
+                            date=day,
+                            initial_state=previous[slot_id].final_state if slot_id in previous else cls.FREE,
+                        )
+                        try:
+                            with transaction.atomic():
+                                timeline.save()
+                        except IntegrityError:
+                            # Another transaction started this day first
+                            timeline = cls.objects.select_for_update().get(slot_id=slot_id, date=day)
+                        timelines[(slot_id, day)] = timeline
+
+                for slot_id in slot_ids:
+                    timeline = timelines[(slot_id, day)]
+                    # Stable sort keeps same-second changes in the order they happened
+                    merged = sorted(timeline.decode() + by_day[(slot_id, day)], key=lambda change: change[0])
+                    runs, state = [], timeline.initial_state
+                    for seconds, new_state in merged:
+                        if new_state != state:
+                            runs.append((seconds, new_state))
+                            state = new_state
+                    timeline.encode(runs)
+                    batch_latest[slot_id] = timeline
+
+            cls.objects.bulk_update(timelines.values(), ['transitions'])
+
+    @classmethod
+    def record_slots(cls, slot_ids, at=None):
+        """Record the current state of slots changed with a queryset ``update()``"""
+        at = at or timezone.now()
+        slots = ParkingSlot.objects.filter(pk__in=slot_ids).only('is_occupied', 'is_reserved')
+        cls.record_on_commit([(slot.pk, slot.state, at) for slot in slots])
+
+
+@receiver(post_save, sender=ParkingSlot)
+def record_slot_state(sender, instance, **kwargs):
+    # The from_db snapshot limits this to saves that changed the state
+    if instance.state != getattr(instance, '_recorded_state', None):
+        SlotOccupancyTimeline.record_on_commit([(instance.pk, instance.state, timezone.now())])
+        instance._recorded_state = instance.state
 
 class MembershipPlan(models.Model):
     name = models.CharField(max_length=100)
@@ -455,6 +1339,9 @@ class UserMembership(models.Model):
         ('incomplete_expired', 'Incomplete Expired'),
     ]
     
+    # Subscribers get one free entry per day
+    FREE_ENTRIES_PER_DAY = 1
+
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='membership')
     stripe_customer_id = models.CharField(max_length=255, blank=True, null=True)
     stripe_subscription_id = models.CharField(max_length=255, blank=True, null=True)
@@ -469,7 +1356,29 @@ class UserMembership(models.Model):
     last_free_entry_date = models.DateField(null=True, blank=True)
     subscription_start_date = models.DateTimeField(null=True, blank=True)
     subscription_end_date = models.DateTimeField(null=True, blank=True)
+    stripe_event_created = models.DateTimeField(
+        null=True, blank=True, help_text="When Stripe created the last subscription event applied here"
+    )
     
+    @staticmethod
+    def snapshot_key(user_id):
+        return f"membership:{user_id}"
+
+    @classmethod
+    def invalidate_snapshot(cls, user_id):
+        """Drop the cached snapshot (see ``utils/membership_cache.py``) once the current transaction commits"""
+        key = cls.snapshot_key(user_id)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    @classmethod
+    def active_user_ids(cls, user_ids):
+        """IDs among ``user_ids`` whose membership is active right now (see ``is_active``)"""
+        return set(cls.objects.filter(
+            user_id__in=user_ids,
+            status='active',
+            current_period_end__gt=timezone.now()
+        ).values_list('user_id', flat=True))
+
     @property
     def is_active(self):
         if self.status == 'active' and self.current_period_end:
@@ -477,35 +1386,38 @@ class UserMembership(models.Model):
         return False
     @property
     def has_free_entry_available(self):
-        """Check if user has free entry available for today"""
-        from django.utils import timezone
-        
-        today = timezone.now().date()
-        
-        # Reset counter if it's a new day
-        if self.last_free_entry_date != today:
-            self.free_entries_used_today = 0
-            self.last_free_entry_date = today
-            self.save()
-        
-        # Subscribers get one free entry per day
-        return self.status == 'active' and self.free_entries_used_today < 1
-    
+        """Check if user has free entry available for today (read-only; see ``use_free_entry``)"""
+        if self.status != 'active':
+            return False
+        # A counter left over from an earlier day doesn't count against today
+        return (self.last_free_entry_date != timezone.localdate()
+                or self.free_entries_used_today < self.FREE_ENTRIES_PER_DAY)
+
     def use_free_entry(self):
-        """Mark one free entry as used"""
-        from django.utils import timezone
-        
-        today = timezone.now().date()
-        
-        if self.last_free_entry_date != today:
-            self.free_entries_used_today = 0
-            self.last_free_entry_date = today
-        
-        if self.free_entries_used_today < 1:
-            self.free_entries_used_today += 1
-            self.save()
-            return True
-        return False
+        """Claim one of today's free entries; returns whether one was available.
+
+        A single conditional UPDATE resets the counter on a new day and
+        increments it only while under quota, so concurrent entries for the
+        same member can't both get the last free entry.
+        """
+        today = timezone.localdate()
+        new_day = ~models.Q(last_free_entry_date=today)
+        claimed = UserMembership.objects.filter(
+            new_day | models.Q(free_entries_used_today__lt=self.FREE_ENTRIES_PER_DAY),
+            pk=self.pk,
+            status='active',
+        ).update(
+            free_entries_used_today=models.Case(
+                models.When(new_day, then=models.Value(1)),
+                default=models.F('free_entries_used_today') + 1,
+            ),
+            last_free_entry_date=today,
+        )
+        if claimed:
+            # Keep the instance current so a later save() doesn't write back a stale count
+            self.refresh_from_db(fields=['free_entries_used_today', 'last_free_entry_date'])
+            self.invalidate_snapshot(self.user_id)
+        return bool(claimed)
     
     @property
     def can_subscribe_again(self):
@@ -536,9 +1448,15 @@ class UserMembership(models.Model):
             self.subscription_start_date = timezone.now()
             
         super().save(*args, **kwargs)
+        self.invalidate_snapshot(self.user_id)
 
     def __str__(self):
         return f"{self.user.username} - {self.get_status_display()}"
+
+
+@receiver(post_delete, sender=UserMembership)
+def invalidate_membership_snapshot(sender, instance, **kwargs):
+    UserMembership.invalidate_snapshot(instance.user_id)
     
 
 class UserActivityLog(models.Model):
@@ -551,49 +1469,11 @@ class UserActivityLog(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp', 'id']),
+        ]
     
     def __str__(self):
         if self.user:
             return f"{self.user.username} - {self.action} - {self.timestamp}"
         return f"Anonymous - {self.action} - {self.timestamp}"
-    
-    @property
-    def has_free_entry_available(self):
-        """Check if user has free entry available for today"""
-        from django.utils import timezone
-        
-        today = timezone.now().date()
-        
-        # Only check if subscription is active
-        if self.status != 'active':
-            return False
-        
-        # Reset counter if it's a new day
-        if self.last_free_entry_date != today:
-            self.free_entries_used_today = 0
-            self.last_free_entry_date = today
-            self.save()
-        
-        return self.free_entries_used_today < 1
-    
-    def use_free_entry(self):
-        """Mark one free entry as used"""
-        from django.utils import timezone
-        
-        today = timezone.now().date()
-        
-        # Only allow if subscription is active
-        if self.status != 'active':
-            return False
-        
-        # Reset counter if it's a new day
-        if self.last_free_entry_date != today:
-            self.free_entries_used_today = 0
-            self.last_free_entry_date = today
-        
-        if self.free_entries_used_today < 1:
-            self.free_entries_used_today += 1
-            self.save()
-            return True
-        return False
-    
\ No newline at end of file
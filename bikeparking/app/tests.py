@@ -1,3 +1,1173 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from app import views
+from app.management.commands.run_booking_scheduler import Command as BookingScheduler
+from app.models import (
+    Booking, BookingSequence, EconomicsReport, GateEventReceipt, IdempotencyKey, ParkingHistory, ParkingSlot,
+    RevenueDailyRollup, SlotOccupancyTimeline, StripeEvent, Ticket, UserMembership,
+)
+from app.utils import parquet_export
+from app.utils.deadlines import DeadlineQueue
+from app.utils.keyset import KeysetPage, encode_cursor, keyset_page
+from app.utils.occupancy import lot_state, occupancy_between
+from app.utils.gate_events import process_gate_events, process_manual_entry, process_manual_exit
+from app.utils.membership_cache import claim_free_entry, get_membership
+from app.utils.stripe_events import process_pending_events
+from app.utils import timeseries
+from app.utils.parquet_export import LedgerExporter
+from app.utils.pricing import Tariff, from_cents, local_minutes, to_cents
+from app.utils.rate_limit import TokenBucket, rate_limit, rejection_counts
+
+
+def run_concurrently(target, count):
+    """Call ``target(i)`` for ``i`` in ``range(count)`` from threads released together; return the results in order"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    errors = []
+
+    def worker(i):
+        try:
+            barrier.wait()
+            results[i] = target(i)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            own = getattr(BookingSequence._local, 'connection', None)
+            if own is not None:
+                own.close()
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def reserve_booking_numbers_in_test_transaction(test):
+    """Keep ``TestCase`` bookings off the counter's own connection, which
+    can't see the test transaction and would commit outside it"""
+    patcher = mock.patch.object(BookingSequence, '_use_own_connection', return_value=False)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def create_slots(count=views.TOTAL_SLOTS):
+    return ParkingSlot.objects.bulk_create([ParkingSlot(slot_number=f'S{i:02d}') for i in range(count)])
+
+
+@skipIf(parquet_export.pa is None, "pyarrow is not installed")
+class LedgerExporterTests(TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out_dir)
+        self.exporter = LedgerExporter(self.out_dir)
+
+    def run_later(self, table, delay):
+        with mock.patch.object(parquet_export.timezone, 'now', return_value=timezone.now() + delay):
+            return self.exporter.run([table])
+
+    def exported_ids(self, table):
+        import pyarrow.dataset as ds
+        try:
+            dataset = ds.dataset(f'{self.out_dir}/{table}', partitioning='hive')
+        except FileNotFoundError:
+            return []
+        return sorted(dataset.to_table(columns=['id']).column('id').to_pylist())
+
+    def test_replayed_history_row_does_not_skip_a_live_row(self):
+        now = timezone.now()
+        live = ParkingHistory.objects.create(vehicle_number='AB1', action='entered', timestamp=now)
+        replayed = ParkingHistory.objects.create(vehicle_number='AB2', action='entered', timestamp=now - timedelta(days=1))
+
+        # The live row is still settling, so the replayed row behind it waits too
+        self.assertEqual(self.exporter.run(['parking_history']), {'parking_history': 0})
+        self.assertEqual(self.exporter.watermarks()['parking_history'], 0)
+
+        self.assertEqual(self.run_later('parking_history', timedelta(hours=1)), {'parking_history': 2})
+        self.assertEqual(self.exported_ids('parking_history'), [live.pk, replayed.pk])
+        self.assertEqual(self.run_later('parking_history', timedelta(hours=1)), {'parking_history': 0})
+
+    def test_exit_replayed_after_a_run_is_exported(self):
+        now = timezone.now()
+        closed = Ticket.objects.create(
+            vehicle_number='AB1', entry_time=now - timedelta(days=2), exit_time=now - timedelta(days=1)
+        )
+        Ticket.objects.filter(pk=closed.pk).update(closed_at=now - timedelta(days=1))
+        self.exporter.run(['tickets'])
+        self.assertEqual(self.exported_ids('tickets'), [closed.pk])
+
+        # Exit time before the last run, recorded now from the gate queue
+        late = Ticket.objects.create(vehicle_number='AB2', entry_time=now - timedelta(days=2))
+        late.exit_time = now - timedelta(days=1)
+        late.save()
+        self.assertEqual(self.exporter.run(['tickets']), {'tickets': 0})
+
+        self.assertEqual(self.run_later('tickets', timedelta(hours=1)), {'tickets': 1})
+        self.assertEqual(self.exported_ids('tickets'), [closed.pk, late.pk])
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class ConcurrentBookingTests(TransactionTestCase):
+    def setUp(self):
+        create_slots()
+        BookingSequence._blocks.clear()
+
+    def test_parallel_lockers_never_share_a_slot(self):
+        def take_slot(i):
+            with transaction.atomic():
+                slots = ParkingSlot.lock_free_slots()
+                if not slots:
+                    return None
+                ParkingSlot.objects.filter(pk=slots[0].pk).update(is_reserved=True)
+                return slots[0].pk
+
+        taken = [slot_id for slot_id in run_concurrently(take_slot, 60) if slot_id]
+        self.assertEqual(len(taken), len(set(taken)))
+        self.assertEqual(ParkingSlot.objects.filter(is_reserved=True).count(), len(taken))
+
+    def test_parallel_bookings_stay_within_quota(self):
+        start = timezone.now()
+        end = start + timedelta(minutes=Booking.EXPIRY_MINUTES)
+
+        def book(i):
+            with transaction.atomic():
+                slot = views.find_available_slot(start, end)
+                if slot is None:
+                    return None
+                return Booking.objects.create(
+                    slot=slot, vehicle_number=f'AB{i:03d}', start_time=start, end_time=end, status='confirmed'
+                ).slot_id
+
+        # Every booker sees the same stale cached availability
+        stale = {'booking_enabled': True, 'available_for_booking': views.MAX_BOOKABLE_SLOTS}
+        with mock.patch.object(views, 'get_booking_availability', return_value=stale):
+            booked = [slot_id for slot_id in run_concurrently(book, 40) if slot_id]
+
+        self.assertEqual(len(booked), views.MAX_BOOKABLE_SLOTS)
+        self.assertEqual(len(set(booked)), len(booked))
+        self.assertEqual(ParkingSlot.objects.filter(is_reserved=True).count(), len(booked))
+        self.assertEqual(Booking.objects.values('booking_id').distinct().count(), len(booked))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class BookingSequenceTests(TransactionTestCase):
+    def setUp(self):
+        BookingSequence._blocks.clear()
+        self.addCleanup(BookingSequence._blocks.clear)
+
+    def insert_in_parallel(self, threads=10, per_thread=10):
+        def insert(i):
+            for n in range(per_thread):
+                with transaction.atomic():
+                    Booking.objects.create(vehicle_number=f'AB{i:02d}{n:02d}', start_time=timezone.now())
+
+        run_concurrently(insert, threads)
+        booking_ids = list(Booking.objects.values_list('booking_id', flat=True))
+        self.assertEqual(len(booking_ids), threads * per_thread)
+        self.assertEqual(len(set(booking_ids)), len(booking_ids))
+
+    def test_parallel_inserts_get_unique_booking_ids(self):
+        with self.settings(BOOKING_ID_BLOCK_SIZE=1):
+            self.insert_in_parallel()
+        # One counter bump per booking, none lost or repeated
+        year = timezone.now().year
+        self.assertEqual(BookingSequence.objects.get(year=year).last_value, 100)
+
+    def test_parallel_inserts_with_preallocated_blocks(self):
+        with self.settings(BOOKING_ID_BLOCK_SIZE=5):
+            self.insert_in_parallel()
+
+    def test_reserving_does_not_wait_for_an_open_booking_transaction(self):
+        reserved = threading.Event()
+        release = threading.Event()
+
+        def hold_booking(i):
+            if i == 0:
+                with transaction.atomic():
+                    Booking.objects.create(vehicle_number='AB0001', start_time=timezone.now())
+                    reserved.set()
+                    release.wait(10)
+            else:
+                reserved.wait(10)
+                try:
+                    with transaction.atomic():
+                        Booking.objects.create(vehicle_number='AB0002', start_time=timezone.now())
+                    # The first booking is still uncommitted when the second one is
+                    return Booking.objects.count()
+                finally:
+                    release.set()
+
+        self.assertEqual(run_concurrently(hold_booking, 2)[1], 1)
+        self.assertEqual(Booking.objects.count(), 2)
+
+
+class BookingLifecycleQueryTests(TestCase):
+    def setUp(self):
+        self.slot = create_slots(1)[0]
+        BookingSequence.objects.create(year=timezone.now().year)
+        BookingSequence._blocks.clear()
+        reserve_booking_numbers_in_test_transaction(self)
+        self.addCleanup(BookingSequence._blocks.clear)
+
+    def create_booking(self, slot=None, **kwargs):
+        slot = slot or ParkingSlot.objects.get(pk=self.slot.pk)
+        with self.settings(BOOKING_ID_BLOCK_SIZE=1):
+            return Booking.objects.create(
+                slot=slot,
+                vehicle_number='AB1234',
+                start_time=timezone.now(),
+                status='confirmed',
+                **kwargs
+            )
+
+    def test_create_reserves_the_slot(self):
+        # Counter bump in a savepoint, slot UPDATE and booking INSERT
+        with self.assertNumQueries(5):
+            self.create_booking(slot=self.slot)
+        self.assertTrue(ParkingSlot.objects.get(pk=self.slot.pk).is_reserved)
+
+    def test_status_change_releases_the_slot_in_the_same_write(self):
+        self.create_booking()
+        booking = Booking.objects.get()
+        booking.status = 'expired'
+        # Slot UPDATE, slot state read for the timeline and the booking
+        # UPDATE in a savepoint; no re-read of the booking
+        with self.assertNumQueries(5):
+            booking.save()
+        self.assertFalse(ParkingSlot.objects.get(pk=self.slot.pk).is_reserved)
+
+    def test_save_without_status_change_is_one_update(self):
+        self.create_booking()
+        booking = Booking.objects.get()
+        booking.guest_phone = '555'
+        with self.assertNumQueries(1):
+            booking.save()
+
+    def test_expiry_sweep_is_set_based(self):
+        for _ in range(3):
+            self.create_booking()
+        Booking.objects.update(start_time=timezone.now() - timedelta(hours=1))
+        with self.assertNumQueries(6):
+            self.assertEqual(Booking.expire_overdue(), 3)
+        self.assertFalse(ParkingSlot.objects.filter(is_reserved=True).exists())
+
+
+class DeadlineQueueTests(SimpleTestCase):
+    def test_rescheduling_replaces_the_earlier_deadline(self):
+        queue = DeadlineQueue()
+        queue.schedule(1, 'grace', 10)
+        queue.schedule(2, 'grace', 20)
+        queue.schedule(2, 'end', 15)
+        queue.schedule(1, 'grace', 30)
+        queue.schedule(2, 'end', 15)
+        queue.cancel(2, 'grace')
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.next_due(), 15)
+        self.assertEqual(queue.pop_due(25), {'end': [2]})
+        self.assertEqual(queue.pop_due(30), {'grace': [1]})
+        self.assertIsNone(queue.next_due())
+
+
+class BookingSchedulerTests(TestCase):
+    def setUp(self):
+        self.slots = create_slots()
+        reserve_booking_numbers_in_test_transaction(self)
+        self.scheduler = BookingScheduler(stdout=StringIO())
+        self.scheduler.queue = DeadlineQueue()
+        self.scheduler.loaded_until = None
+
+    def create_bookings(self, count, start_time):
+        first = Booking.objects.count()
+        return [
+            Booking.objects.create(
+                slot=self.slots[i], vehicle_number=f'AB{i:04d}', start_time=start_time, status='confirmed'
+            )
+            for i in range(first, first + count)
+        ]
+
+    def sweep(self, now):
+        due = self.scheduler.queue.pop_due(now)
+        if due:
+            self.scheduler.run_transitions(due, now)
+        return due
+
+    def test_edited_booking_is_not_expired_at_its_old_deadline(self):
+        now = timezone.now()
+        booking, = self.create_bookings(1, now - timedelta(minutes=10))
+        self.scheduler.load_bookings()
+
+        booking.start_time = now + timedelta(hours=1)
+        booking.save()
+        self.scheduler.load_bookings()
+
+        self.assertEqual(self.sweep(now + timedelta(minutes=6)), {})
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'confirmed')
+        self.assertEqual(self.sweep(now + timedelta(hours=1, minutes=16)), {'grace': [booking.pk]})
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'expired')
+        self.assertFalse(ParkingSlot.objects.get(pk=booking.slot_id).is_reserved)
+
+    def test_due_bookings_expire_in_one_set_based_update(self):
+        def sweep_queries(count):
+            now = timezone.now()
+            bookings = self.create_bookings(count, now - timedelta(minutes=20))
+            self.scheduler.load_bookings()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.sweep(now)['grace']), count)
+            self.assertEqual(Booking.objects.filter(pk__in=[b.pk for b in bookings], status='expired').count(), count)
+            return len(queries)
+
+        self.assertEqual(sweep_queries(2), sweep_queries(10))
+        self.assertFalse(ParkingSlot.objects.filter(is_reserved=True).exists())
+
+
+class KeysetPageTests(TestCase):
+    def setUp(self):
+        # Five tickets share one entry time, so only the id orders them
+        now = timezone.now()
+        times = [now] * 5 + [now - timedelta(minutes=i) for i in range(1, 4)]
+        Ticket.objects.bulk_create([
+            Ticket(vehicle_number=f'AB{i:04d}', plate_key=f'AB{i:04d}', entry_time=at) for i, at in enumerate(times)
+        ])
+        self.tickets = Ticket.objects.all()
+        self.expected = list(self.tickets.order_by('-entry_time', '-pk'))
+
+    def page(self, cursor=None):
+        return KeysetPage(self.tickets, 'entry_time', 3, cursor)
+
+    def test_walks_every_row_once_across_ties(self):
+        seen, page = [], self.page()
+        while True:
+            seen.extend(page)
+            if not page.has_next:
+                break
+            page = self.page(page.next_cursor)
+        self.assertEqual(seen, self.expected)
+        self.assertFalse(page.has_next)
+        self.assertTrue(page.has_previous)
+
+        # And back again from the last page
+        seen = []
+        while page.has_previous:
+            page = self.page(page.previous_cursor)
+            seen = list(page) + seen
+        self.assertEqual(seen, self.expected[:6])
+        self.assertIsNone(page.previous_cursor)
+
+    def test_stepping_back_past_the_first_page_returns_a_full_first_page(self):
+        second = self.page(self.page().next_cursor)
+        Ticket.objects.filter(pk__in=[ticket.pk for ticket in self.expected[:2]]).delete()
+        page = self.page(second.previous_cursor)
+        self.assertEqual(list(page), self.expected[2:5])
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+
+        newest = self.expected[2]
+        page = self.page(encode_cursor(newest.entry_time, newest.pk, 'prev'))
+        self.assertEqual(list(page), self.expected[2:5])
+
+    def test_tampered_cursor_falls_back_to_the_first_page(self):
+        cursor = self.page().next_cursor
+        for bad in (cursor[:-2] + 'xx', 'not-a-cursor', cursor.replace(':', '.', 1)):
+            request = RequestFactory().get('/tickets/', {'cursor': bad})
+            page = keyset_page(request, self.tickets, 'entry_time', 3)
+            self.assertEqual(list(page), self.expected[:3])
+            self.assertFalse(page.has_previous)
+
+
+@override_settings(TIME_ZONE='UTC')
+class SlotOccupancyTests(TestCase):
+    FREE, RESERVED, OCCUPIED = SlotOccupancyTimeline.FREE, SlotOccupancyTimeline.RESERVED, SlotOccupancyTimeline.OCCUPIED
+
+    def setUp(self):
+        # S00 gets a timeline in each test; S01 never changes
+        self.slot, self.idle = create_slots(2)
+        self.day = datetime(2026, 6, 1).date()
+
+    def at(self, days=0, hours=0):
+        return utc(2026, 6, 1) + timedelta(days=days, hours=hours)
+
+    def test_transitions_round_trip_through_the_packed_encoding(self):
+        changes = [(0, self.OCCUPIED), (3600, self.FREE), (7200, self.RESERVED), (86399, self.OCCUPIED)]
+        timeline = SlotOccupancyTimeline(slot=self.slot, date=self.day, initial_state=self.RESERVED)
+        timeline.encode(changes)
+        timeline.save()
+
+        stored = SlotOccupancyTimeline.objects.get(pk=timeline.pk)
+        self.assertEqual(stored.decode(), changes)
+        self.assertEqual(len(bytes(stored.transitions)), 4 * len(changes))
+        self.assertEqual(stored.final_state, self.OCCUPIED)
+        self.assertEqual(
+            [stored.state_at(seconds) for seconds in (0, 3599, 3600, 7199, 86398)],
+            [self.OCCUPIED, self.OCCUPIED, self.FREE, self.FREE, self.RESERVED],
+        )
+
+    def test_recorded_changes_split_into_day_timelines(self):
+        SlotOccupancyTimeline.record_many([
+            (self.slot.pk, self.OCCUPIED, self.at(hours=6)),
+            (self.slot.pk, self.OCCUPIED, self.at(hours=7)),
+            (self.slot.pk, self.FREE, self.at(days=1, hours=1)),
+        ])
+        first, second = SlotOccupancyTimeline.objects.order_by('date')
+        self.assertEqual((first.initial_state, first.decode()), (self.FREE, [(6 * 3600, self.OCCUPIED)]))
+        self.assertEqual((second.initial_state, second.decode()), (self.OCCUPIED, [(3600, self.FREE)]))
+
+    def test_occupancy_is_weighted_by_time(self):
+        SlotOccupancyTimeline.record_many([
+            (self.slot.pk, self.OCCUPIED, self.at(hours=6)),
+            (self.slot.pk, self.RESERVED, self.at(hours=12)),
+        ])
+        points = occupancy_between([self.at(), self.at(hours=12), self.at(hours=24)])
+        # One of two slots occupied for half of the first interval
+        self.assertEqual(points, [
+            {'occupied': 0, 'reserved': 0, 'occupancy_percent': 25.0},
+            {'occupied': 0, 'reserved': 1, 'occupancy_percent': 0.0},
+        ])
+
+        points = occupancy_between([self.at(hours=9), self.at(hours=10)])
+        self.assertEqual(points, [{'occupied': 1, 'reserved': 0, 'occupancy_percent': 50.0}])
+
+    def test_multi_day_range_carries_state_over_days_without_a_row(self):
+        SlotOccupancyTimeline.record_many([
+            (self.slot.pk, self.OCCUPIED, self.at(hours=18)),
+            (self.slot.pk, self.FREE, self.at(days=2, hours=6)),
+        ])
+        self.assertEqual(SlotOccupancyTimeline.objects.count(), 2)
+        points = occupancy_between([self.at(days=day) for day in range(4)])
+        self.assertEqual(
+            [(point['occupied'], point['occupancy_percent']) for point in points],
+            [(0, 12.5), (1, 50.0), (1, 12.5)],
+        )
+        # A range that starts on the day with no row reads the carried-over state
+        self.assertEqual(
+            occupancy_between([self.at(days=1, hours=12), self.at(days=2, hours=12)]),
+            [{'occupied': 1, 'reserved': 0, 'occupancy_percent': 37.5}],
+        )
+
+    def test_slot_without_a_timeline_is_free(self):
+        self.assertEqual(
+            occupancy_between([self.at(), self.at(days=1)]),
+            [{'occupied': 0, 'reserved': 0, 'occupancy_percent': 0.0}],
+        )
+        SlotOccupancyTimeline.record_many([(self.slot.pk, self.OCCUPIED, self.at(hours=1))])
+        self.assertEqual(lot_state(self.at(hours=2)), {'S00': self.OCCUPIED, 'S01': self.FREE})
+        self.assertEqual(lot_state(self.at()), {'S00': self.FREE, 'S01': self.FREE})
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('member')
+        self.calls = []
+
+        @views.idempotent('test')
+        def view(request):
+            self.calls.append(json.loads(request.body))
+            if self.nested:
+                self.nested = False
+                self.nested_response = view(self.post(self.calls[-1]))
+            return JsonResponse({'success': True, 'call': len(self.calls)}, status=201)
+
+        self.view = view
+        self.nested = False
+
+    def post(self, body, key='key-1'):
+        request = RequestFactory().post(
+            '/test/', json.dumps(body), content_type='application/json', HTTP_IDEMPOTENCY_KEY=key
+        )
+        request.user = self.user
+        return request
+
+    def test_replay_returns_the_stored_response(self):
+        first = self.view(self.post({'slot': 1}))
+        replay = self.view(self.post({'slot': 1}))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay.content, first.content)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.view(self.post({'slot': 1}, key='key-2')).status_code, 201)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_key_reused_with_a_different_body_is_rejected(self):
+        self.view(self.post({'slot': 1}))
+        self.assertEqual(self.view(self.post({'slot': 2})).status_code, 422)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_duplicate_of_an_in_flight_request_gets_a_conflict(self):
+        self.nested = True
+        self.assertEqual(self.view(self.post({'slot': 1})).status_code, 201)
+        self.assertEqual(self.nested_response.status_code, 409)
+        self.assertEqual(self.nested_response['Retry-After'], '1')
+        self.assertEqual(len(self.calls), 1)
+
+    def test_expired_lease_is_taken_over(self):
+        record, created = IdempotencyKey.claim(f'test:user:{self.user.pk}', 'key-1', hashlib.sha256(
+            json.dumps({'slot': 1}).encode()
+        ).hexdigest())
+        self.assertTrue(created)
+        IdempotencyKey.objects.filter(pk=record.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.view(self.post({'slot': 1})).status_code, 201)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_claim_retries_when_the_conflicting_key_is_gone(self):
+        create = IdempotencyKey.objects.create
+        attempts = []
+
+        def create_once_purged(**kwargs):
+            # The first insert loses to a row that is purged before it can be read
+            attempts.append(kwargs)
+            if len(attempts) == 1:
+                raise IntegrityError
+            return create(**kwargs)
+
+        with mock.patch.object(IdempotencyKey.objects, 'create', side_effect=create_once_purged):
+            record, created = IdempotencyKey.claim('test', 'key-1', 'hash')
+        self.assertTrue(created)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(IdempotencyKey.objects.get().pk, record.pk)
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_burst_is_limited_to_capacity(self):
+        bucket = TokenBucket('test', capacity=3, rate=1)
+        self.assertEqual([bucket.take('client', now=1000) for _ in range(4)], [0, 0, 0, 1])
+        self.assertEqual(bucket.take('other', now=1000), 0)
+
+    def test_tokens_refill_over_time_up_to_capacity(self):
+        bucket = TokenBucket('test', capacity=3, rate=0.5)
+        for _ in range(3):
+            bucket.take('client', now=1000)
+        self.assertEqual(bucket.take('client', now=1001), 1)
+        self.assertEqual(bucket.take('client', now=1002), 0)
+        self.assertEqual(bucket.take('client', now=1002), 2)
+        # A long idle spell refills the bucket but never beyond its capacity
+        self.assertEqual([bucket.take('client', now=5000) for _ in range(4)], [0, 0, 0, 2])
+
+    @override_settings(RATE_LIMITS={'test': (2, 60)})
+    def test_users_get_their_own_bucket_and_guests_share_one_per_ip(self):
+        view = rate_limit('test')(lambda request: JsonResponse({'success': True}))
+        user = User.objects.create_user('member')
+
+        def request(address, user=None, guest_id=None):
+            request = RequestFactory().get('/test/', REMOTE_ADDR=address)
+            request.user = user or AnonymousUser()
+            if guest_id:
+                request.COOKIES['guest_id'] = guest_id
+            return view(request).status_code
+
+        self.assertEqual([request('10.0.0.1', guest_id=str(i)) for i in range(3)], [200, 200, 429])
+        self.assertEqual(request('10.0.0.2'), 200)
+        self.assertEqual([request('10.0.0.1', user=user) for _ in range(3)], [200, 200, 429])
+        self.assertEqual(request('10.0.0.2', user=user), 429)
+        self.assertEqual(rejection_counts(), {'test': 3})
+
+        rejected = RequestFactory().get('/test/', REMOTE_ADDR='10.0.0.1')
+        rejected.user = AnonymousUser()
+        response = view(rejected)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class ManualEntryTests(TestCase):
+    # Entries per second one worker must sustain on the test database
+    MIN_ENTRIES_PER_SECOND = 20
+
+    def setUp(self):
+        create_slots()
+        reserve_booking_numbers_in_test_transaction(self)
+        self.staff = User.objects.create_user('gate', is_staff=True)
+        # Warm the membership snapshot cache, as a running worker would have
+        get_membership(self.staff.pk)
+
+    def test_walk_in_entry_query_budget(self):
+        # Booking lookup, free-slot lock, slot UPDATE, ticket, economics,
+        # the day's first revenue rollup row and history, plus savepoints
+        with self.assertNumQueries(14):
+            result = process_manual_entry('AB1234', '', self.staff, timezone.now())
+        self.assertTrue(Ticket.objects.filter(pk=result['ticket_id'], exit_time=None).exists())
+
+    def test_booked_entry_query_budget(self):
+        slot = ParkingSlot.objects.get(slot_number='S05')
+        booking = Booking.objects.create(slot=slot, vehicle_number='AB1234', start_time=timezone.now(), status='confirmed')
+        # The booking UPDATE takes the place of the free-slot lock
+        with self.assertNumQueries(14):
+            result = process_manual_entry('AB 1234', '', self.staff, timezone.now())
+        self.assertEqual(result['slot_number'], 'S05')
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'active')
+
+    def test_second_entry_for_a_parked_plate_is_rejected(self):
+        process_manual_entry('AB1234', '', self.staff, timezone.now())
+        with self.assertRaisesMessage(ValueError, 'already parked'):
+            process_manual_entry('AB 1234', '', self.staff, timezone.now())
+        self.assertEqual(Ticket.objects.filter(plate_key='AB1234').count(), 1)
+        self.assertEqual(ParkingSlot.objects.filter(is_occupied=True).count(), 1)
+
+    def test_entry_throughput(self):
+        count = 25
+        started = time.perf_counter()
+        for i in range(count):
+            process_manual_entry(f'AB{i:04d}', '', self.staff, timezone.now())
+        rate = count / (time.perf_counter() - started)
+        self.assertGreaterEqual(rate, self.MIN_ENTRIES_PER_SECOND, f"{rate:.0f} entries/s")
+
+
+class GateBatchTests(TestCase):
+    def setUp(self):
+        create_slots()
+        reserve_booking_numbers_in_test_transaction(self)
+        self.staff = User.objects.create_user('gate', is_staff=True)
+        self.client.force_login(self.staff)
+        get_membership(self.staff.pk)
+
+    def post_batch(self, events):
+        response = self.client.post(
+            reverse('gate_events_batch'), json.dumps({'events': events}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_mixed_batch_with_duplicates_and_rejections(self):
+        start = timezone.now() - timedelta(hours=1)
+
+        def event(minute, vehicle_number, action, event_id=None):
+            return {
+                'vehicle_number': vehicle_number, 'action': action, 'event_id': event_id,
+                'timestamp': (start + timedelta(minutes=minute)).isoformat(),
+            }
+
+        results = self.post_batch([
+            event(0, 'AB1', 'entry', 'e1'),
+            event(1, 'CD2', 'entry', 'e2'),
+            event(2, 'AB1', 'exit', 'e3'),
+            event(3, 'AB1', 'entry', 'e4'),
+            event(4, 'CD2', 'entry', 'e5'),
+            event(5, 'EF3', 'exit', 'e6'),
+            event(6, 'CD2', 'exit', 'e2'),
+            event(7, 'GH4', 'park', 'e7'),
+        ])
+
+        self.assertEqual([result['success'] for result in results], [True, True, True, True, False, False, True, False])
+        self.assertEqual(results[2]['action'], 'exit')
+        self.assertIn('already parked', results[4]['error'])
+        self.assertEqual(results[5]['error'], 'No active entry found for this vehicle')
+        self.assertTrue(results[6]['duplicate'])
+        self.assertEqual(
+            sorted(Ticket.objects.filter(exit_time=None).values_list('plate_key', flat=True)), ['AB1', 'CD2']
+        )
+        self.assertEqual(Ticket.objects.filter(plate_key='AB1').exclude(exit_time=None).count(), 1)
+        self.assertEqual(ParkingSlot.objects.filter(is_occupied=True).count(), 2)
+        self.assertEqual(ParkingHistory.objects.count(), 4)
+        self.assertEqual(EconomicsReport.objects.count(), 3)
+        self.assertEqual(GateEventReceipt.objects.count(), 4)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def query_count(size, offset):
+            events = [
+                {'index': i, 'vehicle_number': f'AB{offset + i:04d}', 'action': 'entry',
+                 'timestamp': timezone.now(), 'event_id': f'e{offset + i}'}
+                for i in range(size)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                results = process_gate_events(events, self.staff)
+            self.assertTrue(all(result['success'] for result in results.values()))
+            return len(queries)
+
+        # Warm the day's revenue rollup rows first
+        query_count(1, 0)
+        self.assertEqual(query_count(2, 100), query_count(20, 200))
+
+    def test_both_entry_paths_arrive_for_the_earliest_booking(self):
+        slots = ParkingSlot.objects.order_by('slot_number')
+        for plate_key in ('AB1', 'CD2'):
+            first = Booking.objects.create(
+                slot=slots[0 if plate_key == 'AB1' else 2], vehicle_number=plate_key, start_time=timezone.now(),
+                status='confirmed',
+            )
+            Booking.objects.create(
+                slot=slots[1 if plate_key == 'AB1' else 3], vehicle_number=plate_key, start_time=timezone.now(),
+                status='confirmed',
+            )
+            Booking.objects.filter(pk=first.pk).update(booked_at=timezone.now() - timedelta(hours=1))
+            setattr(self, plate_key, first)
+
+        process_manual_entry('AB1', '', self.staff, timezone.now())
+        process_gate_events(
+            [{'index': 0, 'vehicle_number': 'CD2', 'action': 'entry', 'timestamp': timezone.now()}], self.staff
+        )
+        self.assertEqual(
+            set(Booking.objects.filter(status='active').values_list('pk', flat=True)), {self.AB1.pk, self.CD2.pk}
+        )
+
+
+class GateEventReceiptTests(TestCase):
+    def setUp(self):
+        create_slots()
+        self.staff = User.objects.create_user('gate', is_staff=True)
+
+    def event(self, event_id, action, vehicle_number='AB1234', index=0):
+        return {
+            'index': index, 'event_id': event_id, 'vehicle_number': vehicle_number,
+            'action': action, 'timestamp': timezone.now(),
+        }
+
+    def test_rejected_batch_event_can_be_retried(self):
+        results = process_gate_events([self.event('exit-1', 'exit')], self.staff)
+        self.assertFalse(results[0]['success'])
+        self.assertFalse(GateEventReceipt.objects.exists())
+
+        process_gate_events([self.event('entry-1', 'entry')], self.staff)
+        results = process_gate_events([self.event('exit-1', 'exit')], self.staff)
+        self.assertEqual(results[0]['action'], 'exit')
+        self.assertFalse(Ticket.objects.filter(exit_time=None).exists())
+
+        results = process_gate_events([self.event('exit-1', 'exit')], self.staff)
+        self.assertEqual(results[0], {'success': True, 'duplicate': True})
+
+    def test_rejected_single_event_can_be_retried(self):
+        with self.assertRaises(ValueError):
+            process_manual_exit('AB1234', self.staff, timezone.now(), event_id='exit-1')
+        process_manual_entry('AB1234', '', self.staff, timezone.now(), event_id='entry-1')
+        self.assertIn('ticket_id', process_manual_exit('AB1234', self.staff, timezone.now(), event_id='exit-1'))
+        self.assertEqual(
+            process_manual_exit('AB1234', self.staff, timezone.now(), event_id='exit-1'), {'duplicate': True}
+        )
+
+
+class EconomicsDashboardTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('office', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def add_transactions(self, count):
+        kinds = [
+            ('entry_fee', '30.00', True), ('free_entry', '0.00', False),
+            ('booking_fee', '10.00', True), ('subscription_payment', '99.00', True),
+        ]
+        for i in range(count):
+            transaction_type, amount, is_paid = kinds[i % len(kinds)]
+            EconomicsReport.objects.create(
+                vehicle_number=f'AB{i:04d}', amount=amount, transaction_type=transaction_type,
+                payment_method='cash', is_paid=is_paid, user=self.staff,
+            )
+
+    def get_dashboard(self):
+        response = self.client.get(reverse('economics_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_cards_come_from_one_aggregate(self):
+        self.add_transactions(8)
+        # Session, user, the card aggregate and one page of transactions
+        with self.assertNumQueries(4):
+            context = self.get_dashboard()
+        self.assertEqual(context['total_revenue'], Decimal('278.00'))
+        self.assertEqual(context['entry_fee_revenue'], Decimal('60.00'))
+        self.assertEqual(context['booking_fee_revenue'], Decimal('20.00'))
+        self.assertEqual(context['subscription_revenue'], Decimal('198.00'))
+        self.assertEqual(context['today_revenue'], Decimal('278.00'))
+        self.assertEqual(context['transaction_count'], 8)
+        self.assertEqual(context['transaction_count_by_type'], {'entry_fee': 4, 'booking_fee': 2, 'subscription': 2})
+        self.assertEqual(context['today_count'], 8)
+
+    def test_query_count_does_not_grow_with_transactions(self):
+        self.add_transactions(40)
+        with self.assertNumQueries(4):
+            self.get_dashboard()
+
+
+class RevenueRollupTests(TestCase):
+    def rollup(self):
+        return {
+            (row.date, row.transaction_type, row.payment_method, row.is_paid): (row.total_amount, row.transaction_count)
+            for row in RevenueDailyRollup.objects.exclude(transaction_count=0)
+        }
+
+    def ledger(self):
+        totals = {}
+        for report in EconomicsReport.objects.all():
+            bucket, amount = report.rollup_state()
+            total, count = totals.get(bucket, (Decimal('0'), 0))
+            totals[bucket] = (total + amount, count + 1)
+        return totals
+
+    def assert_consistent(self):
+        incremental = self.rollup()
+        self.assertEqual(incremental, self.ledger())
+        call_command('rebuild_revenue_rollup', stdout=StringIO())
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_edits_and_deletes_keep_the_rollup_consistent(self):
+        reports = [
+            EconomicsReport.objects.create(vehicle_number=f'AB{i:04d}', amount='30.00', payment_method=method)
+            for i, method in enumerate(['cash', 'cash', 'card', 'cash'])
+        ]
+        self.assert_consistent()
+
+        reports[0].amount = Decimal('12.50')
+        reports[0].save()
+        reports[1].is_paid = False
+        reports[1].save()
+        # A fresh instance has no snapshot, so save() reads the stored row
+        moved = EconomicsReport.objects.only('id').get(pk=reports[2].pk)
+        moved.transaction_date = timezone.now() - timedelta(days=3)
+        moved.amount = Decimal('45.00')
+        moved.save()
+        reports[3].delete()
+        self.assert_consistent()
+
+        day = timezone.localdate()
+        self.assertEqual(RevenueDailyRollup.totals(date=day), {'total': Decimal('42.50'), 'count': 2})
+        self.assertEqual(
+            RevenueDailyRollup.totals(date=day - timedelta(days=3)), {'total': Decimal('45.00'), 'count': 1}
+        )
+
+    def test_rebuild_repairs_queryset_updates(self):
+        for i in range(3):
+            EconomicsReport.objects.create(vehicle_number=f'AB{i:04d}', amount='30.00')
+        # Queryset updates bypass save(), so only a rebuild catches them up
+        EconomicsReport.objects.update(amount=Decimal('10.00'))
+        self.assertNotEqual(self.rollup(), self.ledger())
+        self.assertEqual(RevenueDailyRollup.rebuild(date_from=timezone.localdate()), 1)
+        self.assertEqual(self.rollup(), self.ledger())
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+@override_settings(TIME_ZONE='UTC')
+class TariffTests(SimpleTestCase):
+    def quote(self, tariff, minutes, start=None, **kwargs):
+        entry = start or utc(2026, 6, 1, 12)
+        return tariff.quote(entry, entry + timedelta(minutes=minutes), **kwargs)
+
+    def test_first_hour_then_hourly_rate(self):
+        tariff = Tariff(first_hour='2.00', hourly_rate='1.00')
+        self.assertEqual(self.quote(tariff, 0), Decimal('2.00'))
+        self.assertEqual(self.quote(tariff, 60), Decimal('2.00'))
+        self.assertEqual(self.quote(tariff, 150), Decimal('3.50'))
+        # An exit recorded before the entry is charged as a zero-length stay
+        self.assertEqual(self.quote(tariff, -30), Decimal('2.00'))
+
+    def test_peak_hours_are_charged_by_local_time(self):
+        tariff = Tariff(first_hour='2.00', hourly_rate='1.00', peak_hourly_rate='3.00', peak_hours=[(8, 10)])
+        self.assertEqual(self.quote(tariff, 180, start=utc(2026, 6, 1, 7)), Decimal('8.00'))
+        with timezone.override('Asia/Karachi'):
+            # 02:00-05:00 UTC is 07:00-10:00 in Karachi
+            self.assertEqual(self.quote(tariff, 180, start=utc(2026, 6, 1, 2)), Decimal('8.00'))
+            self.assertEqual(self.quote(tariff, 180, start=utc(2026, 6, 1, 7)), Decimal('4.00'))
+
+    def test_daily_cap_applies_per_started_day(self):
+        tariff = Tariff(first_hour='2.00', hourly_rate='1.00', daily_cap='10.00')
+        self.assertEqual(self.quote(tariff, 5 * 60), Decimal('6.00'))
+        self.assertEqual(self.quote(tariff, 24 * 60), Decimal('10.00'))
+        self.assertEqual(self.quote(tariff, 30 * 60), Decimal('20.00'))
+
+    def test_grace_minutes_are_free(self):
+        tariff = Tariff(first_hour='2.00', grace_minutes=15)
+        self.assertEqual(self.quote(tariff, 15), Decimal('0.00'))
+        self.assertEqual(self.quote(tariff, 16), Decimal('2.00'))
+
+    def test_member_discount(self):
+        tariff = Tariff(first_hour='2.00', hourly_rate='1.00', member_discount_percent=10)
+        self.assertEqual(self.quote(tariff, 150, is_member=True), Decimal('3.15'))
+        self.assertEqual(self.quote(tariff, 150, is_member=False), Decimal('3.50'))
+
+    def test_cents_round_trip(self):
+        self.assertEqual(to_cents('2.675'), 268)
+        self.assertEqual(to_cents(Decimal('0.005')), 1)
+        self.assertEqual(to_cents(30), 3000)
+        for amount in ['0.00', '0.01', '2.68', '1234.50']:
+            self.assertEqual(from_cents(to_cents(amount)), Decimal(amount))
+            self.assertEqual(str(from_cents(to_cents(amount))), amount)
+        self.assertEqual(Tariff(entry_fee='30').entry_fee, Decimal('30.00'))
+
+    def test_batch_agrees_with_single_quotes(self):
+        tariff = Tariff(first_hour='2.00', hourly_rate='1.25', peak_hourly_rate='2.50', peak_hours=[(17, 19)],
+                        daily_cap='20.00', member_discount_percent=15)
+        entries = [utc(2026, 6, 1, 12) + timedelta(minutes=37 * i) for i in range(50)]
+        exits = [entry + timedelta(minutes=53 * i) for i, entry in enumerate(entries)]
+        members = [i % 3 == 0 for i in range(50)]
+        cents = tariff.quote_batch(entries, exits, members)
+        self.assertEqual(
+            [from_cents(c) for c in cents],
+            [tariff.quote(entry, exit, member) for entry, exit, member in zip(entries, exits, members)],
+        )
+
+    def test_stay_across_dst_change_is_charged_for_elapsed_time(self):
+        tariff = Tariff(first_hour='2.00', hourly_rate='1.00')
+        with timezone.override('Europe/London'):
+            # Clocks go forward at 01:00 UTC on 29 March and back at 01:00 UTC on 25 October
+            spring, autumn = utc(2026, 3, 29, 0, 30), utc(2026, 10, 25, 0, 30)
+            self.assertEqual(
+                list(local_minutes([spring, spring + timedelta(hours=2)]) - local_minutes([spring] * 2)), [0, 180]
+            )
+            self.assertEqual(
+                list(local_minutes([autumn, autumn + timedelta(hours=2)]) - local_minutes([autumn] * 2)), [0, 60]
+            )
+            for entry in (spring, autumn):
+                self.assertEqual(self.quote(tariff, 120, start=entry), Decimal('3.00'))
+                self.assertEqual(list(tariff.quote_batch([entry] * 2, [entry + timedelta(hours=2)] * 2)), [300, 300])
+
+        # The local clock still picks the rate: 08:00-10:00 London is 07:00-09:00 UTC in summer
+        peak = Tariff(first_hour='2.00', hourly_rate='1.00', peak_hourly_rate='3.00', peak_hours=[(8, 10)])
+        with timezone.override('Europe/London'):
+            self.assertEqual(self.quote(peak, 120, start=utc(2026, 3, 28, 23, 30)), Decimal('3.00'))
+            self.assertEqual(self.quote(peak, 180, start=utc(2026, 3, 29, 6)), Decimal('8.00'))
+
+
+@override_settings(TIME_ZONE='UTC')
+class TimeseriesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_slots(4)
+
+    def add_report(self, at, amount='30.00', is_paid=True):
+        report = EconomicsReport.objects.create(vehicle_number='AB1234', amount=amount, is_paid=is_paid)
+        # transaction_date is auto_now_add, so the ledger row is moved afterwards
+        EconomicsReport.objects.filter(pk=report.pk).update(transaction_date=at)
+
+    def test_year_of_hourly_points_is_fast(self):
+        start = utc(2025, 1, 1)
+        for day in range(0, 365, 5):
+            self.add_report(start + timedelta(days=day, hours=9))
+        started = time.perf_counter()
+        for name in ('revenue', 'occupancy', 'slots'):
+            series = timeseries.SERIES[name](start, utc(2026, 1, 1), 'hour')
+        elapsed = time.perf_counter() - started
+        self.assertEqual(len(series), 365 * 24)
+        self.assertLess(elapsed, 0.5)
+
+    def test_five_minute_points_fold_into_their_bucket(self):
+        for minute in (1, 4, 7):
+            self.add_report(utc(2026, 6, 1, 12, minute))
+        self.add_report(utc(2026, 6, 1, 12, 2), is_paid=False)
+        series = timeseries.revenue_series(utc(2026, 6, 1, 12), utc(2026, 6, 1, 12, 15), '5min')
+        self.assertEqual(
+            [(point['start'][11:16], point['transactions'], point['revenue']) for point in series],
+            [('12:00', 2, 60.0), ('12:05', 1, 30.0), ('12:10', 0, 0.0)],
+        )
+
+    def test_closed_series_are_cached_longer_than_open_ones(self):
+        computed = []
+
+        def series(start, end, granularity):
+            computed.append(end)
+            return []
+
+        now = timezone.now()
+        with mock.patch.dict(timeseries.SERIES, {'revenue': series}), \
+                mock.patch.object(timeseries.cache, 'set', wraps=timeseries.cache.set) as cache_set:
+            timeseries.cached_series('revenue', now - timedelta(days=2), now - timedelta(days=1), 'hour')
+            timeseries.cached_series('revenue', now - timedelta(days=2), now - timedelta(days=1), 'hour')
+            timeseries.cached_series('revenue', now - timedelta(days=1), now + timedelta(hours=1), 'hour')
+        self.assertEqual(len(computed), 2)
+        self.assertEqual(
+            [call.args[2] for call in cache_set.call_args_list],
+            [timeseries.CLOSED_SERIES_TTL, timeseries.OPEN_SERIES_TTL],
+        )
+
+    @override_settings(TIME_ZONE='Europe/London')
+    def test_buckets_follow_the_local_clock_across_dst_changes(self):
+        # Clocks go forward at 01:00 UTC on 29 March: local 01:00-02:00 never happens
+        self.add_report(utc(2026, 3, 29, 1, 30))
+        spring = timeseries.revenue_series(utc(2026, 3, 29), utc(2026, 3, 29, 23), 'hour')
+        self.assertEqual(len(spring), 23)
+        self.assertNotIn('2026-03-29T01:00:00', [point['start'] for point in spring])
+        self.assertEqual([point['start'] for point in spring if point['transactions']], ['2026-03-29T02:00:00'])
+        slots = timeseries.slot_occupancy_series(utc(2026, 3, 29), utc(2026, 3, 29, 23), 'hour')
+        self.assertEqual([point['occupancy_percent'] for point in slots], [0.0] * 23)
+
+        # ...and back at 01:00 UTC on 25 October, so local 01:00-02:00 happens twice
+        self.add_report(utc(2026, 10, 25, 0, 30))
+        self.add_report(utc(2026, 10, 25, 1, 30))
+        autumn = timeseries.revenue_series(utc(2026, 10, 24, 23), utc(2026, 10, 26, 0), 'hour')
+        self.assertEqual(len(autumn), 24)
+        self.assertEqual(
+            [(point['start'], point['transactions']) for point in autumn if point['transactions']],
+            [('2026-10-25T01:00:00', 2)],
+        )
+
+    def test_ranges_over_max_points_are_rejected(self):
+        start = utc(2026, 1, 1)
+        end = start + timedelta(minutes=5 * (timeseries.MAX_POINTS + 1))
+        with self.assertRaisesMessage(ValueError, 'the limit is'):
+            timeseries.bucket_starts(start, end, '5min')
+
+        self.client.force_login(User.objects.create_user('office', is_staff=True))
+        response = self.client.get(reverse('economics_timeseries_api'), {
+            'granularity': '5min', 'start': start.isoformat(), 'end': end.isoformat(),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('the limit is', response.json()['message'])
+
+
+class FreeEntryTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create_user('member')
+        self.membership = UserMembership.objects.create(user=self.member, status='active')
+
+    def test_one_free_entry_per_day(self):
+        self.assertTrue(self.membership.use_free_entry())
+        self.assertFalse(self.membership.use_free_entry())
+        self.assertFalse(UserMembership.objects.get(pk=self.membership.pk).has_free_entry_available)
+
+    def test_counter_resets_on_a_new_day(self):
+        UserMembership.objects.filter(pk=self.membership.pk).update(
+            free_entries_used_today=1, last_free_entry_date=timezone.localdate() - timedelta(days=1)
+        )
+        membership = UserMembership.objects.get(pk=self.membership.pk)
+        self.assertTrue(membership.has_free_entry_available)
+        self.assertTrue(membership.use_free_entry())
+        self.assertEqual(membership.free_entries_used_today, 1)
+        self.assertEqual(membership.last_free_entry_date, timezone.localdate())
+
+    def test_checking_availability_does_not_write(self):
+        self.membership.use_free_entry()
+        membership = get_membership(self.member.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(claim_free_entry(membership))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentFreeEntryTests(TransactionTestCase):
+    def test_simultaneous_entries_claim_one_free_entry(self):
+        member = User.objects.create_user('member')
+        membership = UserMembership.objects.create(user=member, status='active')
+
+        def claim(i):
+            return UserMembership.objects.get(pk=membership.pk).use_free_entry()
+
+        self.assertEqual(sum(run_concurrently(claim, 20)), UserMembership.FREE_ENTRIES_PER_DAY)
+        self.assertEqual(
+            UserMembership.objects.get(pk=membership.pk).free_entries_used_today, UserMembership.FREE_ENTRIES_PER_DAY
+        )
+
+
+def subscription_event(event_id, event_type, created, **subscription):
+    return {
+        'id': event_id,
+        'object': 'event',
+        'type': event_type,
+        'created': created,
+        'data': {'object': dict({'id': 'sub_test', 'object': 'subscription'}, **subscription)},
+    }
+
+
+# Recorded event bodies for one subscription, in the order Stripe created them
+STRIPE_EVENT_FIXTURES = [
+    subscription_event(
+        'evt_past_due', 'customer.subscription.updated', 1767225600,
+        status='past_due', current_period_start=1767225600, current_period_end=1769904000,
+    ),
+    {'id': 'evt_invoice', 'object': 'event', 'type': 'invoice.paid', 'created': 1767229200,
+     'data': {'object': {'id': 'in_test', 'object': 'invoice', 'subscription': 'sub_test'}}},
+    # Newer API versions report the billing period per subscription item
+    subscription_event(
+        'evt_active', 'customer.subscription.updated', 1767232800, status='active',
+        cancel_at_period_end=True,
+        items={'data': [{'current_period_start': 1767225600, 'current_period_end': 1769904000}]},
+    ),
+    subscription_event('evt_deleted', 'customer.subscription.deleted', 1769904000, status='canceled'),
+]
+
+
+class StripeStandIn:
+    """Delivers event fixtures to the webhook signed the way Stripe signs them"""
+    secret = 'whsec_test'
+
+    def __init__(self, client):
+        self.client = client
+
+    def deliver(self, event, secret=None):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(
+            (secret or self.secret).encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256
+        ).hexdigest()
+        return self.client.post(
+            reverse('stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=StripeStandIn.secret)
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.stripe = StripeStandIn(self.client)
+        self.member = User.objects.create_user('member')
+        UserMembership.objects.create(user=self.member, status='incomplete', stripe_subscription_id='sub_test')
+        self.events = {event['id']: event for event in STRIPE_EVENT_FIXTURES}
+
+    def membership(self):
+        return UserMembership.objects.get(user=self.member)
+
+    def test_events_are_stored_and_applied_later(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(self.stripe.deliver(self.events['evt_past_due']).status_code, 200)
+        self.assertEqual(StripeEvent.objects.get().status, 'pending')
+        self.assertEqual(self.membership().status, 'incomplete')
+
+        process_pending_events()
+        self.assertEqual(StripeEvent.objects.get().status, 'done')
+        self.assertEqual(self.membership().status, 'past_due')
+
+    def test_redelivered_and_out_of_order_events_apply_once_in_order(self):
+        for event_id in ['evt_active', 'evt_past_due', 'evt_past_due', 'evt_invoice', 'evt_active']:
+            self.assertEqual(self.stripe.deliver(self.events[event_id]).status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 3)
+
+        handled = process_pending_events()
+        self.assertEqual([event.event_id for event in handled], ['evt_past_due', 'evt_invoice', 'evt_active'])
+        membership = self.membership()
+        self.assertEqual(membership.status, 'active')
+        self.assertTrue(membership.cancel_at_period_end)
+        self.assertEqual(membership.current_period_end.timestamp(), 1769904000)
+
+        self.stripe.deliver(self.events['evt_deleted'])
+        process_pending_events()
+        self.assertEqual(self.membership().status, 'canceled')
+        self.assertFalse(StripeEvent.objects.exclude(status='done').exists())
+
+    def test_event_delivered_after_a_newer_one_was_applied_is_skipped(self):
+        self.stripe.deliver(self.events['evt_active'])
+        process_pending_events()
+        self.assertEqual(self.membership().status, 'active')
+
+        self.stripe.deliver(self.events['evt_past_due'])
+        self.assertEqual([event.event_id for event in process_pending_events()], ['evt_past_due'])
+        membership = self.membership()
+        self.assertEqual(membership.status, 'active')
+        self.assertTrue(membership.cancel_at_period_end)
+        self.assertEqual(membership.stripe_event_created.timestamp(), 1767232800)
+        self.assertFalse(StripeEvent.objects.exclude(status='done').exists())
+
+    def test_bad_signature_is_rejected_and_not_stored(self):
+        response = self.stripe.deliver(self.events['evt_active'], secret='whsec_other')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
@@ -13,6 +13,9 @@ urlpatterns = [
     path('', home, name='home'),
     path('book/', book_slot, name='book_slot'),
     path('booking/confirmation/<int:booking_id>/', booking_confirmation, name='booking_confirmation'),
+    path('booking/<int:booking_id>/artifacts/', booking_artifacts_status, name='booking_artifacts_status'),
+    path('booking/<int:booking_id>/qr/', booking_qr_code, name='booking_qr_code'),
+    path('booking/<int:booking_id>/slip/', booking_slip, name='booking_slip'),
     path('profile/', profile, name='profile'),
     path('my-bookings/', my_bookings, name='my_bookings'),
 
@@ -26,6 +29,7 @@ urlpatterns = [
     path('dashboard/parking-logs/', parking_logs, name='parking_logs'),
     path('dashboard/login/', dashboard_login, name='dashboard_login'),
     path('dashboard/manual-entry/', admin_manual_entry, name='admin_manual_entry'),    
+    path('dashboard/gate-events/', gate_events_batch, name='gate_events_batch'),
     path('dashboard/', admin_dashboard, name='admin_dashboard'),
     path('dashboard/ticket-history/', ticket_history, name='ticket_history'),    
     path('dashboard/logout/', custom_logout, name='dashboard_logout'),
@@ -38,15 +42,20 @@ urlpatterns = [
     path('api/parking-metrics/', get_parking_metrics, name='get_parking_metrics'),
     path('dashboard/create/', create_booking, name='create_booking'),
     path('api/check-booking/', check_booking, name='check_booking'),
+    path('api/rate-limits/', rate_limit_stats, name='rate_limit_stats'),
+    path('api/occupancy/', lot_occupancy_api, name='lot_occupancy_api'),
     path('get-slot-data/', get_slot_data, name='get_slot_data'),
     path('generate-receipt/<int:ticket_id>/', generate_receipt_pdf, name='generate_receipt'),
     path('api/ticket/<int:ticket_id>/', get_ticket_details, name='get_ticket_details'),
+    path('ticket/<int:ticket_id>/qr/', ticket_qr_code, name='ticket_qr_code'),
     path('check-vehicle-status/', check_vehicle_status, name='check_vehicle_status'),
 
     path('economics/', economics_dashboard, name='economics_dashboard'),
     path('economics/report/', economics_report, name='economics_report'),
     path('economics/export/', export_economics_csv, name='export_economics_csv'),
+    path('economics/export/parquet/', export_parquet, name='export_parquet'),
     path('economics/summary/', economics_summary_api, name='economics_summary_api'),
+    path('economics/timeseries/', economics_timeseries_api, name='economics_timeseries_api'),
 
     # Membership URLs
     path('create-payment-intent/', create_payment_intent, name='create_payment_intent'),
@@ -0,0 +1,32 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+# Rows fetched per round trip when streaming a queryset
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object for ``csv.writer`` that hands each line back instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def streaming_csv_response(filename, header, rows):
+    """Stream ``rows`` as a CSV download, one line at a time.
+
+    ``rows`` should be lazy (e.g. built from ``queryset.iterator()``) so the
+    export holds a single chunk in memory and the first bytes go out before
+    the query has been read to the end.
+    """
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,52 @@
+import heapq
+import itertools
+
+
+class DeadlineQueue:
+    """Min-heap of (deadline, key, kind) entries for the booking scheduler.
+
+    Scheduling a key/kind again replaces its earlier deadline (or is a no-op
+    if unchanged); superseded heap entries are skipped lazily when they surface, so both ``schedule``
+    and ``pop_due`` are O(log n) per entry and a sweep only touches the
+    entries that are actually due.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, key, kind, when):
+        if self._deadlines.get((key, kind)) == when:
+            return
+        self._deadlines[(key, kind)] = when
+        heapq.heappush(self._heap, (when, next(self._counter), key, kind))
+
+    def cancel(self, key, kind):
+        self._deadlines.pop((key, kind), None)
+
+    def next_due(self):
+        """Earliest live deadline, or None if nothing is scheduled"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Remove and return ``{kind: [keys]}`` for every deadline <= now"""
+        due = {}
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            when, _, key, kind = heapq.heappop(self._heap)
+            del self._deadlines[(key, kind)]
+            due.setdefault(kind, []).append(key)
+
+    def _discard_stale(self):
+        while self._heap:
+            when, _, key, kind = self._heap[0]
+            if self._deadlines.get((key, kind)) == when:
+                return
+            heapq.heappop(self._heap)
@@ -0,0 +1,400 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction, IntegrityError, InterfaceError, OperationalError
+from django.utils import timezone
+
+from app.models import (
+    Booking, EconomicsReport, GateEventReceipt, ParkingHistory, ParkingSlot, RenderJob,
+    RevenueDailyRollup, SlotOccupancyTimeline, Ticket, UserMembership, normalize_plate,
+)
+from app.utils.membership_cache import claim_free_entry, get_membership
+from app.utils.pricing import from_cents, get_tariff
+
+logger = logging.getLogger(__name__)
+
+# A plate with several live bookings arrives for the one booked first, on
+# every entry path
+ENTRY_BOOKING_ORDER = ('booked_at', 'id')
+
+
+def entry_charge(membership, tariff):
+    """EconomicsReport fields for one gate entry: a member's free entry if
+    one is left on ``membership``, otherwise the cash entry fee"""
+    if claim_free_entry(membership):
+        return {'amount': 0, 'transaction_type': 'free_entry', 'payment_method': 'free', 'is_paid': False}
+    return {'amount': tariff.entry_fee, 'transaction_type': 'entry_fee', 'payment_method': 'cash', 'is_paid': True}
+
+
+def process_gate_events(events, user):
+    """Apply a batch of gate entry/exit events in one transaction.
+
+    ``events`` are dicts with ``index``, ``vehicle_number`` (already
+    validated), ``action`` ('entry' or 'exit'), ``timestamp`` and optionally
+    an ``event_id``. They are replayed in timestamp order against an
+    in-memory view of the open tickets, bookings and slots for the plates
+    involved, then written back with a fixed number of bulk statements
+    however large the batch is. Events whose ID was already applied are
+    skipped and reported as duplicates.
+
+    Returns ``{index: result}`` where each result has ``success`` and either
+    the slot/ticket details or an ``error`` message. Raises ``ValueError``
+    if the batch conflicts with a concurrent entry and must be retried.
+    """
+    events = sorted(events, key=lambda event: (event['timestamp'], event['index']))
+    plate_keys = {normalize_plate(event['vehicle_number']) for event in events}
+    event_ids = [event['event_id'] for event in events if event.get('event_id')]
+    results = {}
+
+    with transaction.atomic():
+        seen = set(
+            GateEventReceipt.objects.filter(event_id__in=event_ids).values_list('event_id', flat=True)
+        )
+        receipts = []
+
+        open_tickets = {
+            ticket.plate_key: ticket
+            for ticket in Ticket.objects.select_for_update(of=('self',))
+            .select_related('slot', 'booking')
+            .filter(plate_key__in=plate_keys, exit_time__isnull=True)
+        }
+
+        bookings = {}
+        for booking in (
+            Booking.objects.select_for_update(of=('self',))
+            .filter(plate_key__in=plate_keys, status__in=['confirmed', 'active'])
+            .order_by(*ENTRY_BOOKING_ORDER)
+        ):
+            bookings.setdefault(booking.plate_key, booking)
+
+        # Booked slots are re-read under lock so a concurrent gate can't
+        # have occupied them since the booking was made
+        booked_slots = ParkingSlot.objects.select_for_update().in_bulk(
+            [booking.slot_id for booking in bookings.values() if booking.slot_id]
+        )
+
+        # One locked query for every walk-in slot the batch might need. A
+        # plate that is already parked, or enters twice, can only enter again
+        # after exiting, which frees the slot that entry will take
+        walk_ins = sum(
+            1 for plate_key in {
+                normalize_plate(event['vehicle_number']) for event in events if event['action'] == 'entry'
+            }
+            if plate_key not in open_tickets
+            and (plate_key not in bookings or not bookings[plate_key].slot_id)
+        )
+        free_slots = ParkingSlot.lock_free_slots(limit=walk_ins) if walk_ins else []
+
+        # Staff entries take a member's free entry, as in process_manual_entry
+        membership = get_membership(user.pk) if user else None
+
+        tariff = get_tariff()
+        recorded_at = timezone.now()
+        new_tickets = []
+        exiting = []
+        exited_tickets = []
+        history = []
+        economics = []
+        occupied_slots = {}
+        freed_slots = {}
+        slot_changes = []
+        arrived_bookings = set()
+        completed_bookings = set()
+
+        for event in events:
+            event_id = event.get('event_id')
+            if event_id:
+                if event_id in seen:
+                    results[event['index']] = {'success': True, 'duplicate': True}
+                    continue
+
+            plate_key = normalize_plate(event['vehicle_number'])
+            timestamp = event['timestamp']
+
+            if event['action'] == 'entry':
+                if plate_key in open_tickets:
+                    results[event['index']] = {
+                        'success': False,
+                        'error': f"Vehicle {event['vehicle_number']} is already parked. Please exit the vehicle first.",
+                    }
+                    continue
+
+                booking = bookings.pop(plate_key, None)
+                slot = booked_slots.get(booking.slot_id) if booking else None
+                if slot is not None and slot.is_occupied:
+                    results[event['index']] = {
+                        'success': False,
+                        'error': f"Booked slot {slot.slot_number} is already occupied",
+                    }
+                    continue
+                if slot is None:
+                    if not free_slots:
+                        results[event['index']] = {'success': False, 'error': "No available parking slots"}
+                        continue
+                    slot = free_slots.pop(0)
+
+                slot.is_occupied, slot.is_reserved = True, False
+                occupied_slots[slot.pk] = slot
+                slot_changes.append((slot.pk, SlotOccupancyTimeline.OCCUPIED, timestamp))
+                freed_slots.pop(slot.pk, None)
+                if booking:
+                    arrived_bookings.add(booking.pk)
+
+                ticket = Ticket(
+                    vehicle_number=event['vehicle_number'],
+                    plate_key=plate_key,
+                    slot=slot,
+                    booking=booking,
+                    entry_time=timestamp,
+                )
+                open_tickets[plate_key] = ticket
+                new_tickets.append(ticket)
+                economics.append(EconomicsReport(
+                    vehicle_number=event['vehicle_number'],
+                    plate_key=plate_key,
+                    ticket=ticket,
+                    booking=booking,
+                    user=user,
+                    **entry_charge(membership, tariff),
+                ))
+                history.append(ParkingHistory(
+                    vehicle_number=event['vehicle_number'],
+                    plate_key=plate_key,
+                    action='entered',
+                    timestamp=timestamp,
+                    ticket=ticket,
+                    booking=booking,
+                    is_prebooked=booking is not None,
+                    user=user,
+                ))
+                results[event['index']] = {'success': True, 'action': 'entry', 'slot_number': slot.slot_number, 'ticket': ticket}
+
+            else:
+                ticket = open_tickets.pop(plate_key, None)
+                if ticket is None:
+                    results[event['index']] = {'success': False, 'error': "No active entry found for this vehicle"}
+                    continue
+
+                ticket.exit_time = timestamp
+                ticket.closed_at = recorded_at
+                ticket.duration = timestamp - ticket.entry_time
+                exiting.append(ticket)
+                if ticket.pk:
+                    exited_tickets.append(ticket)
+                if ticket.booking_id:
+                    completed_bookings.add(ticket.booking_id)
+
+                if ticket.slot:
+                    ticket.slot.is_occupied = False
+                    freed_slots[ticket.slot.pk] = ticket.slot
+                    slot_changes.append((ticket.slot.pk, ticket.slot.state, timestamp))
+                    occupied_slots.pop(ticket.slot.pk, None)
+                    # The slot can take a later entry in this batch
+                    free_slots.append(ticket.slot)
+
+                history.append(ParkingHistory(
+                    vehicle_number=event['vehicle_number'],
+                    plate_key=plate_key,
+                    action='exited',
+                    timestamp=timestamp,
+                    ticket=ticket,
+                    booking=ticket.booking,
+                    user=user,
+                ))
+                results[event['index']] = {'success': True, 'action': 'exit', 'ticket': ticket}
+
+            # Rejections continue above, so only applied events get a receipt
+            # and a rejected one can be retried
+            if event_id:
+                seen.add(event_id)
+                receipts.append(GateEventReceipt(event_id=event_id))
+
+        # Price every exit in the batch in one call
+        if exiting:
+            members = UserMembership.active_user_ids(
+                {ticket.booking.user_id for ticket in exiting if ticket.booking and ticket.booking.user_id}
+            )
+            fees = tariff.quote_batch(
+                [ticket.entry_time for ticket in exiting],
+                [ticket.exit_time for ticket in exiting],
+                [bool(ticket.booking) and ticket.booking.user_id in members for ticket in exiting],
+            )
+            for ticket, cents in zip(exiting, fees):
+                ticket.fee_amount = from_cents(cents)
+
+        try:
+            GateEventReceipt.objects.bulk_create(receipts)
+            # Close exited tickets first, so a plate that exits and enters
+            # again in this batch has only its new ticket open
+            Ticket.objects.bulk_update(exited_tickets, ['exit_time', 'closed_at', 'duration', 'fee_amount'])
+            Ticket.objects.bulk_create(new_tickets)
+        except IntegrityError:
+            raise ValueError("Events in this batch were recorded concurrently elsewhere; please retry")
+
+        ParkingSlot.objects.filter(pk__in=occupied_slots).update(is_occupied=True, is_reserved=False)
+        ParkingSlot.objects.filter(pk__in=freed_slots).update(is_occupied=False)
+        SlotOccupancyTimeline.record_on_commit(slot_changes)
+        Booking.objects.filter(pk__in=arrived_bookings).update(vehicle_arrived=True, status='active')
+        Booking.objects.filter(pk__in=completed_bookings).update(status='completed')
+        EconomicsReport.objects.bulk_create(economics)
+        RevenueDailyRollup.add_reports(economics)
+        ParkingHistory.objects.bulk_create(history)
+
+        if settings.PRERENDER_ARTIFACTS:
+            RenderJob.objects.bulk_create([RenderJob(kind='ticket', object_id=ticket.pk) for ticket in new_tickets])
+
+    for result in results.values():
+        ticket = result.pop('ticket', None)
+        if ticket is not None:
+            result['ticket_id'] = ticket.pk
+    return results
+
+
+def process_manual_entry(vehicle_number, booking_id, user, timestamp, event_id=None):
+    """Record one vehicle entry from the manual entry page or the gate queue.
+
+    Runs in a fixed handful of queries: one booking lookup (slot joined in),
+    a free-slot lock only for walk-ins, conditional UPDATEs for the slot and
+    booking, and the ticket, economics and history inserts. The one open
+    ticket per plate constraint rejects vehicles that are already parked.
+
+    An ``event_id`` that was already applied returns ``{'duplicate': True}``
+    without recording anything. Rejections raise ``ValueError``; database
+    outages (``OperationalError``/``InterfaceError``) propagate unchanged so
+    the caller can queue the event and replay it later.
+    """
+    try:
+        with transaction.atomic():
+            if event_id and not GateEventReceipt.record(event_id):
+                return {'duplicate': True}
+
+            plate_key = normalize_plate(vehicle_number)
+            bookings = Booking.objects.select_related('slot').filter(status__in=['confirmed', 'active'])
+
+            # A booking made for this plate wins over a typed-in booking ID
+            booking = bookings.filter(plate_key=plate_key).order_by(*ENTRY_BOOKING_ORDER).first()
+            if booking is None and booking_id and str(booking_id).strip():
+                try:
+                    booking = bookings.get(id=booking_id)
+                except (Booking.DoesNotExist, ValueError):
+                    raise ValueError("Invalid booking ID or booking is not active")
+
+            slot = booking.slot if booking else None
+            if slot:
+                # Conditional so two gates can't both occupy the booked slot
+                if not ParkingSlot.objects.filter(pk=slot.pk, is_occupied=False).update(is_occupied=True, is_reserved=False):
+                    raise ValueError(f"Booked slot {slot.slot_number} is already occupied")
+            else:
+                free_slots = ParkingSlot.lock_free_slots()
+                if not free_slots:
+                    raise ValueError("No available parking slots")
+                slot = free_slots[0]
+                ParkingSlot.objects.filter(pk=slot.pk).update(is_occupied=True, is_reserved=False)
+            slot.is_occupied, slot.is_reserved = True, False
+            SlotOccupancyTimeline.record_on_commit([(slot.pk, SlotOccupancyTimeline.OCCUPIED, timestamp)])
+
+            if booking:
+                Booking.objects.filter(pk=booking.pk).update(vehicle_arrived=True, status='active')
+                booking.vehicle_arrived, booking.status = True, 'active'
+
+            try:
+                ticket = Ticket.objects.create(
+                    vehicle_number=vehicle_number,
+                    slot=slot,
+                    booking=booking,
+                    entry_time=timestamp
+                )
+            except IntegrityError:
+                raise ValueError(f"Vehicle {vehicle_number} is already parked. Please exit the vehicle first.")
+
+            # Manual entries are always recorded against the staff user
+            membership = get_membership(user.pk) if user else None
+            economic_record = EconomicsReport.objects.create(
+                vehicle_number=vehicle_number,
+                ticket=ticket,
+                booking=booking,
+                user=user,
+                **entry_charge(membership, get_tariff()),
+            )
+
+            ParkingHistory.objects.create(
+                vehicle_number=vehicle_number,
+                action='entered',
+                timestamp=timestamp,
+                ticket=ticket,
+                booking=booking,
+                is_prebooked=booking is not None,
+                user=user
+            )
+
+            logger.info(
+                "Manual entry recorded",
+                extra={
+                    'vehicle_number': plate_key,
+                    'slot_number': slot.slot_number,
+                    'ticket_id': ticket.id,
+                    'booking_id': booking.id if booking else None,
+                    'staff_user': user.username if user else None,
+                }
+            )
+
+            return {
+                'slot_number': slot.slot_number,
+                'booking_id': booking.id if booking else None,
+                'ticket_id': ticket.id,
+                'receipt_number': f"R{ticket.id:05d}.2",  # Generate receipt number from ticket ID
+                'economic_record_id': economic_record.id
+            }
+
+    except (ValueError, OperationalError, InterfaceError):
+        raise
+    except Exception as e:
+        logger.exception("Manual entry failed for %s", vehicle_number)
+        raise ValueError(str(e))
+
+
+def process_manual_exit(vehicle_number, user, timestamp, event_id=None):
+    """Record one vehicle exit; errors and ``event_id`` as for ``process_manual_entry``"""
+    try:
+        with transaction.atomic():
+            if event_id and not GateEventReceipt.record(event_id):
+                return {'duplicate': True}
+
+            # Find active ticket
+            ticket = Ticket.objects.select_related('slot', 'booking').filter(
+                plate_key=normalize_plate(vehicle_number),
+                exit_time__isnull=True
+            ).first()
+
+            if not ticket:
+                raise ValueError("No active entry found for this vehicle")
+
+            # Set exit time
+            ticket.exit_time = timestamp
+            ticket.save()
+
+            # Free up the slot
+            if ticket.slot:
+                ticket.slot.is_occupied = False
+                ticket.slot.save()
+
+            # Update booking if exists
+            if ticket.booking:
+                ticket.booking.status = 'completed'
+                ticket.booking.save()
+
+            ParkingHistory.objects.create(
+                vehicle_number=vehicle_number,
+                action='exited',
+                timestamp=timestamp,
+                ticket=ticket,
+                booking=ticket.booking,
+                user=user
+            )
+
+            return {'ticket_id': ticket.id}
+
+    except (ValueError, OperationalError, InterfaceError):
+        raise
+    except Exception as e:
+        raise ValueError(f"An error occurred during exit: {str(e)}")
@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import uuid
+from contextlib import closing
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+
+class GateQueue:
+    """Durable local log of gate events recorded while the database is down.
+
+    Lives in a SQLite file on the gate host (``settings.GATE_QUEUE_PATH``) in
+    WAL mode with full fsync, so an acknowledged event survives a crash.
+    Events are appended with a unique ``event_id`` and replayed in order by
+    ``replay_gate_queue``; the ID doubles as the dedupe key on the server, so
+    an event is applied once even if a replay is interrupted and re-run.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or settings.GATE_QUEUE_PATH)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS gate_events ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' event_id TEXT NOT NULL UNIQUE,'
+            ' user_id INTEGER,'
+            ' payload TEXT NOT NULL,'
+            ' replayed INTEGER NOT NULL DEFAULT 0)'
+        )
+        return conn
+
+    def append(self, vehicle_number, action, timestamp, user_id=None, booking_id=''):
+        """Record an event and return its ``event_id``"""
+        event_id = uuid.uuid4().hex
+        payload = json.dumps({
+            'vehicle_number': vehicle_number,
+            'action': action,
+            'timestamp': timestamp.isoformat(),
+            'booking_id': booking_id,
+        })
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'INSERT INTO gate_events (event_id, user_id, payload) VALUES (?, ?, ?)',
+                (event_id, user_id, payload)
+            )
+        return event_id
+
+    def pending(self, limit=100):
+        """Oldest events not yet replayed, in the order they were recorded"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT seq, event_id, user_id, payload FROM gate_events'
+                ' WHERE replayed = 0 ORDER BY seq LIMIT ?',
+                (limit,)
+            ).fetchall()
+
+        events = []
+        for seq, event_id, user_id, payload in rows:
+            event = json.loads(payload)
+            event.update(seq=seq, event_id=event_id, user_id=user_id,
+                         timestamp=parse_datetime(event['timestamp']))
+            events.append(event)
+        return events
+
+    def mark_replayed(self, seqs):
+        if not seqs:
+            return
+        with closing(self._connect()) as conn:
+            placeholders = ', '.join('?' * len(seqs))
+            conn.execute(f'UPDATE gate_events SET replayed = 1 WHERE seq IN ({placeholders})', list(seqs))
+
+    def purge_replayed(self):
+        """Drop replayed events; their IDs are kept server-side as receipts"""
+        with closing(self._connect()) as conn:
+            return conn.execute('DELETE FROM gate_events WHERE replayed = 1').rowcount
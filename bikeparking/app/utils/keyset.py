@@ -0,0 +1,118 @@
+import json
+
+from django.core import signing
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+CURSOR_SALT = 'app.keyset'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk, direction):
+    """Opaque token for the row ``(value, pk)``; ``direction`` is 'next' or 'prev'"""
+    return signing.dumps([value.isoformat(), pk, direction], salt=CURSOR_SALT)
+
+
+def decode_cursor(token):
+    try:
+        value, pk, direction = signing.loads(token, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+    value = parse_datetime(value)
+    if value is None or not isinstance(pk, int) or direction not in ('next', 'prev'):
+        raise InvalidCursor('Invalid cursor')
+    return value, pk, direction
+
+
+def approximate_count(queryset):
+    """Planner row estimate on PostgreSQL, exact ``count()`` elsewhere.
+
+    The estimate comes from EXPLAIN, so it costs the same however many rows
+    match; it is usually within a few percent on analysed tables.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset.count()
+
+
+class KeysetPage:
+    """One page of a queryset walked newest-first on ``(field, id)``.
+
+    Instead of a page number the page carries ``next_cursor`` (older rows)
+    and ``previous_cursor`` (newer rows). Each page is a single indexed
+    range scan of ``per_page + 1`` rows, so deep pages cost the same as the
+    first one. ``count`` is the approximate total and is only queried when
+    a template or view asks for it.
+    """
+
+    def __init__(self, queryset, field, per_page, cursor=None):
+        self.queryset = queryset
+        self.field = field
+        self.per_page = per_page
+
+        if cursor:
+            value, pk, direction = decode_cursor(cursor)
+            self._fetch(value, pk, direction)
+            # Stepping back to (or past) the newest row lands on a full first page
+            if direction == 'next' or self.has_previous:
+                return
+        self._fetch()
+
+    def _fetch(self, value=None, pk=None, direction='next'):
+        field = self.field
+        rows = self.queryset
+        if direction == 'next':
+            if value is not None:
+                rows = rows.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+            rows = list(rows.order_by(f'-{field}', '-pk')[:self.per_page + 1])
+            self.object_list = rows[:self.per_page]
+            self.has_next = len(rows) > self.per_page
+            self.has_previous = value is not None
+        else:
+            rows = rows.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+            rows = list(rows.order_by(field, 'pk')[:self.per_page + 1])
+            self.object_list = rows[:self.per_page][::-1]
+            self.has_next = True
+            self.has_previous = len(rows) > self.per_page
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _cursor(self, row, direction):
+        return encode_cursor(getattr(row, self.field), row.pk, direction)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor(self.object_list[-1], 'next')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self._cursor(self.object_list[0], 'prev')
+        return None
+
+    @cached_property
+    def count(self):
+        return approximate_count(self.queryset)
+
+
+def keyset_page(request, queryset, field, per_page):
+    """Page of ``queryset`` for the request's ``cursor`` parameter; bad cursors fall back to the first page"""
+    try:
+        return KeysetPage(queryset, field, per_page, request.GET.get('cursor'))
+    except InvalidCursor:
+        return KeysetPage(queryset, field, per_page)
@@ -0,0 +1,46 @@
+from django.core.cache import cache
+
+from app.models import UserMembership
+
+# Every write through save(), delete() or use_free_entry() drops the
+# snapshot; the TTL only bounds how stale one can get after a write that
+# bypasses them (e.g. a queryset update in a shell)
+SNAPSHOT_TTL = 15 * 60
+
+
+def get_membership(user_id):
+    """``user_id``'s membership from the shared cache, or ``None`` if they have none.
+
+    A hit is one cache read and no query; users without a membership are
+    cached too. The instance is rebuilt from the cached field values, so
+    ``is_active``, ``has_free_entry_available`` and ``can_subscribe_again``
+    behave as on a fresh read, and ``use_free_entry`` still claims against
+    the database row.
+    """
+    key = UserMembership.snapshot_key(user_id)
+    values = cache.get(key)
+    if values is None:
+        field_names = [field.attname for field in UserMembership._meta.concrete_fields]
+        row = UserMembership.objects.filter(user_id=user_id).values_list(*field_names).first()
+        values = dict(zip(field_names, row)) if row else {}
+        cache.set(key, values, SNAPSHOT_TTL)
+    if not values:
+        return None
+    # Fields added after the snapshot was cached come back deferred and load on access
+    return UserMembership.from_db(UserMembership.objects.db, list(values), list(values.values()))
+
+
+def claim_free_entry(membership):
+    """Use today's free entry on ``membership`` (from ``get_membership``) if one is left.
+
+    Only an available entry touches the database, through the conditional
+    UPDATE in ``use_free_entry``. That also refreshes the instance, so a
+    batch can call this for each entry on one instance and claim at most
+    one entry.
+    """
+    return bool(
+        membership is not None
+        and membership.status == 'active'
+        and membership.has_free_entry_available
+        and membership.use_free_entry()
+    )
@@ -0,0 +1,90 @@
+import numpy as np
+from django.utils import timezone
+
+from app.models import ParkingSlot, SlotOccupancyTimeline
+
+
+def _slot_states(at):
+    """``{slot_id: (slot_number, state)}`` at ``at``"""
+    day = timezone.localdate(at)
+    seconds = (at - SlotOccupancyTimeline.day_start(day)).total_seconds()
+    timelines = SlotOccupancyTimeline.latest(None, day)
+
+    states = {}
+    for slot_id, slot_number in ParkingSlot.objects.values_list('pk', 'slot_number'):
+        timeline = timelines.get(slot_id)
+        if timeline is None:
+            state = SlotOccupancyTimeline.FREE
+        elif timeline.date == day:
+            state = timeline.state_at(seconds)
+        else:
+            state = timeline.final_state
+        states[slot_id] = (slot_number, state)
+    return states
+
+
+def lot_state(at=None):
+    """``{slot_number: state}`` for every slot at ``at`` (default: now).
+
+    Two queries however far back ``at`` is: the slots and, per slot, the
+    latest timeline on or before that day.
+    """
+    return dict(_slot_states(at or timezone.now()).values())
+
+
+def occupancy_between(edges):
+    """Occupancy for each interval between consecutive aware ``edges``.
+
+    Each point has the occupied and reserved slot counts at the interval
+    start and ``occupancy_percent``, the time-weighted share of slots
+    occupied across the interval. The timelines are flattened into one
+    sorted array of occupied-count changes, so the cost grows with the
+    number of transitions, not with the number of intervals times slots.
+    """
+    range_start, range_end = edges[0].timestamp(), edges[-1].timestamp()
+
+    current = {slot_id: state for slot_id, (_, state) in _slot_states(edges[0]).items()}
+    total_slots = len(current)
+    occupied = sum(state == SlotOccupancyTimeline.OCCUPIED for state in current.values())
+    reserved = sum(state == SlotOccupancyTimeline.RESERVED for state in current.values())
+
+    times, occupied_deltas, reserved_deltas = [], [], []
+    timelines = SlotOccupancyTimeline.objects.filter(
+        date__gte=timezone.localdate(edges[0]), date__lte=timezone.localdate(edges[-1])
+    ).order_by('slot_id', 'date')
+    for timeline in timelines:
+        day_start = SlotOccupancyTimeline.day_start(timeline.date).timestamp()
+        changes = [(0, timeline.initial_state)] + timeline.decode()
+        for offset, state in changes:
+            moment = day_start + offset
+            if moment <= range_start or moment >= range_end:
+                continue
+            previous = current.get(timeline.slot_id, SlotOccupancyTimeline.FREE)
+            if state == previous:
+                continue
+            times.append(moment)
+            occupied_deltas.append((state == SlotOccupancyTimeline.OCCUPIED) - (previous == SlotOccupancyTimeline.OCCUPIED))
+            reserved_deltas.append((state == SlotOccupancyTimeline.RESERVED) - (previous == SlotOccupancyTimeline.RESERVED))
+            current[timeline.slot_id] = state
+
+    order = np.argsort(times, kind='stable')
+    times = np.array(times, dtype=float)[order]
+    # Breakpoints of the occupied step function and its level after each one
+    points = np.concatenate(([range_start], times))
+    occupied_levels = occupied + np.concatenate(([0], np.cumsum(np.array(occupied_deltas, dtype=np.int64)[order])))
+    reserved_levels = reserved + np.concatenate(([0], np.cumsum(np.array(reserved_deltas, dtype=np.int64)[order])))
+    area = np.concatenate(([0], np.cumsum(occupied_levels[:-1] * np.diff(points))))
+
+    edge_times = np.array([edge.timestamp() for edge in edges])
+    index = np.searchsorted(points, edge_times, side='right') - 1
+    area_at_edges = area[index] + occupied_levels[index] * (edge_times - points[index])
+    mean_occupied = np.diff(area_at_edges) / np.diff(edge_times)
+
+    return [
+        {
+            'occupied': int(occupied_levels[i]),
+            'reserved': int(reserved_levels[i]),
+            'occupancy_percent': round(float(mean) / total_slots * 100, 1) if total_slots else 0,
+        }
+        for i, mean in zip(index[:-1], mean_occupied)
+    ]
@@ -0,0 +1,169 @@
+import fcntl
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app.models import EconomicsReport, ParkingHistory, Ticket
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional analytics dependency
+    pa = pq = None
+
+CHUNK_SIZE = 50000
+
+# Rows younger than this are left for the next run, so transactions still
+# in flight when a run starts can't be skipped past
+SETTLE_TIME = timedelta(minutes=10)
+
+
+def _tables():
+    """Per-table export spec: model, columns, Arrow types and watermark rules.
+
+    Tickets change when the vehicle leaves, so they are exported once closed
+    and tracked by when the exit was recorded (``closed_at``), which also
+    picks up exits replayed late from the gate queue. History and economics
+    rows are append-only and tracked by id.
+    """
+    money = pa.decimal128(14, 2)
+    ts = pa.timestamp('us', tz='UTC')
+    return {
+        'tickets': {
+            'queryset': Ticket.objects.filter(exit_time__isnull=False),
+            'columns': [
+                ('id', pa.int64()), ('vehicle_number', pa.string()), ('plate_key', pa.string()),
+                ('slot__slot_number', pa.string()), ('booking_id', pa.int64()),
+                ('entry_time', ts), ('exit_time', ts), ('duration', pa.duration('us')),
+                ('fee_amount', money), ('fee_paid', pa.bool_()),
+            ],
+            'partition_by': 'exit_time',
+            'watermark': 'closed_at',
+        },
+        'parking_history': {
+            'queryset': ParkingHistory.objects.all(),
+            'columns': [
+                ('id', pa.int64()), ('vehicle_number', pa.string()), ('plate_key', pa.string()),
+                ('action', pa.string()), ('timestamp', ts), ('duration', pa.duration('us')),
+                ('is_prebooked', pa.bool_()), ('user_id', pa.int64()), ('ticket_id', pa.int64()),
+                ('booking_id', pa.int64()),
+            ],
+            'partition_by': 'timestamp',
+            'watermark': 'id',
+        },
+        'economics': {
+            'queryset': EconomicsReport.objects.all(),
+            'columns': [
+                ('id', pa.int64()), ('vehicle_number', pa.string()), ('plate_key', pa.string()),
+                ('amount', money), ('transaction_type', pa.string()), ('payment_method', pa.string()),
+                ('transaction_date', ts), ('is_paid', pa.bool_()), ('user_id', pa.int64()),
+                ('ticket_id', pa.int64()), ('booking_id', pa.int64()),
+            ],
+            'partition_by': 'transaction_date',
+            'watermark': 'id',
+        },
+    }
+
+
+class LedgerExporter:
+    """Incremental, month-partitioned Parquet export of the parking ledgers.
+
+    Files land in ``<ANALYTICS_EXPORT_DIR>/<table>/month=YYYY-MM/`` with one
+    new part file per month touched by each run, and the high-water mark of
+    every table is kept in ``_watermarks.json`` so a run only reads rows
+    added since the last one. Runs hold an exclusive lock on that file.
+    """
+
+    def __init__(self, out_dir=None):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for Parquet exports (pip install pyarrow)")
+        self.out_dir = str(out_dir or settings.ANALYTICS_EXPORT_DIR)
+        self.watermark_path = os.path.join(self.out_dir, '_watermarks.json')
+
+    def run(self, tables=None):
+        """Export new rows of ``tables`` (default: all) and return row counts per table"""
+        specs = _tables()
+        unknown = set(tables or []) - set(specs)
+        if unknown:
+            raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(os.path.join(self.out_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            watermarks = self.watermarks()
+            cutoff = timezone.now() - SETTLE_TIME
+            run_id = timezone.now().strftime('%Y%m%dT%H%M%S')
+            counts = {}
+            for name in tables or specs:
+                counts[name], watermarks[name] = self._export(name, specs[name], watermarks.get(name), cutoff, run_id)
+                self._save_watermarks(watermarks)
+        return counts
+
+    def watermarks(self):
+        try:
+            with open(self.watermark_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_watermarks(self, watermarks):
+        tmp_path = f"{self.watermark_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(watermarks, f, indent=2)
+        os.replace(tmp_path, self.watermark_path)
+
+    def _export(self, name, spec, watermark, cutoff, run_id):
+        field_names = [column for column, _ in spec['columns']]
+        schema = pa.schema([(column.replace('__', '_'), arrow_type) for column, arrow_type in spec['columns']])
+        partition_index = field_names.index(spec['partition_by'])
+
+        rows = spec['queryset']
+        if spec['watermark'] == 'id':
+            # A row replayed from the gate queue can carry an older timestamp
+            # than rows with lower ids, so rows are read in id order and the
+            # run stops at the first one younger than the cutoff; the
+            # watermark never passes a row that hasn't been exported
+            rows = rows.filter(id__gt=watermark or 0).order_by('id')
+        else:
+            rows = rows.filter(**{f"{spec['watermark']}__lte": cutoff})
+            if watermark:
+                rows = rows.filter(**{f"{spec['watermark']}__gt": parse_datetime(watermark)})
+            rows = rows.order_by(spec['watermark'], 'id')
+
+        writers = {}
+        buffers = {}
+        count = 0
+        last_id = watermark or 0
+        try:
+            for row in rows.values_list(*field_names).iterator(chunk_size=CHUNK_SIZE):
+                if spec['watermark'] == 'id' and row[partition_index] > cutoff:
+                    break
+                month = timezone.localtime(row[partition_index]).strftime('%Y-%m')
+                buffers.setdefault(month, []).append(row)
+                if len(buffers[month]) >= CHUNK_SIZE:
+                    self._flush(name, month, run_id, schema, buffers.pop(month), writers)
+                count += 1
+                last_id = row[0]
+            for month, buffered in buffers.items():
+                self._flush(name, month, run_id, schema, buffered, writers)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        new_watermark = last_id if spec['watermark'] == 'id' else cutoff.isoformat()
+        return count, new_watermark
+
+    def _flush(self, name, month, run_id, schema, rows, writers):
+        if month not in writers:
+            partition_dir = os.path.join(self.out_dir, name, f"month={month}")
+            os.makedirs(partition_dir, exist_ok=True)
+            writers[month] = pq.ParquetWriter(os.path.join(partition_dir, f"part-{run_id}.parquet"), schema)
+        columns = list(zip(*rows))
+        writers[month].write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
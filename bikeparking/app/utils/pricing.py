@@ -0,0 +1,155 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_cents(amount):
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+
+def _utc_offset(seconds):
+    moment = datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+    return timezone.localtime(moment).utcoffset().total_seconds()
+
+
+def _utc_offsets(seconds):
+    """Local UTC offset in seconds at each of the epoch ``seconds``, as a float array"""
+    # The offset only changes at a DST transition and no zone has two in
+    # one hour, so an hour that starts and ends on the same offset keeps it
+    # throughout. Only rows in an hour with a transition are looked up one
+    # by one; a range spanning a whole summer still gets its summer offset
+    hours, inverse = np.unique(seconds // 3600, return_inverse=True)
+    hour_offsets = np.full(len(hours), np.nan)
+    for i, hour in enumerate(hours):
+        start = _utc_offset(hour * 3600)
+        if start == _utc_offset(hour * 3600 + 3599):
+            hour_offsets[i] = start
+    offsets = hour_offsets[inverse]
+    for i in np.flatnonzero(np.isnan(offsets)):
+        offsets[i] = _utc_offset(seconds[i])
+    return offsets
+
+
+def epoch_minutes(times):
+    """Whole minutes since the epoch in UTC, as an int64 array"""
+    return (np.array([t.timestamp() for t in times], dtype=float) // 60).astype(np.int64)
+
+
+def local_minutes(times):
+    """Whole minutes since the epoch on the local wall clock, as an int64 array"""
+    times = list(times)
+    if not times:
+        return np.array([], dtype=np.int64)
+    seconds = np.array([t.timestamp() for t in times])
+    return ((seconds + _utc_offsets(seconds)) // 60).astype(np.int64)
+
+
+def _to_local(minutes):
+    """Local wall-clock minutes for UTC epoch ``minutes``"""
+    if not len(minutes):
+        return minutes
+    return minutes + (_utc_offsets(minutes * 60.0) // 60).astype(np.int64)
+
+
+class Tariff:
+    """Parking tariff evaluated in integer cents over whole minutes.
+
+    A stay is charged ``first_hour`` for its first hour and then the hourly
+    rate in force for each later minute (``peak_hourly_rate`` during
+    ``peak_hours``, given as local ``(start_hour, end_hour)`` pairs). Stays
+    no longer than ``grace_minutes`` are free, ``daily_cap`` limits the
+    charge per started 24 hours and members get ``member_discount_percent``
+    off. ``entry_fee`` is the separate charge taken at the gate.
+
+    Stays are measured in elapsed minutes, so one that crosses a DST change
+    is charged for the time actually parked; the local clock only picks
+    the rate for each minute.
+
+    Time-of-day pricing uses a cumulative per-minute rate table, so the
+    time charge for any stay is the difference of two table lookups and a
+    whole batch of stays is priced with a few array operations. The few
+    stays whose UTC offset changes are priced minute by minute instead.
+    """
+
+    def __init__(self, entry_fee='30.00', first_hour='2.00', hourly_rate='1.00', peak_hourly_rate=None,
+                 peak_hours=(), grace_minutes=0, daily_cap=None, member_discount_percent=0):
+        self.entry_fee = from_cents(to_cents(entry_fee))
+        self.first_hour = to_cents(first_hour)
+        self.grace_minutes = int(grace_minutes)
+        self.daily_cap = to_cents(daily_cap) if daily_cap is not None else None
+        self.member_discount_percent = int(member_discount_percent)
+
+        # Rate per minute in cents/60, so every entry stays an integer
+        minute_rates = np.full(MINUTES_PER_DAY, to_cents(hourly_rate), dtype=np.int64)
+        if peak_hourly_rate is not None:
+            for start_hour, end_hour in peak_hours:
+                minute_rates[start_hour * 60:end_hour * 60] = to_cents(peak_hourly_rate)
+        self._minute_rates = minute_rates
+        self._cumulative_day = np.concatenate(([0], np.cumsum(minute_rates)))
+        self._day_total = int(self._cumulative_day[-1])
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        return cls(**{**settings.PARKING_TARIFF, **overrides})
+
+    def _cumulative(self, minutes):
+        days, minute_of_day = np.divmod(minutes, MINUTES_PER_DAY)
+        return days * self._day_total + self._cumulative_day[minute_of_day]
+
+    def _timed_charge(self, start, end):
+        """Rate table total over the UTC epoch minutes from ``start`` up to ``end``"""
+        local_start, local_end = _to_local(start), _to_local(end)
+        timed = self._cumulative(local_end) - self._cumulative(local_start)
+        for i in np.flatnonzero(local_end - local_start != end - start):
+            minutes = np.arange(start[i], end[i], dtype=np.int64)
+            timed[i] = self._minute_rates[_to_local(minutes) % MINUTES_PER_DAY].sum()
+        return timed
+
+    def quote_batch(self, entry_times, exit_times, is_member=None):
+        """Fees in cents for many stays at once.
+
+        ``entry_times`` and ``exit_times`` are sequences of aware datetimes
+        (or int64 arrays of UTC epoch minutes); ``is_member`` is an optional
+        boolean array. Returns an int64 array of cents.
+        """
+        entry = entry_times if isinstance(entry_times, np.ndarray) else epoch_minutes(entry_times)
+        exit = exit_times if isinstance(exit_times, np.ndarray) else epoch_minutes(exit_times)
+        exit = np.maximum(exit, entry)
+        duration = exit - entry
+
+        timed = self._timed_charge(np.minimum(entry + 60, exit), exit)
+        cents = self.first_hour + (timed + 30) // 60
+
+        if self.daily_cap is not None:
+            days = np.maximum(1, -(-duration // MINUTES_PER_DAY))
+            cents = np.minimum(cents, days * self.daily_cap)
+        if self.member_discount_percent and is_member is not None:
+            discount = (cents * self.member_discount_percent + 50) // 100
+            cents = cents - np.where(np.asarray(is_member, dtype=bool), discount, 0)
+        if self.grace_minutes:
+            cents = np.where(duration <= self.grace_minutes, 0, cents)
+        return cents
+
+    def quote(self, entry_time, exit_time, is_member=False):
+        """Fee for a single stay as an exact Decimal"""
+        return from_cents(self.quote_batch([entry_time], [exit_time], [is_member])[0])
+
+
+_tariff = None
+
+
+def get_tariff():
+    """The tariff configured in ``settings.PARKING_TARIFF``, built once per process"""
+    global _tariff
+    if _tariff is None:
+        _tariff = Tariff.from_settings()
+    return _tariff
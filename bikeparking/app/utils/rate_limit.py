@@ -0,0 +1,92 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+STATS_KEY = 'ratelimit:rejected:{}'
+
+
+class TokenBucket:
+    """Token bucket kept in the shared cache as ``(tokens, updated_at)``.
+
+    ``capacity`` is the burst size and ``rate`` the refill in tokens per
+    second. The read-modify-write isn't atomic across workers, so under a
+    concurrent burst a few extra requests can slip through; that's fine for
+    shedding scraper load and keeps this to one get and one set per request.
+    """
+
+    def __init__(self, name, capacity, rate):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+
+    def take(self, client, now=None):
+        """Consume a token; return ``0`` if allowed, else seconds until one is free"""
+        now = time.time() if now is None else now
+        key = f"ratelimit:{self.name}:{client}"
+        tokens, updated_at = cache.get(key) or (self.capacity, now)
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / self.rate
+
+        # Expire once the bucket would have refilled anyway
+        timeout = math.ceil((self.capacity - tokens) / self.rate) + 1
+        cache.set(key, (tokens, now), timeout)
+        return wait
+
+
+def client_id(request):
+    """Authenticated users get their own bucket; everyone else shares one per IP.
+
+    The ``guest_id`` cookie isn't used here since clients can drop it to get a
+    fresh bucket.
+    """
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def rate_limit(name):
+    """Reject requests over the ``settings.RATE_LIMITS[name]`` budget with a 429"""
+    capacity, per_minute = settings.RATE_LIMITS[name]
+    bucket = TokenBucket(name, capacity, per_minute / 60)
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            wait = bucket.take(client_id(request))
+            if wait:
+                record_rejection(name)
+                response = JsonResponse({
+                    'success': False,
+                    'error': 'Too many requests, please slow down'
+                }, status=429)
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+            return view_func(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def record_rejection(name):
+    key = STATS_KEY.format(name)
+    # add() is a no-op if the counter exists; incr() is atomic on shared backends
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def rejection_counts():
+    """Rejected request counts per limited endpoint since the cache was cleared"""
+    keys = {name: STATS_KEY.format(name) for name in settings.RATE_LIMITS}
+    values = cache.get_many(keys.values())
+    return {name: values.get(key, 0) for name, key in keys.items()}
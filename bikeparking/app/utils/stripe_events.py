@@ -0,0 +1,116 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import StripeEvent, UserMembership
+
+
+def safe_from_timestamp(timestamp):
+    """Aware UTC datetime for a Unix ``timestamp``, or ``None`` if it's missing or invalid"""
+    if timestamp:
+        try:
+            return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        except (TypeError, ValueError, OverflowError):
+            return None
+    return None
+
+
+def _period(subscription, name):
+    # Newer API versions report the billing period per subscription item
+    value = subscription.get(name)
+    if value is None:
+        items = (subscription.get('items') or {}).get('data') or [{}]
+        value = items[0].get(name)
+    return safe_from_timestamp(value)
+
+
+def _membership_for_event(subscription, created):
+    """The membership an event created at ``created`` should change, or ``None``
+
+    Batches are applied in ``created`` order, but an event Stripe delivers
+    late lands in a later batch; one older than the last event applied to
+    the membership would roll it back, so it's skipped.
+    """
+    try:
+        membership = UserMembership.objects.select_for_update().get(stripe_subscription_id=subscription['id'])
+    except UserMembership.DoesNotExist:
+        return None
+    if membership.stripe_event_created and created < membership.stripe_event_created:
+        return None
+    membership.stripe_event_created = created
+    return membership
+
+
+def handle_subscription_update(subscription, created):
+    """Update UserMembership when subscription changes"""
+    membership = _membership_for_event(subscription, created)
+    if membership is None:
+        return
+
+    membership.status = subscription['status']
+    membership.current_period_start = _period(subscription, 'current_period_start')
+    membership.current_period_end = _period(subscription, 'current_period_end')
+    membership.cancel_at_period_end = subscription.get('cancel_at_period_end', False)
+    # save() drops the cached membership snapshot
+    membership.save()
+
+
+def handle_subscription_cancellation(subscription, created):
+    """Handle subscription cancellation"""
+    membership = _membership_for_event(subscription, created)
+    if membership is None:
+        return
+
+    membership.status = 'canceled'
+    membership.save()
+
+
+# Event types that change local state; anything else is stored and marked done
+HANDLERS = {
+    'customer.subscription.updated': handle_subscription_update,
+    'customer.subscription.deleted': handle_subscription_cancellation,
+}
+
+
+def apply_event(event):
+    handler = HANDLERS.get(event.event_type)
+    if handler is not None:
+        handler(event.payload['data']['object'], event.created)
+
+
+def process_pending_events(limit=50):
+    """Apply pending ``StripeEvent`` rows in the order Stripe created them.
+
+    The batch is locked for the duration, so a second worker waits instead
+    of applying later events first. Each event runs in its own savepoint;
+    one that raises stays pending and ends the batch, so later events for
+    the same subscription can't overtake it, until it has failed
+    ``StripeEvent.MAX_ATTEMPTS`` times and is set aside as failed.
+
+    Returns the events handled in this batch.
+    """
+    handled = []
+    with transaction.atomic():
+        events = (
+            StripeEvent.objects.select_for_update()
+            .filter(status='pending')
+            .order_by('created', 'id')[:limit]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    apply_event(event)
+                event.status = 'done'
+                event.last_error = ''
+                event.processed_at = timezone.now()
+            except Exception as e:
+                event.last_error = str(e)
+                if event.attempts >= StripeEvent.MAX_ATTEMPTS:
+                    event.status = 'failed'
+            event.save(update_fields=['status', 'attempts', 'last_error', 'processed_at'])
+            handled.append(event)
+            if event.status == 'pending':
+                break
+    return handled
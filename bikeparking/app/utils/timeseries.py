@@ -0,0 +1,197 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+
+from app.models import EconomicsReport, ParkingSlot, RevenueDailyRollup, Ticket
+from app.utils.occupancy import occupancy_between
+
+GRANULARITIES = {
+    '5min': timedelta(minutes=5),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+# Longest series a single request may ask for (a year of hourly points fits)
+MAX_POINTS = 10000
+
+# Series that end before the current bucket only change on late writes
+# (e.g. gate queue replays), so they are kept longer than ones still filling
+CLOSED_SERIES_TTL = 60 * 60
+OPEN_SERIES_TTL = 60
+
+
+def floor_bucket(moment, granularity):
+    """Start of the local ``granularity`` bucket containing ``moment``, as a naive local datetime"""
+    local = timezone.localtime(moment).replace(tzinfo=None)
+    if granularity == 'day':
+        return datetime.combine(local.date(), time.min)
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    return local.replace(minute=local.minute - local.minute % 5, second=0, microsecond=0)
+
+
+def bucket_end(moment, granularity):
+    """Aware end of the bucket containing ``moment``, so open-ended ranges share cache keys"""
+    return timezone.make_aware(floor_bucket(moment, granularity) + GRANULARITIES[granularity])
+
+
+def _exists(local):
+    """Whether the naive local ``local`` is a wall-clock time that actually occurs"""
+    # Through UTC, since astimezone() to the same zone returns the value unchanged
+    utc = timezone.make_aware(local).astimezone(dt_timezone.utc)
+    return timezone.localtime(utc).replace(tzinfo=None) == local
+
+
+def bucket_starts(start, end, granularity):
+    """Naive local bucket starts covering ``[start, end)``.
+
+    Hour and five-minute buckets skipped by a DST change are left out, so
+    every bucket has a real length; the hour repeated when clocks go back
+    is one bucket twice as long.
+    """
+    step = GRANULARITIES[granularity]
+    first = floor_bucket(start, granularity)
+    last = floor_bucket(end - timedelta(microseconds=1), granularity)
+    count = int((last - first) / step) + 1
+    if count > MAX_POINTS:
+        raise ValueError(f"Range needs {count} {granularity} points; the limit is {MAX_POINTS}")
+    buckets = [first + step * i for i in range(count)]
+    if granularity == 'day':
+        return buckets
+
+    # Only days whose UTC offset changes by the next midnight can have gaps
+    offsets = [
+        timezone.make_aware(datetime.combine(first.date() + timedelta(days=i), time.min)).utcoffset()
+        for i in range((last.date() - first.date()).days + 2)
+    ]
+    changing = {first.date() + timedelta(days=i) for i in range(len(offsets) - 1) if offsets[i] != offsets[i + 1]}
+    if not changing:
+        return buckets
+    return [bucket for bucket in buckets if bucket.date() not in changing or _exists(bucket)]
+
+
+def _grouped(queryset, field, granularity, **aggregates):
+    """``{naive local bucket: row}`` for ``queryset`` grouped by ``field``.
+
+    Hour and day buckets come straight from the database; five-minute
+    buckets are grouped per minute there and folded together here.
+    """
+    trunc = {'day': TruncDay, 'hour': TruncHour, '5min': TruncMinute}[granularity]
+    rows = (
+        queryset.annotate(bucket=trunc(field, tzinfo=timezone.get_current_timezone()))
+        .values('bucket')
+        .annotate(**aggregates)
+        .order_by()
+    )
+    grouped = {}
+    for row in rows:
+        # Trunc returns the bucket already in the local timezone
+        key = row.pop('bucket').replace(tzinfo=None)
+        if granularity == '5min':
+            key = key.replace(minute=key.minute - key.minute % 5)
+        if key in grouped:
+            for name, value in row.items():
+                grouped[key][name] += value
+        else:
+            grouped[key] = row
+    return grouped
+
+
+def revenue_series(start, end, granularity):
+    """Paid revenue and transaction count per bucket over ``[start, end)``.
+
+    Daily series are read from ``RevenueDailyRollup``; finer ones group the
+    ledger directly.
+    """
+    buckets = bucket_starts(start, end, granularity)
+    if granularity == 'day':
+        rows = (
+            RevenueDailyRollup.objects
+            .filter(is_paid=True, date__gte=buckets[0].date(), date__lte=buckets[-1].date())
+            .values('date')
+            .annotate(revenue=Sum('total_amount'), transactions=Sum('transaction_count'))
+            .order_by()
+        )
+        grouped = {datetime.combine(row.pop('date'), time.min): row for row in rows}
+    else:
+        grouped = _grouped(
+            EconomicsReport.objects.filter(is_paid=True, transaction_date__gte=start, transaction_date__lt=end),
+            'transaction_date', granularity,
+            revenue=Sum('amount'), transactions=Count('id'),
+        )
+
+    series = []
+    for bucket in buckets:
+        row = grouped.get(bucket, {})
+        series.append({
+            'start': bucket.isoformat(),
+            'revenue': float(row.get('revenue') or 0),
+            'transactions': row.get('transactions') or 0,
+        })
+    return series
+
+
+def occupancy_series(start, end, granularity):
+    """Vehicle entries, exits and occupied slots per bucket over ``[start, end)``.
+
+    ``occupied`` is the number of parked vehicles at the end of each bucket:
+    the tickets open at ``start`` plus a running sum of entries minus exits.
+    """
+    buckets = bucket_starts(start, end, granularity)
+    total_slots = ParkingSlot.objects.count()
+
+    parked = Ticket.objects.filter(entry_time__lt=start).exclude(exit_time__lt=start).count()
+    entries = _grouped(
+        Ticket.objects.filter(entry_time__gte=start, entry_time__lt=end),
+        'entry_time', granularity, count=Count('id'),
+    )
+    exits = _grouped(
+        Ticket.objects.filter(exit_time__gte=start, exit_time__lt=end),
+        'exit_time', granularity, count=Count('id'),
+    )
+
+    series = []
+    for bucket in buckets:
+        entered = entries.get(bucket, {}).get('count', 0)
+        left = exits.get(bucket, {}).get('count', 0)
+        parked += entered - left
+        series.append({
+            'start': bucket.isoformat(),
+            'entries': entered,
+            'exits': left,
+            'occupied': parked,
+            'occupancy_rate': round(parked / total_slots * 100, 1) if total_slots else 0,
+        })
+    return series
+
+
+def slot_occupancy_series(start, end, granularity):
+    """Per-bucket slot occupancy over ``[start, end)`` read from ``SlotOccupancyTimeline``"""
+    buckets = bucket_starts(start, end, granularity)
+    edges = [timezone.make_aware(bucket) for bucket in buckets]
+    edges.append(edges[-1] + GRANULARITIES[granularity])
+    return [
+        {'start': bucket.isoformat(), **point}
+        for bucket, point in zip(buckets, occupancy_between(edges))
+    ]
+
+
+SERIES = {
+    'revenue': revenue_series,
+    'occupancy': occupancy_series,
+    'slots': slot_occupancy_series,
+}
+
+
+def cached_series(name, start, end, granularity):
+    """``SERIES[name]`` for the range, cached by (series, range, granularity)"""
+    key = f"timeseries:{name}:{granularity}:{start.timestamp():.0f}:{end.timestamp():.0f}"
+    series = cache.get(key)
+    if series is None:
+        series = SERIES[name](start, end, granularity)
+        closed = end <= timezone.now()
+        cache.set(key, series, CLOSED_SERIES_TTL if closed else OPEN_SERIES_TTL)
+    return series
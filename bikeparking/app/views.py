@@ -3,25 +3,40 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.utils import timezone
 from django.urls import reverse 
 from datetime import timedelta, datetime
-from .models import ParkingSlot, Booking, Ticket, ParkingHistory, EconomicsReport, UserActivityLog, UserMembership, MembershipPlan
+from .models import ParkingSlot, Booking, Ticket, ParkingHistory, EconomicsReport, UserActivityLog, UserMembership, MembershipPlan, IdempotencyKey, RevenueDailyRollup, SlotOccupancyTimeline, StripeEvent, normalize_plate
 from .forms import *
 from django.contrib import messages
 import cv2
 from django.http import StreamingHttpResponse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import StreamingHttpResponse, JsonResponse
+from django.http import StreamingHttpResponse, JsonResponse, FileResponse, Http404
 from django.contrib.auth.forms import AuthenticationForm
+import hashlib
+import logging
 import uuid
+from functools import wraps
+from .utils.rate_limit import rate_limit, rejection_counts
+from .utils.gate_events import process_gate_events, process_manual_entry, process_manual_exit
+from .utils.gate_queue import GateQueue
+from .utils.pricing import get_tariff
+from .utils.csv_export import CHUNK_SIZE as CSV_CHUNK_SIZE, streaming_csv_response
+from .utils.parquet_export import LedgerExporter
+from .utils.keyset import approximate_count, keyset_page
+from .utils.timeseries import GRANULARITIES, SERIES as TIMESERIES, bucket_end, cached_series, floor_bucket
+from .utils.occupancy import lot_state
+from .utils.membership_cache import claim_free_entry, get_membership
 from django.views.decorators.http import require_GET
-from django.db import transaction
+from django.db import transaction, IntegrityError, OperationalError, InterfaceError
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.admin.views.decorators import staff_member_required
 from .models import GuestUser
 from django.core.paginator import Paginator
 from django.db.models import Q, Sum, Count
 import csv
-from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.csrf import csrf_exempt
+from django.core import signing
+from django.utils.crypto import constant_time_compare
 from ultralytics import YOLO
 import cv2
 from reportlab.pdfgen import canvas
@@ -38,12 +53,15 @@ from django.conf import settings
 # ==============================
 # CONFIGURATION
 # ==============================
-BOOKING_EXPIRY_MINUTES = 15
+logger = logging.getLogger(__name__)
+
+BOOKING_EXPIRY_MINUTES = Booking.EXPIRY_MINUTES
 TOTAL_SLOTS = 26
 
 # ===== ADD THESE NEW CONFIGURATIONS =====
 MAX_BOOKABLE_SLOTS_PERCENT = 30  # Only 30% of slots can be booked
 MAX_OCCUPANCY_FOR_BOOKING_PERCENT = 60  # Disable booking when 60% occupied
+MAX_GATE_EVENT_BATCH = 500  # Events accepted per gate_events_batch request
 # ========================================
 
 # Calculate actual numbers from percentages
@@ -147,10 +165,10 @@ def update_parking_metrics():
             'last_updated': timezone.now()  # Update the timestamp
         })
         
-        print(f"🔄 Parking metrics updated at {timezone.now().strftime('%H:%M:%S')} - Available: {available_slots}, Occupied: {occupied_slots}")
+        logger.debug("Parking metrics updated - available: %s, occupied: %s", available_slots, occupied_slots)
         
-    except Exception as e:
-        print(f"Error updating parking metrics: {e}")
+    except Exception:
+        logger.exception("Error updating parking metrics")
 
 def get_cached_parking_metrics():
     """Get cached parking metrics with automatic 5-second update if needed"""
@@ -167,6 +185,70 @@ def get_cached_parking_metrics():
 def staff_required(view_func):
     return user_passes_test(lambda u: u.is_staff)(view_func)
 
+def idempotent(scope):
+    """Replay the first response for a repeated ``Idempotency-Key`` header.
+
+    Keys are scoped to the user (or guest cookie) so clients can't read each
+    other's responses; guests without a ``guest_id`` cookie can't use them.
+    A key reused with a different body gets a 422, and a duplicate that
+    arrives while the first request is still running gets a 409 until the
+    first one's lease runs out. 5xx and 429 responses are not stored so
+    retries run again. Apply it outside ``rate_limit`` so replays don't
+    spend tokens.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            key = request.headers.get('Idempotency-Key', '').strip()
+            if request.method != 'POST' or not key:
+                return view_func(request, *args, **kwargs)
+
+            if request.user.is_authenticated:
+                owner = f"user:{request.user.pk}"
+            elif request.COOKIES.get('guest_id'):
+                owner = f"guest:{request.COOKIES['guest_id']}"
+            else:
+                return JsonResponse({
+                    'success': False,
+                    'errors': {'__all__': ['Idempotency-Key requires signing in or a guest_id cookie']}
+                }, status=400)
+
+            request_hash = hashlib.sha256(request.body).hexdigest()
+            record, created = IdempotencyKey.claim(f"{scope}:{owner}", key[:255], request_hash)
+            if not created:
+                if record.request_hash != request_hash:
+                    return JsonResponse({
+                        'success': False,
+                        'errors': {'__all__': ['Idempotency-Key was already used with a different request']}
+                    }, status=422)
+                if record.status_code is None:
+                    response = JsonResponse({
+                        'success': False,
+                        'errors': {'__all__': ['A request with this Idempotency-Key is already in progress']}
+                    }, status=409)
+                    response['Retry-After'] = '1'
+                    return response
+                response = HttpResponse(record.response_body, status=record.status_code,
+                                        content_type='application/json')
+                response['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            if response.status_code >= 500 or response.status_code == 429:
+                record.delete()
+            else:
+                record.status_code = response.status_code
+                record.response_body = response.content.decode()
+                record.save(update_fields=['status_code', 'response_body'])
+            return response
+        return wrapped
+    return decorator
+
 # ==============================
 # AUTHENTICATION & CORE VIEWS
 # ==============================
@@ -175,22 +257,9 @@ def staff_required(view_func):
 def profile(request):
     now = timezone.now()
     
-    # Get user's bookings with status handling
+    # Expiry is handled by the run_booking_scheduler command
     bookings = Booking.objects.filter(user=request.user).order_by('-booked_at')
     
-    # Process expired bookings
-    for booking in bookings:
-        if (
-            booking.status == 'confirmed' and 
-            booking.start_time + timedelta(minutes=BOOKING_EXPIRY_MINUTES) < now and
-            not booking.vehicle_arrived
-        ):
-            booking.status = 'expired'
-            if booking.slot:
-                booking.slot.is_reserved = False
-                booking.slot.save()
-            booking.save()
-    
     context = {
         'bookings': bookings,
         'now': now,
@@ -201,9 +270,6 @@ def home(request):
     """Home view for guest and logged-in users"""
     guest_id = generate_guest_id(request)
     
-    # Process expired bookings
-    process_expired_bookings()
-    
     # Get booking availability
     booking_availability = get_booking_availability()
     
@@ -271,7 +337,7 @@ def validate_vehicle_number_server(vehicle_number):
     Server-side validation for vehicle numbers
     """
     # Remove spaces and convert to uppercase
-    cleaned = re.sub(r'\s+', '', vehicle_number).upper()
+    cleaned = normalize_plate(vehicle_number)
     
     # Check length
     if len(cleaned) > 10:
@@ -292,6 +358,8 @@ def validate_vehicle_number_server(vehicle_number):
 # ==============================
 
 @csrf_exempt
+@idempotent('book_slot')
+@rate_limit('book_slot')
 def book_slot(request):
     """Handle slot booking with dynamic availability and limits"""
     if request.method == 'POST':
@@ -352,35 +420,37 @@ def book_slot(request):
             start_time_dt = timezone.now()
             end_time_dt = start_time_dt + timedelta(minutes=BOOKING_EXPIRY_MINUTES)
             
-            # Find available slot
-            slot = find_available_slot(start_time_dt, end_time_dt)
-            
-            if not slot:
-                response_data['success'] = False
-                response_data['errors'] = {'__all__': ['No available parking slots']}
-                return JsonResponse(response_data)
-            
-            # Create booking
-            booking = Booking.objects.create(
-                user=request.user if request.user.is_authenticated else None,
-                slot=slot,
-                vehicle_number=cleaned_vehicle_number,
-                start_time=start_time_dt,
-                end_time=end_time_dt,
-                guest_email=guest_email,
-                guest_phone=guest_phone,
-                status='confirmed'
-            )
-            
-            # Reserve the slot
-            slot.is_reserved = True
-            slot.save()
+            with transaction.atomic():
+                # Find and lock an available slot
+                slot = find_available_slot(start_time_dt, end_time_dt)
+                
+                if not slot:
+                    response_data['success'] = False
+                    response_data['errors'] = {'__all__': ['No available parking slots']}
+                    return JsonResponse(response_data)
+                
+                # Create booking (reserves the locked slot)
+                booking = Booking.objects.create(
+                    user=request.user if request.user.is_authenticated else None,
+                    slot=slot,
+                    vehicle_number=cleaned_vehicle_number,
+                    start_time=start_time_dt,
+                    end_time=end_time_dt,
+                    guest_email=guest_email,
+                    guest_phone=guest_phone,
+                    status='confirmed'
+                )
             
             # Update cache immediately after booking
             update_parking_metrics()
             
             response_data['success'] = True
             response_data['redirect_url'] = reverse('booking_confirmation', args=[booking.id])
+            response_data['artifact_status'] = booking.artifact_status
+            # Tokenised so guests, who have no account to check against, can fetch them too
+            response_data['status_url'] = artifact_url('booking_artifacts_status', booking)
+            response_data['qr_code_url'] = artifact_url('booking_qr_code', booking)
+            response_data['booking_slip_url'] = artifact_url('booking_slip', booking)
             return JsonResponse(response_data)
             
         except Exception as e:
@@ -426,7 +496,11 @@ def validate_booking_data(request, vehicle_number, start_time, end_time, user):
     return errors
 
 def find_available_slot(start_time, end_time):
-    """Find available slot considering existing bookings and booking limits"""
+    """Lock and return a free slot considering existing bookings and booking limits.
+
+    Must be called inside ``transaction.atomic()`` so the row lock is held
+    until the booking that reserves the slot is committed.
+    """
     # Get booking availability
     booking_availability = get_booking_availability()
     
@@ -434,56 +508,98 @@ def find_available_slot(start_time, end_time):
     if not booking_availability['booking_enabled'] or booking_availability['available_for_booking'] <= 0:
         return None
     
-    # Get all slots
-    all_slots = ParkingSlot.objects.all()
-    
-    # Find slots that are not occupied and don't have conflicting bookings
-    available_slots = []
-    for slot in all_slots:
-        if slot.is_occupied:
-            continue
-            
-        # Check for conflicting bookings
-        conflicting_booking = Booking.objects.filter(
-            slot=slot,
-            status__in=['confirmed', 'active'],
-            start_time__lt=end_time,
-            end_time__gt=start_time
-        ).exists()
-        
-        if not conflicting_booking:
-            available_slots.append(slot)
-    
-    return available_slots[0] if available_slots else None
-
-def process_expired_bookings():
-    """Process bookings that have expired"""
-    now = timezone.now()
-    expired_bookings = Booking.objects.filter(
-        status='confirmed',
-        start_time__lte=now - timedelta(minutes=BOOKING_EXPIRY_MINUTES),
-        vehicle_arrived=False
-    )
+    # Skips slots locked by concurrent bookers instead of waiting on them
+    available_slots = ParkingSlot.lock_free_slots(start_time=start_time, end_time=end_time)
+    if not available_slots:
+        return None
     
-    for booking in expired_bookings:
-        booking.status = 'expired'
-        if booking.slot:
-            booking.slot.is_reserved = False
-            booking.slot.save()
-        booking.save()
+    # The cached figures above can be seconds old and are shared by every
+    # concurrent booker, so re-check the limits against committed rows
+    total_slots, occupied_slots, reserved_slots = ParkingSlot.lock_booking_counts()
+    if total_slots and occupied_slots / total_slots * 100 >= MAX_OCCUPANCY_FOR_BOOKING_PERCENT:
+        return None
+    if reserved_slots >= MAX_BOOKABLE_SLOTS:
+        return None
     
-    # Update cache after processing expired bookings
-    update_parking_metrics()
+    return available_slots[0]
 
 @login_required
 def booking_confirmation(request, booking_id):
     booking = get_object_or_404(Booking, id=booking_id)
     return render(request, 'user/userconfirmation.html', {'booking': booking})
 
+ARTIFACT_TOKEN_SALT = 'app.artifacts'
+
+def artifact_token(obj):
+    """Signature letting whoever holds it fetch ``obj``'s QR code and slip without logging in"""
+    return signing.Signer(salt=ARTIFACT_TOKEN_SALT).signature(f"{obj._meta.model_name}:{obj.pk}")
+
+def artifact_url(name, obj):
+    return f"{reverse(name, args=[obj.pk])}?token={artifact_token(obj)}"
+
+def check_artifact_access(request, obj, owner_id):
+    """Raise 404 unless the request may see ``obj``'s artifacts.
+
+    Staff and the owning user always may; anyone else, guests included,
+    needs the signed ``token`` handed out when the booking was made.
+    """
+    user = request.user
+    if user.is_authenticated and (user.is_staff or user.pk == owner_id):
+        return
+    if not constant_time_compare(request.GET.get('token', ''), artifact_token(obj)):
+        raise Http404
+
+def booking_artifacts_status(request, booking_id):
+    """Report whether the booking's QR code and slip have been rendered yet"""
+    booking = get_object_or_404(Booking, id=booking_id)
+    check_artifact_access(request, booking, booking.user_id)
+    return JsonResponse({
+        'booking_id': booking.id,
+        'artifact_status': booking.artifact_status,
+        'qr_code_url': artifact_url('booking_qr_code', booking),
+        'booking_slip_url': artifact_url('booking_slip', booking),
+    })
+
+def serve_artifact(request, obj, field_name, content_type, download_name=None):
+    """Serve a QR code / slip file, rendering it on first request.
+
+    Files are content-addressed, so the hash doubles as a strong ETag and
+    repeat requests are answered from the stored file or with a 304.
+    """
+    etag = f'"{obj.artifact_key()}"'
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponse(status=304)
+    else:
+        obj = obj.ensure_artifacts()
+        response = FileResponse(
+            getattr(obj, field_name).open('rb'),
+            content_type=content_type,
+            as_attachment=download_name is not None,
+            filename=download_name
+        )
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+def booking_qr_code(request, booking_id):
+    booking = get_object_or_404(Booking.objects.select_related('slot'), id=booking_id)
+    check_artifact_access(request, booking, booking.user_id)
+    return serve_artifact(request, booking, 'qr_code', 'image/png')
+
+def booking_slip(request, booking_id):
+    booking = get_object_or_404(Booking.objects.select_related('slot'), id=booking_id)
+    check_artifact_access(request, booking, booking.user_id)
+    return serve_artifact(request, booking, 'booking_slip', 'application/pdf',
+                          download_name=f'booking_{booking.id}_slip.pdf')
+
+def ticket_qr_code(request, ticket_id):
+    ticket = get_object_or_404(Ticket.objects.select_related('booking'), id=ticket_id)
+    check_artifact_access(request, ticket, ticket.booking.user_id if ticket.booking else None)
+    return serve_artifact(request, ticket, 'qr_code', 'image/png')
+
 @login_required
 def my_bookings(request):
     now = timezone.now()
-    process_expired_bookings()
     
     # Get user's bookings
     bookings = Booking.objects.filter(user=request.user).order_by('-booked_at')
@@ -753,20 +869,12 @@ def get_parking_metrics(request):
 @staff_member_required
 def admin_dashboard(request):
     """Main admin dashboard view"""
-    process_expired_bookings()
-    
     # Use cached metrics for better performance
     metrics = get_cached_parking_metrics()
     
-    # Get economics data
-    today_revenue = EconomicsReport.objects.filter(
-        transaction_date__date=timezone.now().date(),
-        is_paid=True
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    total_revenue = EconomicsReport.objects.filter(is_paid=True).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+    # Get economics data from the daily rollup
+    today_revenue = RevenueDailyRollup.totals(date=timezone.localdate(), is_paid=True)['total']
+    total_revenue = RevenueDailyRollup.totals(is_paid=True)['total']
     
     # Format slots for template using cached data
     formatted_slots = []
@@ -859,6 +967,18 @@ def mark_vehicle_arrived(self):
         return True
     return False
 
+def parse_gate_timestamp(value):
+    """Parse an ISO timestamp sent by a gate, falling back to the current time"""
+    try:
+        timestamp = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        return timezone.now()
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
 @login_required
 @staff_member_required
 @csrf_exempt
@@ -871,11 +991,6 @@ def admin_manual_entry(request):
             booking_id = request.POST.get('booking_id', '').strip()
             timestamp_str = request.POST.get('timestamp', '').strip()
             
-            print(f"Processing manual {action} for vehicle: {vehicle_number}")
-            print(f"Booking ID received: '{booking_id}'")
-            print(f"Timestamp received: '{timestamp_str}'")
-            print(f"All POST data: {dict(request.POST)}")
-            
             # Validate required fields
             if not vehicle_number:
                 return JsonResponse({
@@ -900,21 +1015,12 @@ def admin_manual_entry(request):
             # Use cleaned vehicle number
             cleaned_vehicle_number = validation_result
             
-            # Parse timestamp if provided, otherwise use current time
-            if timestamp_str:
-                try:
-                    from datetime import datetime
-                    timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                    if timezone.is_naive(timestamp):
-                        timestamp = timezone.make_aware(timestamp)
-                except (ValueError, TypeError):
-                    timestamp = timezone.now()
-            else:
-                timestamp = timezone.now()
+            timestamp = parse_gate_timestamp(timestamp_str)
             
             if action == 'entry':
                 # Process vehicle entry
                 result = process_manual_entry(cleaned_vehicle_number, booking_id, request.user, timestamp)
+                update_parking_metrics()
                 
                 return JsonResponse({
                     'status': 'success',
@@ -929,6 +1035,7 @@ def admin_manual_entry(request):
             elif action == 'exit':
                 # Process vehicle exit
                 result = process_manual_exit(cleaned_vehicle_number, request.user, timestamp)
+                update_parking_metrics()
                 
                 return JsonResponse({
                     'status': 'success',
@@ -936,16 +1043,25 @@ def admin_manual_entry(request):
                     'action': 'exit'
                 })
                 
+        except (OperationalError, InterfaceError):
+            # Database unreachable: keep the event on the gate host and let
+            # replay_gate_queue record it once the database is back
+            logger.warning("Database unavailable, queueing manual %s for %s", action, cleaned_vehicle_number)
+            event_id = GateQueue().append(cleaned_vehicle_number, action, timestamp, request.user.pk, booking_id=booking_id)
+            return JsonResponse({
+                'status': 'queued',
+                'message': f'Database unavailable. {action.capitalize()} for {cleaned_vehicle_number} was saved on this gate and will be recorded automatically.',
+                'action': action,
+                'event_id': event_id
+            }, status=202)
         except ValueError as e:
-            print(f"ValueError in admin_manual_entry: {str(e)}")
+            logger.info("Manual %s rejected for %s: %s", action, vehicle_number, e)
             return JsonResponse({
                 'status': 'error',
                 'message': str(e)
             }, status=400)
         except Exception as e:
-            print(f"Unexpected error in admin_manual_entry: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Unexpected error in admin_manual_entry")
             return JsonResponse({
                 'status': 'error',
                 'message': f'An unexpected error occurred: {str(e)}'
@@ -966,7 +1082,64 @@ def admin_manual_entry(request):
     
     return render(request, 'dashboard/manual_entry.html', context)
 
+@login_required
+@staff_member_required
+@csrf_exempt
+@require_POST
+def gate_events_batch(request):
+    """Record a batch of gate entry/exit events and return a result per event.
+
+    Expects ``{"events": [{"vehicle_number", "action", "timestamp", "event_id"}, ...]}``
+    where ``event_id`` is optional and makes retries safe; results come back
+    in the same order as the events.
+    """
+    try:
+        events = json.loads(request.body).get('events')
+    except (ValueError, AttributeError):
+        events = None
+    if not isinstance(events, list) or not events:
+        return JsonResponse({'status': 'error', 'message': 'A non-empty "events" list is required.'}, status=400)
+    if len(events) > MAX_GATE_EVENT_BATCH:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'At most {MAX_GATE_EVENT_BATCH} events can be sent at once.'
+        }, status=400)
+
+    results = {}
+    valid_events = []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            results[index] = {'success': False, 'error': 'Event must be an object'}
+            continue
+        action = str(event.get('action', '')).strip()
+        if action not in ['entry', 'exit']:
+            results[index] = {'success': False, 'error': 'Valid action (entry/exit) is required.'}
+            continue
+        is_valid, validation_result = validate_vehicle_number_server(str(event.get('vehicle_number') or ''))
+        if not is_valid:
+            results[index] = {'success': False, 'error': validation_result}
+            continue
+        valid_events.append({
+            'index': index,
+            'event_id': str(event.get('event_id') or '')[:64],
+            'vehicle_number': validation_result,
+            'action': action,
+            'timestamp': parse_gate_timestamp(event.get('timestamp')),
+        })
+
+    try:
+        results.update(process_gate_events(valid_events, request.user))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=409)
+
+    update_parking_metrics()
+    return JsonResponse({
+        'status': 'success',
+        'results': [dict(results[index], index=index) for index in range(len(events))],
+    })
+
 @require_GET
+@rate_limit('check_vehicle_status')
 def check_vehicle_status(request):
     """Check if a vehicle is already parked"""
     vehicle_number = request.GET.get('vehicle_number', '').strip()
@@ -979,7 +1152,7 @@ def check_vehicle_status(request):
     
     # Check if vehicle has an active ticket (not exited yet)
     active_ticket = Ticket.objects.filter(
-        vehicle_number__iexact=vehicle_number,
+        plate_key=normalize_plate(vehicle_number),
         exit_time__isnull=True  # Vehicle hasn't exited yet
     ).first()
     
@@ -998,174 +1171,6 @@ def check_vehicle_status(request):
             'message': 'Vehicle is not currently parked'
         })
 
-def process_manual_entry(vehicle_number, booking_id, user, timestamp):
-    """Process manual vehicle entry with receipt generation and economic tracking"""
-    try:
-        with transaction.atomic():
-            slot = None
-            booking = None
-            
-            print(f"Processing entry for vehicle: {vehicle_number}")
-            print(f"Booking ID provided: '{booking_id}'")
-            print(f"Processing user: {user.username}")
-            
-            # Check if vehicle already has an active ticket (not exited yet)
-            active_ticket = Ticket.objects.filter(
-                vehicle_number__iexact=vehicle_number.strip(),
-                exit_time__isnull=True  # Vehicle hasn't exited yet
-            ).first()
-            
-            if active_ticket:
-                raise ValueError(f"Vehicle {vehicle_number} is already parked in Slot {active_ticket.slot.slot_number}. Please exit the vehicle first.")
-            
-            # Check for active booking
-            active_bookings = Booking.objects.filter(
-                vehicle_number__iexact=vehicle_number.strip(),
-                status__in=['confirmed', 'active']
-            )
-            
-            if active_bookings.exists():
-                booking = active_bookings.first()
-                print(f"Found active booking: {booking.id} for vehicle {vehicle_number}")
-                slot = booking.slot
-                
-                if slot and slot.is_occupied:
-                    raise ValueError(f"Booked slot {slot.slot_number} is already occupied")
-            
-            elif booking_id and booking_id.strip():
-                try:
-                    booking = Booking.objects.get(id=booking_id, status__in=['confirmed', 'active'])
-                    slot = booking.slot
-                    if slot and slot.is_occupied:
-                        raise ValueError(f"Booked slot {slot.slot_number} is already occupied")
-                except Booking.DoesNotExist:
-                    raise ValueError("Invalid booking ID or booking is not active")
-            
-            if not slot:
-                slot = ParkingSlot.objects.filter(
-                    is_occupied=False,
-                    is_reserved=False
-                ).first()
-                if not slot:
-                    raise ValueError("No available parking slots")
-            
-            # Occupy the slot
-            slot.is_occupied = True
-            slot.is_reserved = False
-            slot.save()
-            
-            # Update booking if exists
-            if booking:
-                booking.vehicle_arrived = True
-                booking.status = 'active'
-                booking.save()
-            
-            # ===== FIX: ALWAYS PASS THE STAFF USER =====
-            # For manual entries by staff, always use the staff user
-            entry_user = user  # This is the staff user processing the entry
-            print(f"Using staff user for economic record: {entry_user.username}")
-            # ============================================
-            
-            # Create ticket (this will generate QR code automatically)
-            ticket = Ticket.objects.create(
-                vehicle_number=vehicle_number,
-                slot=slot,
-                booking=booking,
-                entry_time=timestamp
-            )
-            
-            # ===== CRITICAL FIX: Pass is_paid parameter =====
-            economic_record = create_economic_record(
-            vehicle_number=vehicle_number,
-            amount=30.00,
-            transaction_type='entry_fee',
-            ticket=ticket,
-            booking=booking,
-            payment_method='cash',
-            user=entry_user,
-            is_paid=True
-        )
-
-            
-            print(f"DEBUG: Created economic record: {economic_record.id if economic_record else 'None'}")
-            if economic_record:
-                print(f"DEBUG: Economic record ID: {economic_record.id}")
-                print(f"DEBUG: Amount: Rs {economic_record.amount}")
-                print(f"DEBUG: Type: {economic_record.transaction_type}")
-                print(f"DEBUG: Paid: {economic_record.is_paid}")
-                print(f"DEBUG: User: {economic_record.user.username if economic_record.user else 'None'}")
-            else:
-                print(f"DEBUG: FAILED to create economic record!")
-            
-            # Create history record
-            ParkingHistory.objects.create(
-                vehicle_number=vehicle_number,
-                action='entered',
-                timestamp=timestamp,
-                booking=booking,
-                is_prebooked=booking is not None,
-                user=entry_user
-            )
-            
-            # Update cache immediately
-            update_parking_metrics()
-            
-            return {
-                'slot_number': slot.slot_number, 
-                'booking_id': booking.id if booking else None,
-                'ticket_id': ticket.id,
-                'receipt_number': f"R{ticket.id:05d}.2",  # Generate receipt number from ticket ID
-                'economic_record_id': economic_record.id if economic_record else None
-            }
-            
-    except Exception as e:
-        print(f"Error in process_manual_entry: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise ValueError(str(e))
-       
-def process_manual_exit(vehicle_number, user, timestamp):
-    """Process manual vehicle exit"""
-    try:
-        with transaction.atomic():
-            # Find active ticket
-            ticket = Ticket.objects.filter(
-                vehicle_number=vehicle_number,
-                exit_time__isnull=True
-            ).first()
-            
-            if not ticket:
-                raise ValueError("No active entry found for this vehicle")
-            
-            # Set exit time
-            ticket.exit_time = timestamp
-            ticket.save()
-            
-            # Free up the slot
-            if ticket.slot:
-                ticket.slot.is_occupied = False
-                ticket.slot.save()
-            
-            # Update booking if exists
-            if ticket.booking:
-                ticket.booking.status = 'completed'
-                ticket.booking.save()
-            
-            # Create simple history record with only basic fields
-            ParkingHistory.objects.create(
-                vehicle_number=vehicle_number,
-                action='exited',
-                timestamp=timestamp
-            )
-            
-            # Update cache immediately
-            update_parking_metrics()
-            
-            return {}
-            
-    except Exception as e:
-        raise ValueError(f"An error occurred during exit: {str(e)}")
-
 # ==============================
 # DASHBOARD AUTHENTICATION
 # ==============================
@@ -1243,11 +1248,9 @@ def create_booking(request):
                         'expire_time': expire_time,
                     })
                 
-                # Find available slot
-                slot = ParkingSlot.objects.filter(
-                    is_occupied=False,
-                    is_reserved=False
-                ).first()
+                # Find and lock an available slot
+                free_slots = ParkingSlot.lock_free_slots()
+                slot = free_slots[0] if free_slots else None
                 
                 if not slot:
                     messages.error(request, 'No available parking slots')
@@ -1256,7 +1259,7 @@ def create_booking(request):
                         'expire_time': expire_time,
                     })
                 
-                # Create booking
+                # Create booking (reserves the locked slot)
                 booking = Booking.objects.create(
                     vehicle_number=cleaned_vehicle_number,
                     start_time=current_time,
@@ -1267,10 +1270,6 @@ def create_booking(request):
                     vehicle_arrived=False
                 )
                 
-                # Reserve the slot
-                slot.is_reserved = True
-                slot.save()
-                
                 # Update cache immediately
                 update_parking_metrics()
                 
@@ -1338,9 +1337,7 @@ def booking_history(request):
         ).count()
     
     # Pagination
-    paginator = Paginator(bookings, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = keyset_page(request, bookings, 'booked_at', 10)
     
     context = {
         'bookings': page_obj,
@@ -1372,9 +1369,7 @@ def ticket_history(request):
             Q(slot__slot_number__icontains=search_query)
         )
     
-    paginator = Paginator(tickets, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = keyset_page(request, tickets, 'entry_time', 25)
     
     context = {
         'page_obj': page_obj,
@@ -1417,14 +1412,12 @@ def parking_logs(request):
             pass
 
     # Pagination
-    paginator = Paginator(logs, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = keyset_page(request, logs, 'timestamp', 25)
 
     # =================== ADD THESE STATISTICS ===================
     
-    # 1. Total logs (based on current filters)
-    total_logs = logs.count()
+    # 1. Total logs (based on current filters, estimated)
+    total_logs = page_obj.count
     
     # 2. Today's logs (unfiltered - all logs from today)
     today = timezone.now().date()
@@ -1466,7 +1459,8 @@ def get_ticket_details(request, ticket_id):
             'duration': str(ticket.duration) if ticket.duration else None,
             'fee_amount': str(ticket.fee_amount),
             'fee_paid': ticket.fee_paid,
-            'qr_code': ticket.qr_code.url if ticket.qr_code else None,
+            'qr_code': reverse('ticket_qr_code', args=[ticket.id]),
+            'artifact_status': ticket.artifact_status,
             'booking': {
                 'id': ticket.booking.id,
                 'status': ticket.booking.status,
@@ -1515,26 +1509,28 @@ def settings_view(request):
 @staff_member_required
 def export_tickets(request):
     """Export tickets to CSV"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="tickets.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Vehicle', 'Slot', 'Entry Time', 'Exit Time', 'Duration', 'Status'])
-    
-    tickets = Ticket.objects.all().order_by('-entry_time')
-    for ticket in tickets:
-        duration = (ticket.exit_time - ticket.entry_time) if ticket.exit_time else (timezone.now() - ticket.entry_time)
-        writer.writerow([
-            ticket.id,
-            ticket.vehicle_number,
-            ticket.slot.slot_number if ticket.slot else '-',
-            ticket.entry_time.strftime("%Y-%m-%d %H:%M"),
-            ticket.exit_time.strftime("%Y-%m-%d %H:%M") if ticket.exit_time else '-',
-            str(duration),
-            'Completed' if ticket.exit_time else 'Active'
-        ])
-    
-    return response
+    now = timezone.now()
+    tickets = Ticket.objects.order_by('-entry_time').values_list(
+        'id', 'vehicle_number', 'slot__slot_number', 'entry_time', 'exit_time'
+    ).iterator(chunk_size=CSV_CHUNK_SIZE)
+    
+    rows = (
+        [
+            ticket_id,
+            vehicle_number,
+            slot_number or '-',
+            entry_time.strftime("%Y-%m-%d %H:%M"),
+            exit_time.strftime("%Y-%m-%d %H:%M") if exit_time else '-',
+            str((exit_time or now) - entry_time),
+            'Completed' if exit_time else 'Active'
+        ]
+        for ticket_id, vehicle_number, slot_number, entry_time, exit_time in tickets
+    )
+    return streaming_csv_response(
+        'tickets.csv',
+        ['ID', 'Vehicle', 'Slot', 'Entry Time', 'Exit Time', 'Duration', 'Status'],
+        rows
+    )
 
 # ==============================
 # UTILITY VIEWS
@@ -1547,6 +1543,7 @@ def check_slots(request):
     return JsonResponse({'slots': metrics['slots']})
 
 @require_GET
+@rate_limit('check_availability')
 def check_availability(request):
     """Check slot availability for given time range"""
     try:
@@ -1564,6 +1561,7 @@ def check_availability(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
 
+@rate_limit('check_booking')
 def check_booking(request):
     """API endpoint to check for active bookings"""
     vehicle_number = request.GET.get('vehicle_number', '').strip()
@@ -1587,6 +1585,24 @@ def check_booking(request):
             'booking_exists': False
         })
 
+@login_required
+@staff_member_required
+def rate_limit_stats(request):
+    """Rejected request counts for the rate-limited public endpoints"""
+    return JsonResponse({'rejected': rejection_counts()})
+
+@login_required
+@staff_member_required
+@require_POST
+def export_parquet(request):
+    """Append ledger rows added since the last run to the Parquet analytics export"""
+    try:
+        exporter = LedgerExporter()
+        exported = exporter.run(request.POST.getlist('table') or None)
+    except (RuntimeError, ValueError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, 'exported': exported, 'watermarks': exporter.watermarks()})
+
 @login_required
 @staff_member_required
 def generate_receipt_pdf(request, ticket_id):
@@ -1667,7 +1683,7 @@ def generate_receipt_pdf(request, ticket_id):
 
 def create_economic_record(
     vehicle_number=None,
-    amount=30.00,
+    amount=None,
     transaction_type='entry_fee',
     ticket=None,
     booking=None,
@@ -1677,6 +1693,8 @@ def create_economic_record(
     is_paid=None
 ):
     """Create an economic record for financial tracking"""
+    if amount is None:
+        amount = get_tariff().entry_fee
     
     # Check if user has subscription and free entry available
     free_entry = False
@@ -1686,43 +1704,31 @@ def create_economic_record(
     if transaction_type not in ['subscription_payment', 'subscription_renewal']:
         if user and user.is_authenticated:
             try:
-                if hasattr(user, 'membership'):
-                    membership = user.membership
+                # Cached snapshot; only an available free entry touches the database
+                membership = get_membership(user.pk)
+                if membership is not None:
                     
                     # Only check for free entries on entry_fee transactions
                     if transaction_type == 'entry_fee':
                         # Check if user has active subscription
                         if membership.status == 'active':
-                            today = timezone.now().date()
-                            
-                            # Reset counter if it's a new day
-                            if membership.last_free_entry_date != today:
-                                membership.free_entries_used_today = 0
-                                membership.last_free_entry_date = today
-                                membership.save()
-                            
-                            # Check if free entry is available
-                            if membership.free_entries_used_today < 1:
-                                membership.free_entries_used_today += 1
-                                membership.save()
-                                
+                            # Same claim as the batch gate path
+                            if claim_free_entry(membership):
                                 amount = 0
                                 transaction_type = 'free_entry'
                                 payment_method = 'free'
                                 free_entry = True
                                 entry_user = user
+                                # Nothing is collected, whatever the caller expected
+                                is_paid = False
                                 
                         else:
-                            print(f"DEBUG: Membership not active. Status: {membership.status}")
+                            logger.debug("Membership for %s not active: %s", user.username, membership.status)
                 else:
-                    print(f"DEBUG: User {user.username} has no membership")
+                    logger.debug("User %s has no membership", user.username)
                     
-            except Exception as e:
-                print(f"DEBUG: Error checking membership: {e}")
-                import traceback
-                traceback.print_exc()
-        else:
-            print(f"DEBUG: No user or user not authenticated")
+            except Exception:
+                logger.exception("Error checking membership for %s", user.username)
     
     try:
         # Determine if the transaction is paid
@@ -1742,24 +1748,18 @@ def create_economic_record(
             # Don't include subscription_payment if the field doesn't exist
         )
         
-        print(f"✅ Created economic record:")
-        print(f"   ID: {economic_record.id}")
-        print(f"   Amount: Rs {amount}")
-        print(f"   Type: {transaction_type}")
-        print(f"   Paid: {is_paid}")
-        print(f"   User: {economic_record.user.username if economic_record.user else 'None'}")
-        print(f"   Vehicle: {vehicle_number}")
+        logger.debug(
+            "Created economic record %s: Rs %s %s paid=%s",
+            economic_record.id, amount, transaction_type, is_paid
+        )
         
         return economic_record
         
-    except Exception as e:
-        print(f"❌ Error creating economic record: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error creating economic record for %s", vehicle_number)
         
         # Try alternative approach if the first one fails
         try:
-            print("Trying alternative creation method...")
             
             # Create with minimal required fields
             economic_record = EconomicsReport(
@@ -1779,11 +1779,10 @@ def create_economic_record(
             
             economic_record.save()
             
-            print(f"✅ Created economic record via alternative method: {economic_record.id}")
             return economic_record
             
-        except Exception as e2:
-            print(f"❌ Alternative method also failed: {e2}")
+        except Exception:
+            logger.exception("Alternative economic record creation also failed")
             return None
               
 def create_subscription_economic_record(subscription_payment):
@@ -1818,32 +1817,24 @@ def create_subscription_economic_record(subscription_payment):
 def economics_dashboard(request):
     """Economics overview dashboard"""
     try:
-        # Calculate totals including subscription payments
-        total_revenue = EconomicsReport.objects.filter(is_paid=True).aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        # Separate calculations for different transaction types
-        entry_fee_revenue = EconomicsReport.objects.filter(
-            is_paid=True,
-            transaction_type__in=['entry_fee', 'free_entry']
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        booking_fee_revenue = EconomicsReport.objects.filter(
-            is_paid=True,
-            transaction_type='booking_fee'
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        subscription_revenue = EconomicsReport.objects.filter(
-            is_paid=True,
-            transaction_type__in=['subscription_payment', 'subscription_renewal']
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        today = timezone.now().date()
-        today_revenue = EconomicsReport.objects.filter(
-            is_paid=True,
-            transaction_date__date=today
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        # Every card comes from one conditional aggregate over the daily rollup
+        today = timezone.localdate()
+        paid = Q(is_paid=True)
+        entry_types = Q(transaction_type__in=['entry_fee', 'free_entry'])
+        booking_types = Q(transaction_type='booking_fee')
+        subscription_types = Q(transaction_type__in=['subscription_payment', 'subscription_renewal'])
+        cards = RevenueDailyRollup.objects.aggregate(
+            total_revenue=Sum('total_amount', filter=paid, default=0),
+            entry_fee_revenue=Sum('total_amount', filter=paid & entry_types, default=0),
+            booking_fee_revenue=Sum('total_amount', filter=paid & booking_types, default=0),
+            subscription_revenue=Sum('total_amount', filter=paid & subscription_types, default=0),
+            today_revenue=Sum('total_amount', filter=paid & Q(date=today), default=0),
+            entry_fee_count=Sum('transaction_count', filter=entry_types, default=0),
+            booking_fee_count=Sum('transaction_count', filter=booking_types, default=0),
+            subscription_count=Sum('transaction_count', filter=subscription_types, default=0),
+            today_count=Sum('transaction_count', filter=Q(date=today), default=0),
+            transaction_count=Sum('transaction_count', default=0),
+        )
         
         # Get ALL transactions for pagination
         all_transactions = EconomicsReport.objects.select_related(
@@ -1851,43 +1842,22 @@ def economics_dashboard(request):
         ).order_by('-transaction_date')
         
         # Paginate all transactions
-        paginator = Paginator(all_transactions, 10)  # 10 per page
-        page_number = request.GET.get('page', 1)
-        
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
-        
-        # Count transactions by type
-        transaction_count_by_type = {
-            'entry_fee': EconomicsReport.objects.filter(
-                transaction_type__in=['entry_fee', 'free_entry']
-            ).count(),
-            'booking_fee': EconomicsReport.objects.filter(
-                transaction_type='booking_fee'
-            ).count(),
-            'subscription': EconomicsReport.objects.filter(
-                transaction_type__in=['subscription_payment', 'subscription_renewal']
-            ).count(),
-        }
-        
-        today_count = EconomicsReport.objects.filter(
-            transaction_date__date=today
-        ).count()
+        page_obj = keyset_page(request, all_transactions, 'transaction_date', 10)  # 10 per page
         
         context = {
-            'total_revenue': total_revenue,
-            'today_revenue': today_revenue,
-            'entry_fee_revenue': entry_fee_revenue,
-            'booking_fee_revenue': booking_fee_revenue,
-            'subscription_revenue': subscription_revenue,
+            'total_revenue': cards['total_revenue'],
+            'today_revenue': cards['today_revenue'],
+            'entry_fee_revenue': cards['entry_fee_revenue'],
+            'booking_fee_revenue': cards['booking_fee_revenue'],
+            'subscription_revenue': cards['subscription_revenue'],
             'page_obj': page_obj,  # This contains paginated transactions
-            'transaction_count': EconomicsReport.objects.count(),
-            'transaction_count_by_type': transaction_count_by_type,
-            'today_count': today_count,
+            'transaction_count': cards['transaction_count'],
+            'transaction_count_by_type': {
+                'entry_fee': cards['entry_fee_count'],
+                'booking_fee': cards['booking_fee_count'],
+                'subscription': cards['subscription_count'],
+            },
+            'today_count': cards['today_count'],
         }
         
         return render(request, 'dashboard/economics_dashboard.html', context)
@@ -1916,13 +1886,12 @@ def economics_report(request):
         transactions = transactions.filter(transaction_type=transaction_type)
     
     # Calculate filtered totals
-    filtered_total = transactions.aggregate(total=Sum('amount'))['total'] or 0
-    filtered_count = transactions.count()
+    totals = transactions.aggregate(total=Sum('amount', default=0), count=Count('id'))
+    filtered_total = totals['total']
+    filtered_count = totals['count']
     
     # Pagination
-    paginator = Paginator(transactions, 25)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = keyset_page(request, transactions, 'transaction_date', 25)
     
     context = {
         'page_obj': page_obj,
@@ -1940,93 +1909,76 @@ def economics_report(request):
 @staff_member_required
 def export_economics_csv(request):
     """Export economics data to CSV"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="economics_report.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Type', 'Details', 'Amount (PKR)', 'Transaction Type', 
-                    'Payment Method', 'Customer/Vehicle', 'Email', 'Transaction Date', 'Status'])
-    
-    transactions = EconomicsReport.objects.select_related('user', 'subscription_payment').all().order_by('-transaction_date')  # Changed to transaction_date
-    
-    for transaction in transactions:
-        # Determine details based on transaction type
-        if transaction.transaction_type in ['subscription_payment', 'subscription_renewal']:
-            details = "Subscription Payment"
-            customer_info = transaction.user.get_full_name() if transaction.user else "N/A"
-            email = transaction.user.email if transaction.user else "N/A"
-        else:
-            details = transaction.vehicle_number or "N/A"
-            customer_info = transaction.user.username if transaction.user else "N/A"
-            email = transaction.user.email if transaction.user else "N/A"
-        
-        writer.writerow([
-            transaction.id,
-            'Subscription' if transaction.transaction_type in ['subscription_payment', 'subscription_renewal'] else 'Vehicle',
-            details,
-            transaction.amount,
-            transaction.get_transaction_type_display(),
-            transaction.get_payment_method_display(),
-            customer_info,
-            email,
-            transaction.transaction_date.strftime("%Y-%m-%d %H:%M"),  # Changed to transaction_date
-            'Paid' if transaction.is_paid else 'Pending'
-        ])
+    transaction_types = dict(EconomicsReport._meta.get_field('transaction_type').choices)
+    payment_methods = dict(EconomicsReport._meta.get_field('payment_method').choices)
+    subscription_types = ['subscription_payment', 'subscription_renewal']
+    
+    transactions = EconomicsReport.objects.order_by('-transaction_date').values_list(
+        'id', 'transaction_type', 'vehicle_number', 'amount', 'payment_method',
+        'transaction_date', 'is_paid',
+        'user__username', 'user__first_name', 'user__last_name', 'user__email'
+    ).iterator(chunk_size=CSV_CHUNK_SIZE)
+    
+    def rows():
+        for (record_id, transaction_type, vehicle_number, amount, payment_method,
+             transaction_date, is_paid, username, first_name, last_name, email) in transactions:
+            # Determine details based on transaction type
+            is_subscription = transaction_type in subscription_types
+            if is_subscription:
+                details = "Subscription Payment"
+                customer_info = f"{first_name} {last_name}".strip() if username else "N/A"
+            else:
+                details = vehicle_number or "N/A"
+                customer_info = username or "N/A"
+            
+            yield [
+                record_id,
+                'Subscription' if is_subscription else 'Vehicle',
+                details,
+                amount,
+                transaction_types.get(transaction_type, transaction_type),
+                payment_methods.get(payment_method, payment_method),
+                customer_info,
+                email if username else "N/A",
+                transaction_date.strftime("%Y-%m-%d %H:%M"),
+                'Paid' if is_paid else 'Pending'
+            ]
     
-    return response
+    return streaming_csv_response(
+        'economics_report.csv',
+        ['ID', 'Type', 'Details', 'Amount (PKR)', 'Transaction Type',
+         'Payment Method', 'Customer/Vehicle', 'Email', 'Transaction Date', 'Status'],
+        rows()
+    )
 
 @login_required
 @staff_member_required
 def economics_summary_api(request):
     """API endpoint for economics summary data"""
     try:
-        # Today's stats
-        today = timezone.now().date()
-        today_stats = EconomicsReport.objects.filter(
-            transaction_date__date=today,  # Changed to transaction_date
-            is_paid=True
-        ).aggregate(
-            total=Sum('amount'),
-            count=Count('id')
-        )
-        
-        # Weekly stats
-        week_ago = today - timedelta(days=7)
-        weekly_stats = EconomicsReport.objects.filter(
-            transaction_date__date__gte=week_ago,  # Changed to transaction_date
-            is_paid=True
-        ).aggregate(
-            total=Sum('amount'),
-            count=Count('id')
-        )
-        
-        # Monthly stats
-        month_ago = today - timedelta(days=30)
-        monthly_stats = EconomicsReport.objects.filter(
-            transaction_date__date__gte=month_ago,  # Changed to transaction_date
-            is_paid=True
-        ).aggregate(
-            total=Sum('amount'),
-            count=Count('id')
-        )
+        # Today, last 7 days, last 30 days and all time in one query
+        today = timezone.localdate()
+        paid = Q(is_paid=True)
+        periods = {
+            'today': Q(date=today),
+            'weekly': Q(date__gte=today - timedelta(days=7)),
+            'monthly': Q(date__gte=today - timedelta(days=30)),
+        }
+        aggregates = {'all_time_count': Sum('transaction_count', default=0)}
+        for name, period in {**periods, 'all_time': Q()}.items():
+            aggregates[f'{name}_revenue'] = Sum('total_amount', filter=paid & period, default=0)
+        for name, period in periods.items():
+            aggregates[f'{name}_count'] = Sum('transaction_count', filter=paid & period, default=0)
+        stats = RevenueDailyRollup.objects.aggregate(**aggregates)
         
         return JsonResponse({
             'status': 'success',
-            'today': {
-                'revenue': float(today_stats['total'] or 0),
-                'transactions': today_stats['count'] or 0
-            },
-            'weekly': {
-                'revenue': float(weekly_stats['total'] or 0),
-                'transactions': weekly_stats['count'] or 0
-            },
-            'monthly': {
-                'revenue': float(monthly_stats['total'] or 0),
-                'transactions': monthly_stats['count'] or 0
-            },
-            'all_time': {
-                'revenue': float(EconomicsReport.objects.filter(is_paid=True).aggregate(total=Sum('amount'))['total'] or 0),
-                'transactions': EconomicsReport.objects.count()
+            **{
+                name: {
+                    'revenue': float(stats[f'{name}_revenue']),
+                    'transactions': stats[f'{name}_count']
+                }
+                for name in ['today', 'weekly', 'monthly', 'all_time']
             }
         })
         
@@ -2036,26 +1988,84 @@ def economics_summary_api(request):
             'message': str(e)
         }, status=500)
         
+def parse_range_bound(value, is_end=False):
+    """Aware datetime for a ?start=/?end=/?at= value given as a date or datetime"""
+    day = parse_date(value)
+    if day is not None:
+        # A bare end date includes that whole day
+        moment = datetime.datetime.combine(day + timedelta(days=1 if is_end else 0), datetime.time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f'Invalid date: {value}')
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+@login_required
+@staff_member_required
+@require_GET
+def economics_timeseries_api(request):
+    """Revenue, ticket occupancy and slot occupancy (?series=revenue,occupancy,slots) at ?granularity=5min|hour|day"""
+    granularity = request.GET.get('granularity', 'hour')
+    names = request.GET.get('series', 'revenue,occupancy').split(',')
+    if granularity not in GRANULARITIES or not set(names) <= set(TIMESERIES):
+        return JsonResponse({'status': 'error', 'message': 'Unknown granularity or series'}, status=400)
+
+    try:
+        end = parse_range_bound(request.GET['end'], is_end=True) if request.GET.get('end') else timezone.now()
+        start = parse_range_bound(request.GET['start']) if request.GET.get('start') else end - timedelta(days=7)
+        # Align to whole buckets so repeated requests share cache entries
+        end = bucket_end(end - timedelta(microseconds=1), granularity)
+        start = timezone.make_aware(floor_bucket(start, granularity))
+        if start >= end:
+            raise ValueError('start must be before end')
+        series = {name: cached_series(name, start, end, granularity) for name in names}
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'granularity': granularity,
+        'timezone': timezone.get_current_timezone_name(),
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        **series,
+    })
+
+@login_required
+@staff_member_required
+@require_GET
+def lot_occupancy_api(request):
+    """State of every slot at ?at= (default: now), rebuilt from the slot timelines"""
+    try:
+        at = parse_range_bound(request.GET['at']) if request.GET.get('at') else timezone.now()
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    states = lot_state(at)
+    names = dict(SlotOccupancyTimeline.STATE_CHOICES)
+    counts = {name.lower(): 0 for name in names.values()}
+    for state in states.values():
+        counts[names[state].lower()] += 1
+    return JsonResponse({
+        'status': 'success',
+        'at': at.isoformat(),
+        **counts,
+        'occupancy_rate': round(counts['occupied'] / len(states) * 100, 1) if states else 0,
+        'slots': {slot_number: names[state].lower() for slot_number, state in states.items()},
+    })
+
 @login_required
 @staff_member_required
 def recent_transactions_api(request):
     """API endpoint for recent transactions (for AJAX if needed)"""
     try:
-        page = int(request.GET.get('page', 1))
-        per_page = int(request.GET.get('per_page', 10))
+        per_page = min(max(int(request.GET.get('per_page', 10)), 1), 100)
         
         transactions = EconomicsReport.objects.select_related(
             'ticket', 'booking', 'user'
         ).order_by('-transaction_date')
         
-        paginator = Paginator(transactions, per_page)
-        
-        try:
-            page_obj = paginator.page(page)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
+        page_obj = keyset_page(request, transactions, 'transaction_date', per_page)
         
         data = []
         for t in page_obj:
@@ -2082,13 +2092,11 @@ def recent_transactions_api(request):
         return JsonResponse({
             "status": "success",
             "transactions": data,
-            "current_page": page_obj.number,
-            "total_pages": paginator.num_pages,
-            "total_count": paginator.count,
-            "has_previous": page_obj.has_previous(),
-            "has_next": page_obj.has_next(),
-            "previous_page": page_obj.previous_page_number() if page_obj.has_previous() else None,
-            "next_page": page_obj.next_page_number() if page_obj.has_next() else None,
+            "approximate_count": page_obj.count if request.GET.get('count') else None,
+            "has_previous": page_obj.has_previous,
+            "has_next": page_obj.has_next,
+            "previous_cursor": page_obj.previous_cursor,
+            "next_cursor": page_obj.next_cursor,
         })
         
     except Exception as e:
@@ -2360,98 +2368,33 @@ def payment_cancelled(request):
 @csrf_exempt
 @require_POST
 def stripe_webhook(request):
+    """Verify and store a Stripe event, then acknowledge it straight away.
+
+    Events are applied by ``run_stripe_worker``, so slow processing can't
+    make Stripe time out and redeliver; redeliveries of a stored event are
+    acknowledged without being stored again.
+    """
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     
-    print(f"Webhook received! Headers: {dict(request.META)}")
-    print(f"Payload length: {len(payload)}")
-    
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
-        print(f"✅ Webhook verified! Event type: {event['type']}")
-        
-    except ValueError as e:
-        print(f"❌ Invalid payload: {e}")
-        return HttpResponse(status=400)
-    except stripe.error.SignatureVerificationError as e:
-        print(f"❌ Invalid signature: {e}")
+    except ValueError:
+        logger.warning("Stripe webhook with invalid payload")
         return HttpResponse(status=400)
-    except Exception as e:
-        print(f"❌ Other error: {e}")
+    except stripe.error.SignatureVerificationError:
+        logger.warning("Stripe webhook with invalid signature")
         return HttpResponse(status=400)
     
-    # Handle the event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        print(f"✅ Checkout completed! Session ID: {session['id']}")
-        print(f"   Customer: {session.get('customer')}")
-        print(f"   Subscription: {session.get('subscription')}")
-        print(f"   Payment status: {session.get('payment_status')}")
-        
-    elif event['type'] == 'customer.subscription.created':
-        subscription = event['data']['object']
-        print(f"✅ Subscription created! ID: {subscription['id']}")
-        print(f"   Status: {subscription['status']}")
-        
-    elif event['type'] == 'customer.subscription.updated':
-        subscription = event['data']['object']
-        print(f"📝 Subscription updated! ID: {subscription['id']}")
-        print(f"   Status: {subscription['status']}")
-        
-    elif event['type'] == 'customer.subscription.deleted':
-        subscription = event['data']['object']
-        print(f"🗑️ Subscription deleted! ID: {subscription['id']}")
-        
-    else:
-        print(f"ℹ️ Unhandled event type: {event['type']}")
+    # Store the body exactly as Stripe signed it
+    event, created = StripeEvent.record(json.loads(payload))
+    if not created:
+        logger.info("Duplicate Stripe event %s ignored", event.event_id)
     
     return HttpResponse(status=200)
 
-def handle_subscription_update(subscription):
-    """Update UserMembership when subscription changes"""
-    try:
-        membership = UserMembership.objects.get(
-            stripe_subscription_id=subscription.id
-        )
-        
-        membership.status = subscription.status
-        membership.current_period_start = datetime.fromtimestamp(
-            subscription.current_period_start
-        )
-        membership.current_period_end = datetime.fromtimestamp(
-            subscription.current_period_end
-        )
-        membership.cancel_at_period_end = subscription.cancel_at_period_end
-        membership.save()
-        
-    except UserMembership.DoesNotExist:
-        pass
-
-def handle_subscription_cancellation(subscription):
-    """Handle subscription cancellation"""
-    try:
-        membership = UserMembership.objects.get(
-            stripe_subscription_id=subscription.id
-        )
-        
-        membership.status = 'canceled'
-        membership.save()
-        
-    except UserMembership.DoesNotExist:
-        pass
-
-
-def safe_from_timestamp(timestamp):
-    """Safely convert timestamp to datetime, return None if invalid"""
-    if timestamp:
-        try:
-            return datetime.fromtimestamp(timestamp)
-        except (TypeError, ValueError):
-            return None
-    return None
-
 
 # ==============================
 # STAFF MANAGEMENT (ADMIN)
@@ -2770,7 +2713,7 @@ def system_logs(request):
     ).distinct().order_by('username')
     
     # Get statistics
-    total_logs = logs.count()
+    total_logs = approximate_count(logs)
     today_logs = UserActivityLog.objects.filter(
         timestamp__date=timezone.now().date()
     ).count()
@@ -2861,9 +2804,7 @@ def system_logs(request):
             })
     
     # Pagination
-    paginator = Paginator(logs, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = keyset_page(request, logs, 'timestamp', 50)
     
     context = {
         'page_obj': page_obj,
@@ -2885,64 +2826,62 @@ def system_logs(request):
 @staff_member_required
 def export_system_logs_csv(request):
     """Export system logs to CSV"""
-    import csv
-    from django.http import HttpResponse
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="system_logs.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'ID', 'Timestamp', 'Event Type', 'Severity', 'User', 
-        'Username', 'Action', 'Details', 'IP Address', 'User Agent'
-    ])
-    
-    logs = UserActivityLog.objects.all().order_by('-timestamp')
-    
-    for log in logs:
-        # Determine event type and severity from action
-        action_lower = log.action.lower()
-        
-        # Event type detection
-        event_type = 'Application'
-        if any(word in action_lower for word in ['login', 'logout', 'password', 'auth']):
-            event_type = 'Authentication'
-        elif any(word in action_lower for word in ['security', 'failed', 'attempt', 'unauthorized']):
-            event_type = 'Security'
-        elif any(word in action_lower for word in ['system', 'clear', 'export', 'maintenance']):
-            event_type = 'System'
-        elif any(word in action_lower for word in ['admin', 'staff', 'reset', 'permission']):
-            event_type = 'Administrative'
-        elif any(word in action_lower for word in ['database', 'delete', 'clean']):
-            event_type = 'Database'
-        elif any(word in action_lower for word in ['performance', 'slow', 'timeout']):
-            event_type = 'Performance'
-        elif any(word in action_lower for word in ['api', 'stripe', 'payment', 'webhook']):
-            event_type = 'Integration'
-        
-        # Severity detection
-        severity = 'Info'
-        if any(word in action_lower for word in ['critical', 'fatal']):
-            severity = 'Critical'
-        elif any(word in action_lower for word in ['error', 'failed', 'exception']):
-            severity = 'Error'
-        elif any(word in action_lower for word in ['warning', 'alert']):
-            severity = 'Warning'
-        
-        writer.writerow([
-            log.id,
-            log.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            event_type,
-            severity,
-            log.user.get_full_name() if log.user else 'Anonymous',
-            log.user.username if log.user else '',
-            log.action,
-            log.details[:500] if log.details else '',
-            log.ip_address or '',
-            log.user_agent or ''
-        ])
+    logs = UserActivityLog.objects.order_by('-timestamp').values_list(
+        'id', 'timestamp', 'action', 'details', 'ip_address', 'user_agent',
+        'user__username', 'user__first_name', 'user__last_name'
+    ).iterator(chunk_size=CSV_CHUNK_SIZE)
+    
+    def rows():
+        for (log_id, timestamp, action, details, ip_address, user_agent,
+             username, first_name, last_name) in logs:
+            # Determine event type and severity from action
+            action_lower = action.lower()
+        
+            # Event type detection
+            event_type = 'Application'
+            if any(word in action_lower for word in ['login', 'logout', 'password', 'auth']):
+                event_type = 'Authentication'
+            elif any(word in action_lower for word in ['security', 'failed', 'attempt', 'unauthorized']):
+                event_type = 'Security'
+            elif any(word in action_lower for word in ['system', 'clear', 'export', 'maintenance']):
+                event_type = 'System'
+            elif any(word in action_lower for word in ['admin', 'staff', 'reset', 'permission']):
+                event_type = 'Administrative'
+            elif any(word in action_lower for word in ['database', 'delete', 'clean']):
+                event_type = 'Database'
+            elif any(word in action_lower for word in ['performance', 'slow', 'timeout']):
+                event_type = 'Performance'
+            elif any(word in action_lower for word in ['api', 'stripe', 'payment', 'webhook']):
+                event_type = 'Integration'
+        
+            # Severity detection
+            severity = 'Info'
+            if any(word in action_lower for word in ['critical', 'fatal']):
+                severity = 'Critical'
+            elif any(word in action_lower for word in ['error', 'failed', 'exception']):
+                severity = 'Error'
+            elif any(word in action_lower for word in ['warning', 'alert']):
+                severity = 'Warning'
+        
+            yield [
+                log_id,
+                timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                event_type,
+                severity,
+                f"{first_name} {last_name}".strip() if username else 'Anonymous',
+                username or '',
+                action,
+                details[:500] if details else '',
+                ip_address or '',
+                user_agent or ''
+            ]
     
-    return response
+    return streaming_csv_response(
+        'system_logs.csv',
+        ['ID', 'Timestamp', 'Event Type', 'Severity', 'User',
+         'Username', 'Action', 'Details', 'IP Address', 'User Agent'],
+        rows()
+    )
 
 @login_required
 @staff_member_required
@@ -158,4 +158,70 @@ import os
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
-STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+
+# Booking reference numbers each worker reserves at a time from the counter row
+BOOKING_ID_BLOCK_SIZE = int(os.getenv("BOOKING_ID_BLOCK_SIZE", "1"))
+
+# Render booking slips and QR codes in the background on create instead of
+# on first download
+PRERENDER_ARTIFACTS = os.getenv("PRERENDER_ARTIFACTS", "0") == "1"
+
+# Shared cache for rate limiting; falls back to per-process memory (tests,
+# local dev) when REDIS_URL isn't set
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Token buckets per client (user, else IP): (burst size, requests per minute)
+RATE_LIMITS = {
+    "book_slot": (5, 10),
+    "check_availability": (20, 60),
+    "check_booking": (10, 30),
+    "check_vehicle_status": (10, 30),
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "simple"},
+    },
+    "loggers": {
+        "app": {"handlers": ["console"], "level": os.getenv("APP_LOG_LEVEL", "INFO")},
+    },
+}
+
+# Local SQLite log that buffers gate entries/exits while the database is
+# unreachable; drained by the replay_gate_queue command
+GATE_QUEUE_PATH = os.getenv("GATE_QUEUE_PATH", str(BASE_DIR / "gate_queue.sqlite3"))
+
+# Month-partitioned Parquet copies of the ledgers for analytics; written by
+# the export_parquet command (see app.utils.parquet_export)
+ANALYTICS_EXPORT_DIR = os.getenv("ANALYTICS_EXPORT_DIR", str(BASE_DIR / "analytics_export"))
+
+# Parking tariff (PKR); see app.utils.pricing.Tariff. peak_hours are local
+# (start_hour, end_hour) pairs billed at peak_hourly_rate when it is set.
+PARKING_TARIFF = {
+    "entry_fee": "30.00",
+    "first_hour": "2.00",
+    "hourly_rate": "1.00",
+    "peak_hourly_rate": None,
+    "peak_hours": [(8, 10), (17, 19)],
+    "grace_minutes": 0,
+    "daily_cap": None,
+    "member_discount_percent": 0,
+}